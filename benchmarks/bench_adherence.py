@@ -0,0 +1,53 @@
+#nightly adherence job against postgres: seeds a month of history (benchmarks.datagen) for every user, gives
+#them all targets, then times evaluate_adherence with each worker count, the chunk markers cleared between
+#runs. users/s should grow close to linearly with the workers up to the number of cores (and of chunks).
+#point POSTGRES_DB at a scratch database, the tables are dropped first
+#usage: python -m benchmarks.bench_adherence [users] [chunk size] [workers ...]
+import sys, datetime, itertools, os, time
+
+from sqlalchemy import create_engine, delete, insert
+from sqlalchemy.orm import Session
+
+from benchmarks import datagen
+from nutrition_logger.adherence import evaluate_adherence
+from nutrition_logger.bootstrap import bootstrap
+from nutrition_logger.config import database_url
+from nutrition_logger.meals import log_entries
+from nutrition_logger.models import Base, User, Food, Target, AdherenceChunk
+
+AS_OF = datetime.date(2024, 12, 31)
+
+def seed(engine, size):
+    with engine.begin() as connection:
+        user_ids = list(connection.scalars(insert(User).returning(User.id, sort_by_parameter_order=True), datagen.users(size)))
+        food_ids = list(connection.scalars(insert(Food).returning(Food.id, sort_by_parameter_order=True), datagen.foods(size)))
+        connection.execute(insert(Target), [{"user_id": user_id, "calories": 2000, "protein": 120, "carbs": 250, "fat": 70} for user_id in user_ids])
+    items = datagen.entries(size, user_ids, food_ids, AS_OF)
+    with Session(engine) as session:
+        while batch := list(itertools.islice(items, 5_000)):
+            log_entries(session, batch)
+            session.commit()
+
+def main(users=20_000, chunk_size=500, *workers):
+    workers = workers or sorted({1, 2, 4, os.cpu_count() or 1})
+    engine = create_engine(database_url())
+    Base.metadata.drop_all(engine)
+    bootstrap(engine)
+    size = datagen.DataSize(users=users, foods=1_000, years=31 / 365)
+    start = time.perf_counter()
+    seed(engine, size)
+    print(f"seeded {users} users x {size.days} days in {time.perf_counter() - start:.1f}s, {os.cpu_count()} cores")
+
+    baseline = None
+    for count in workers:
+        with engine.begin() as connection:
+            connection.execute(delete(AdherenceChunk))
+        start = time.perf_counter()
+        report = evaluate_adherence(engine, AS_OF, chunk_size, count)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{count:>3} workers {report.chunks:>5} chunks {report.users / elapsed:10,.0f} users/s {elapsed:7.2f}s speedup over the first {baseline / elapsed:5.2f}x")
+    engine.dispose()
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
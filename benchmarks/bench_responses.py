@@ -0,0 +1,77 @@
+#per-response cost of the depth-bounded schemas on an embedded database, against the same shape
+#serialized with plain from_attributes models that lazy-load as they go. The recursive DailyLogResponse
+#is not measured: log -> user -> logs -> user ... never terminates
+#usage: python -m benchmarks.bench_responses [days] [entries per day]
+import sys, time, datetime
+
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session
+
+from nutrition_logger.models import Base, User, Food, DailyLog, FoodEntry
+from typing import List
+from pydantic import BaseModel, ConfigDict
+
+from nutrition_logger.schema import DailyLogDetail, DailyLogWithFoods, FoodResponse
+
+class LazyEntry(BaseModel):
+    id: int
+    daily_log_id: int
+    food_id: int
+    quantity: float
+    food: FoodResponse
+
+    model_config = ConfigDict(from_attributes=True)
+
+class LazyLog(BaseModel):
+    id: int
+    user_id: int
+    date: datetime.date
+    food_entries: List[LazyEntry]
+
+    model_config = ConfigDict(from_attributes=True)
+
+def seed(session, days, entries):
+    user = User(username="bench", email="bench@example.com")
+    foods = [Food(name=f"food {i}", manufacturer="bench", serving_size=100, unit="g", calories=100 + i, protein=1, carbs=2, fat=3) for i in range(entries)]
+    start = datetime.date(2024, 1, 1)
+    for day in range(days):
+        log = DailyLog(user=user, date=start + datetime.timedelta(days=day))
+        log.food_entries = [FoodEntry(food=food, quantity=1 + i % 3) for i, food in enumerate(foods)]
+    session.add(user)
+    session.commit()
+
+def measure(engine, name, build):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    with Session(engine) as session:
+        event.listen(engine, "before_cursor_execute", listener)
+        start = time.perf_counter()
+        payloads = build(session)
+        elapsed = time.perf_counter() - start
+        event.remove(engine, "before_cursor_execute", listener)
+    size = sum(len(payload) for payload in payloads)
+    print(f"{name:<20} {elapsed / len(payloads) * 1e6:9.1f} us/response {len(statements):5d} queries {size / len(payloads):9.0f} bytes/response")
+
+def main(days=30, entries=10):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        seed(session, days, entries)
+
+    def bounded(model):
+        def build(session):
+            logs = session.scalars(select(DailyLog).options(*model.loader_options())).all()
+            return [model.model_validate(log).model_dump_json() for log in logs]
+        return build
+
+    def lazy(session):
+        logs = session.scalars(select(DailyLog)).all()
+        return [LazyLog.model_validate(log).model_dump_json() for log in logs]
+
+    print(f"{days} logs x {entries} entries")
+    measure(engine, "lazy loading", lazy)
+    measure(engine, "DailyLogDetail", bounded(DailyLogDetail))
+    measure(engine, "DailyLogWithFoods", bounded(DailyLogWithFoods))
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
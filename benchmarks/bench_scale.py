@@ -0,0 +1,166 @@
+#production-sized benchmark: seeds a deterministic history (benchmarks.datagen) and measures insert
+#throughput, totals latency, food search and response serialization, results go to a JSON file.
+#runs on an embedded sqlite database by default, --postgres uses the POSTGRES_* settings instead
+#(point POSTGRES_DB at a scratch database, the tables are dropped first)
+#usage: python -m benchmarks.bench_scale [--users N] [--foods N] [--years N] [--entries N] [--seed N] [--postgres | --url URL] [--output FILE]
+#       python -m benchmarks.bench_scale compare OLD.json NEW.json
+import argparse, datetime, itertools, json, platform, random, statistics, sys, time
+
+import sqlalchemy
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from benchmarks import datagen
+from nutrition_logger.bootstrap import bootstrap
+from nutrition_logger.config import database_url
+from nutrition_logger.meals import log_entries
+from nutrition_logger.models import Base, User, Food, DailyLog
+from nutrition_logger.schema import DailyLogDetail, DailyLogWithFoods, UserDetail
+from nutrition_logger.search import FoodSearchIndex, search_foods
+from nutrition_logger.totals import daily_totals, log_totals, range_totals, stored_daily_totals
+
+END = datetime.date(2024, 12, 31)
+BATCH = 2_000
+
+def throughput(rows, seconds):
+    return {"rows": rows, "seconds": round(seconds, 3), "rows_per_s": round(rows / seconds) if seconds else None}
+
+def latency(durations):
+    durations = sorted(durations)
+    return {
+        "n": len(durations),
+        "mean_ms": round(statistics.fmean(durations) * 1e3, 3),
+        "p50_ms": round(durations[len(durations) // 2] * 1e3, 3),
+        "p95_ms": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1e3, 3),
+    }
+
+def measure(run, cases):
+    durations = []
+    for case in cases:
+        start = time.perf_counter()
+        run(case)
+        durations.append(time.perf_counter() - start)
+    return latency(durations)
+
+def seed(engine, size):
+    results = {}
+    with engine.begin() as connection:
+        start = time.perf_counter()
+        user_ids = list(connection.scalars(insert(User).returning(User.id, sort_by_parameter_order=True), datagen.users(size)))
+        results["insert_users"] = throughput(len(user_ids), time.perf_counter() - start)
+        start = time.perf_counter()
+        food_ids = list(connection.scalars(insert(Food).returning(Food.id, sort_by_parameter_order=True), datagen.foods(size)))
+        results["insert_foods"] = throughput(len(food_ids), time.perf_counter() - start)
+
+    #the bulk logging path, logs upserted and daily_totals maintained as the app does it
+    rows, elapsed = 0, 0.0
+    items = datagen.entries(size, user_ids, food_ids, END)
+    with Session(engine) as session:
+        while batch := list(itertools.islice(items, BATCH)):
+            start = time.perf_counter()
+            log_entries(session, batch)
+            session.commit()
+            elapsed += time.perf_counter() - start
+            rows += len(batch)
+    results["insert_entries"] = throughput(rows, elapsed)
+    return results, user_ids, food_ids
+
+def run_queries(engine, size, user_ids, food_ids, samples):
+    rng = random.Random(size.seed + 2)
+    results = {}
+    with Session(engine) as session:
+        log_ids = list(session.scalars(select(DailyLog.id)))
+        logs = rng.sample(log_ids, min(samples, len(log_ids)))
+        users = [rng.choice(user_ids) for _ in range(samples)]
+        month = (END - datetime.timedelta(days=29), END)
+        year = (END - datetime.timedelta(days=364), END)
+
+        results["log_totals"] = measure(lambda log_id: log_totals(session, log_id), logs)
+        results["daily_totals_30d"] = measure(lambda user_id: daily_totals(session, user_id, *month), users)
+        results["stored_daily_totals_30d"] = measure(lambda user_id: stored_daily_totals(session, user_id, *month), users)
+        results["range_totals_365d"] = measure(lambda user_id: range_totals(session, user_id, *year), users)
+
+        names = [name for name, in session.execute(select(Food.name).where(Food.id.in_(rng.sample(food_ids, min(samples, len(food_ids))))))]
+        queries = [name.split()[1][:3] if i % 2 else " ".join(name.split()[:2]) for i, name in enumerate(names)]
+        results["search_foods"] = measure(lambda query: search_foods(session, query), queries)
+        start = time.perf_counter()
+        index = FoodSearchIndex().load(session)
+        results["search_index_load"] = {"seconds": round(time.perf_counter() - start, 3), "foods": len(index)}
+        results["search_index"] = measure(lambda query: index.search(query), queries)
+
+        def serialize(model, stmt):
+            def run(ids):
+                session.expunge_all()
+                objects = session.scalars(stmt.where(model.orm_class.id.in_(ids)).options(*model.loader_options())).all()
+                return [model.model_validate(obj).model_dump_json() for obj in objects]
+            return run
+        pages = [logs[i:i + 50] for i in range(0, len(logs), 50)]
+        results["serialize_log_detail_50"] = measure(serialize(DailyLogDetail, select(DailyLog)), pages)
+        results["serialize_log_with_foods_50"] = measure(serialize(DailyLogWithFoods, select(DailyLog)), pages)
+        results["serialize_user_detail"] = measure(serialize(UserDetail, select(User)), [[user_id] for user_id in users[:20]])
+    return results
+
+def run(args):
+    size = datagen.DataSize(args.users, args.foods, args.years, args.entries, args.seed)
+    url = args.url or (database_url() if args.postgres else "sqlite://")
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    bootstrap(engine)
+
+    results, user_ids, food_ids = seed(engine, size)
+    results.update(run_queries(engine, size, user_ids, food_ids, args.samples))
+    report = {
+        "meta": {
+            "dialect": engine.dialect.name,
+            "size": size._asdict(),
+            "samples": args.samples,
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "platform": platform.platform(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+    engine.dispose()
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    for name, result in results.items():
+        print(f"{name:<28} {json.dumps(result)}")
+    print(f"results written to {args.output}")
+
+#relative change of every headline number, latencies by p50, throughput by rows/s
+def compare(old_path, new_path):
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+    if old["meta"]["size"] != new["meta"]["size"] or old["meta"]["dialect"] != new["meta"]["dialect"]:
+        print("warning: runs used different sizes or databases", file=sys.stderr)
+    for name, result in new["results"].items():
+        before = old["results"].get(name)
+        key = next((key for key in ("p50_ms", "rows_per_s", "seconds") if key in result), None)
+        if before is None or key is None or not before.get(key):
+            continue
+        change = (result[key] - before[key]) / before[key] * 100
+        print(f"{name:<28} {key:<10} {before[key]:>12} -> {result[key]:<12} {change:+7.1f}%")
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["compare"]:
+        return compare(*argv[1:3])
+    parser = argparse.ArgumentParser(prog="benchmarks.bench_scale")
+    defaults = datagen.DataSize()
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--foods", type=int, default=defaults.foods)
+    parser.add_argument("--years", type=float, default=defaults.years)
+    parser.add_argument("--entries", type=int, default=defaults.entries_per_day, help="average entries per logged day")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--samples", type=int, default=200, help="queries per latency measurement")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--postgres", action="store_true", help="use the database from the POSTGRES_* settings")
+    target.add_argument("--url", help="any sqlalchemy url, defaults to an in-memory sqlite database")
+    parser.add_argument("--output", default="bench_scale.json")
+    run(parser.parse_args(argv))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+#cold import cost of the application modules in fresh interpreters, with an audit hook counting
+#socket connections and .env reads during the import, both must be zero. The first connection
+#is timed separately, that is where the database round trip now happens
+#usage: python -m benchmarks.bench_startup [runs]
+import json, statistics, subprocess, sys
+
+PROBE = """
+import json, sys, time
+events = {"socket.connect": 0, "dotenv": 0}
+def hook(event, args):
+    if event == "socket.connect":
+        events["socket.connect"] += 1
+    elif event == "open" and isinstance(args[0], str) and args[0].endswith(".env"):
+        events["dotenv"] += 1
+sys.addaudithook(hook)
+start = time.perf_counter()
+import nutrition_logger.main, nutrition_logger.api
+imported = time.perf_counter() - start
+io = dict(events)
+connect = None
+if "--connect" in sys.argv:
+    start = time.perf_counter()
+    nutrition_logger.main.get_engine().connect().close()
+    connect = time.perf_counter() - start
+print(json.dumps({"import": imported, "io": io, "connect": connect}))
+"""
+
+def probe(connect):
+    args = [sys.executable, "-c", PROBE] + (["--connect"] if connect else [])
+    return json.loads(subprocess.run(args, check=True, capture_output=True, text=True).stdout)
+
+def main(runs=5, connect=True):
+    results = [probe(connect) for _ in range(runs)]
+    io = {event: max(result["io"][event] for result in results) for event in results[0]["io"]}
+    print(f"import nutrition_logger.main + api  {statistics.median(r['import'] for r in results) * 1e3:8.1f} ms median of {runs}")
+    print(f"I/O during import                   {io}")
+    if connect:
+        print(f"first connection                    {statistics.median(r['connect'] for r in results) * 1e3:8.1f} ms")
+    if any(io.values()):
+        sys.exit("importing did I/O")
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
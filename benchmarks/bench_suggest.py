@@ -0,0 +1,60 @@
+#"foods that fit my remaining macros" at catalog scale: builds a NutrientIndex over random foods and
+#times top-k queries against a full NumPy scan of the same matrix, then a burst of incremental updates
+#usage: python -m benchmarks.bench_suggest [foods] [queries] [k]
+import sys, time
+
+import numpy as np
+
+from nutrition_logger.suggest import WEIGHTS, NutrientIndex
+
+def catalog(count, rng):
+    protein, carbs, fat = rng.uniform(0, 40, count), rng.uniform(0, 100, count), rng.uniform(0, 50, count)
+    calories = 4 * protein + 4 * carbs + 9 * fat
+    return np.arange(1, count + 1, dtype=np.int64), np.column_stack((calories, protein, carbs, fat))
+
+#a day's target minus a random share of it
+def remaining(rng):
+    left = rng.uniform(0.05, 0.6)
+    return [2000 * left, 120 * left, 250 * left, 70 * left]
+
+def scan(points, query, k):
+    distances = ((points - np.asarray(query) * WEIGHTS) ** 2).sum(axis=1)
+    return np.argpartition(distances, k)[:k]
+
+def report(name, durations):
+    durations = sorted(durations)
+    p50, p99 = durations[len(durations) // 2], durations[int(len(durations) * 0.99)]
+    print(f"{name:<28} p50 {p50 * 1000:8.3f} ms p99 {p99 * 1000:8.3f} ms")
+
+def timed(run, cases):
+    durations = []
+    for case in cases:
+        start = time.perf_counter()
+        run(case)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def main(foods=1_000_000, queries=200, k=10):
+    rng = np.random.default_rng(1)
+    ids, macros = catalog(foods, rng)
+    index = NutrientIndex()
+    start = time.perf_counter()
+    index.build(ids, macros * WEIGHTS)
+    print(f"{foods} foods, build {time.perf_counter() - start:.2f}s, {len(index.starts) - 1} leaves")
+
+    cases = [remaining(rng) for _ in range(queries)]
+    points = np.ascontiguousarray(macros * WEIGHTS)
+    report("numpy scan", timed(lambda query: scan(points, query, k), cases))
+    report("index nearest", timed(lambda query: index.nearest(query, k), cases))
+    report("index nearest, fits", timed(lambda query: index.nearest(query, k, fits=True), cases))
+    report("index nearest, 2 macros", timed(lambda query: index.nearest([query[0], query[1], None, None], k), cases))
+
+    changed = rng.integers(1, foods + 1, 5_000)
+    start = time.perf_counter()
+    for food_id in changed:
+        index.put(int(food_id), *catalog(1, rng)[1][0])
+    print(f"5000 updates {time.perf_counter() - start:.2f}s, {len(index.pending)} pending")
+    report("index nearest, after updates", timed(lambda query: index.nearest(query, k), cases))
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
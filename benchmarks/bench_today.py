@@ -0,0 +1,80 @@
+#concurrent "log to today" against postgres: threads race to add the first entry of a new day for
+#the same user. naive looks the log up, inserts it when missing and on a _user_date_uc violation rolls
+#back and retries, upsert is meals.log_entry. reports aborted transactions and committed writes/second
+#usage: python -m benchmarks.bench_today [threads] [days]
+import sys, threading, time, datetime
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.bootstrap import bootstrap
+from nutrition_logger.config import database_url
+from nutrition_logger.meals import log_entry
+from nutrition_logger.models import User, Food, DailyLog, FoodEntry
+
+def naive_log_entry(session, user_id, food_id, date):
+    log = session.scalar(select(DailyLog).where(DailyLog.user_id == user_id, DailyLog.date == date))
+    if log is None:
+        log = DailyLog(user_id=user_id, date=date)
+        session.add(log)
+    session.add(FoodEntry(daily_log=log, food_id=food_id, quantity=1))
+    session.commit()
+
+def upsert_log_entry(session, user_id, food_id, date):
+    log_entry(session, user_id, food_id, 1, date)
+    session.commit()
+
+def run(Session, write, user_id, food_id, threads, days):
+    barrier = threading.Barrier(threads)
+    aborted = [0]
+    lock = threading.Lock()
+
+    def worker():
+        for day in range(days):
+            date = datetime.date(2000, 1, 1) + datetime.timedelta(days=day)
+            barrier.wait()
+            while True:
+                with Session() as session:
+                    try:
+                        write(session, user_id, food_id, date)
+                        break
+                    except IntegrityError:
+                        session.rollback()
+                        with lock:
+                            aborted[0] += 1
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - start, aborted[0]
+
+def main(threads=16, days=50):
+    engine = create_engine(database_url(), pool_size=threads)
+    bootstrap(engine)
+    Session = sessionmaker(bind=engine)
+
+    print(f"{threads} threads x {days} new days")
+    for name, write in [("naive + retry", naive_log_entry), ("upsert", upsert_log_entry)]:
+        with Session() as session:
+            user = User(username="bench_today", email="bench_today@example.com")
+            food = Food(name="bench_today", manufacturer="bench", serving_size=1, unit="g", calories=1, protein=1, carbs=1, fat=1)
+            session.add_all([user, food])
+            session.commit()
+            user_id, food_id = user.id, food.id
+
+        elapsed, aborted = run(Session, write, user_id, food_id, threads, days)
+        print(f"{name:<14} {threads * days / elapsed:8.0f} writes/s {aborted:6d} aborted transactions")
+
+        with Session() as session:
+            session.delete(session.get(User, user_id))
+            session.flush()
+            session.delete(session.get(Food, food_id))
+            session.commit()
+    engine.dispose()
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,55 @@
+#objects per second through the schema.py models: payloads one model_validate call at a time against
+#validate_many (one cached TypeAdapter per model), and depth-bounded responses built with
+#model_validate(from_attributes) against LoadedResponse.trusted, on logs loaded from an embedded database
+#usage: python -m benchmarks.bench_validation [payloads] [days] [entries per day]
+import sys, time
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from nutrition_logger.models import Base, DailyLog
+from nutrition_logger.schema import DailyLogWithFoods, FoodCreate, FoodEntryCreate, validate_many
+
+from benchmarks.bench_responses import seed
+
+def food_payloads(count):
+    return [
+        {"name": f"food {i}", "manufacturer": "bench", "serving_size": 100, "unit": "g", "calories": 100 + i % 50, "protein": 1, "carbs": 2, "fat": 3}
+        for i in range(count)
+    ]
+
+def entry_payloads(count):
+    return [{"daily_log_id": 1 + i % 30, "food_id": 1 + i % 500, "quantity": 1 + i % 3} for i in range(count)]
+
+def measure(name, count, build, repeat=5):
+    best = min(_timed(build) for _ in range(repeat))
+    print(f"{name:<40} {count / best:12,.0f} objects/s")
+
+def _timed(build):
+    start = time.perf_counter()
+    build()
+    return time.perf_counter() - start
+
+def main(payloads=20_000, days=30, entries=20):
+    for model, items in ((FoodCreate, food_payloads(payloads)), (FoodEntryCreate, entry_payloads(payloads))):
+        print(f"{payloads} {model.__name__} payloads")
+        measure("  model_validate per item", payloads, lambda: [model.model_validate(item) for item in items])
+        measure("  validate_many", payloads, lambda: validate_many(model, items))
+        broken = [dict(item, quantity=0, serving_size=0) if i % 100 == 0 else item for i, item in enumerate(items)]
+        measure("  validate_many, 1% invalid", payloads, lambda: validate_many(model, broken))
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        seed(session, days, entries)
+    with Session(engine) as session:
+        logs = session.scalars(select(DailyLog).options(*DailyLogWithFoods.loader_options())).all()
+        #a log counts once, its entries and foods come with it
+        print(f"{days} logs x {entries} entries as DailyLogWithFoods")
+        measure("  model_validate(from_attributes)", len(logs), lambda: [DailyLogWithFoods.model_validate(log) for log in logs])
+        measure("  trusted", len(logs), lambda: [DailyLogWithFoods.trusted(log) for log in logs])
+        measure("  model_validate + json", len(logs), lambda: [DailyLogWithFoods.model_validate(log).model_dump_json() for log in logs])
+        measure("  trusted + json", len(logs), lambda: [DailyLogWithFoods.trusted(log).model_dump_json() for log in logs])
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
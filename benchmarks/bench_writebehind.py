@@ -0,0 +1,102 @@
+#meal-time burst against postgres: threads log single entries at a fixed total rate, either directly
+#(meals.log_entry and a commit per entry) or through the write-behind EntryWriter, waiting for each
+#entry to be durable or only for it to be queued. reports entries/s, commits/s and the latency of a
+#write call: until the entry is committed, or queued for the last mode
+#usage: python -m benchmarks.bench_writebehind [entries per second] [seconds] [threads]
+import sys, threading, time, datetime
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.bootstrap import bootstrap
+from nutrition_logger.config import database_url
+from nutrition_logger.meals import log_entry
+from nutrition_logger.models import User, Food
+from nutrition_logger.schema import BulkEntryCreate
+from nutrition_logger.writebehind import EntryWriter
+
+DAY = datetime.date(2000, 1, 1)
+
+def direct(Session):
+    def write(user_id, food_id):
+        with Session() as session:
+            log_entry(session, user_id, food_id, 1, DAY)
+            session.commit()
+    return write, lambda: None
+
+def write_behind(Session):
+    writer = EntryWriter(Session, max_batch=500, max_delay=0.05)
+    def write(user_id, food_id):
+        writer.submit(BulkEntryCreate(user_id=user_id, date=DAY, food_id=food_id)).result()
+    return write, writer.close
+
+def write_behind_queued(Session):
+    writer = EntryWriter(Session, max_batch=500, max_delay=0.05)
+    def write(user_id, food_id):
+        writer.submit(BulkEntryCreate(user_id=user_id, date=DAY, food_id=food_id))
+    return write, writer.close
+
+#every thread paces itself to rate / threads entries per second
+def run(write, user_ids, food_id, rate, seconds, threads):
+    latencies = []
+    lock = threading.Lock()
+    interval = threads / rate
+
+    def worker(user_id):
+        start = time.perf_counter()
+        for i in range(int(rate * seconds / threads)):
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            began = time.perf_counter()
+            write(user_id, food_id)
+            with lock:
+                latencies.append(time.perf_counter() - began)
+
+    workers = [threading.Thread(target=worker, args=(user_ids[i],)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - start, sorted(latencies)
+
+def main(rate=80, seconds=5, threads=16):
+    engine = create_engine(database_url(), pool_size=threads + 1)
+    bootstrap(engine)
+    Session = sessionmaker(bind=engine)
+    commits = [0]
+    event.listen(engine, "commit", lambda connection: commits.__setitem__(0, commits[0] + 1))
+
+    print(f"{rate} entries/s for {seconds}s from {threads} threads")
+    for name, mode in [("direct", direct), ("write-behind", write_behind), ("queued only", write_behind_queued)]:
+        with Session() as session:
+            users = [User(username=f"bench_wb_{i}", email=f"bench_wb_{i}@example.com") for i in range(threads)]
+            food = Food(name="bench_wb", manufacturer="bench", serving_size=1, unit="g", calories=1, protein=1, carbs=1, fat=1)
+            session.add_all([*users, food])
+            session.commit()
+            user_ids, food_id = [user.id for user in users], food.id
+
+        write, close = mode(Session)
+        commits[0] = 0
+        started = time.perf_counter()
+        elapsed, latencies = run(write, user_ids, food_id, rate, seconds, threads)
+        #commits made while draining the queue count towards the run
+        close()
+        elapsed = max(elapsed, time.perf_counter() - started)
+        p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+        print(
+            f"{name:<13} {len(latencies) / elapsed:8.0f} entries/s {commits[0] / elapsed:8.1f} commits/s "
+            f"p50 {p50 * 1000:6.1f} ms p99 {p99 * 1000:6.1f} ms"
+        )
+
+        with Session() as session:
+            for user_id in user_ids:
+                session.delete(session.get(User, user_id))
+            session.flush()
+            session.delete(session.get(Food, food_id))
+            session.commit()
+    engine.dispose()
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,57 @@
+#deterministic synthetic data: the same seed and sizes always give the same users, foods and history,
+#so numbers from different runs (or databases) describe the same workload
+from typing import Iterator, List, NamedTuple
+import datetime, random
+
+from nutrition_logger.schema import BulkEntryCreate
+
+ADJECTIVES = ["whole", "organic", "roasted", "salted", "greek", "smoked", "frozen", "fresh", "dark", "spicy", "light", "crunchy"]
+NOUNS = ["oats", "milk", "yogurt", "chicken", "rice", "almonds", "bread", "salmon", "apple", "cheese", "pasta", "beans", "tofu", "granola"]
+BRANDS = ["Acme", "Northfield", "Green Valley", "Blue Harbor", "Sunrise", "Oak & Mill", "Harvest Co", "Riverbend"]
+
+class DataSize(NamedTuple):
+    users: int = 100
+    foods: int = 5_000
+    years: float = 1.0
+    entries_per_day: int = 4
+    seed: int = 42
+
+    @property
+    def days(self) -> int:
+        return int(self.years * 365)
+
+def users(size: DataSize) -> List[dict]:
+    return [{"username": f"user{i}", "email": f"user{i}@example.com"} for i in range(size.users)]
+
+def foods(size: DataSize) -> List[dict]:
+    rng = random.Random(size.seed)
+    rows = []
+    for i in range(size.foods):
+        protein, carbs, fat = rng.uniform(0, 30), rng.uniform(0, 80), rng.uniform(0, 40)
+        rows.append({
+            "name": f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}",
+            "manufacturer": rng.choice(BRANDS),
+            "serving_size": rng.choice([30, 40, 100, 150, 250]),
+            "unit": rng.choice(["g", "ml"]),
+            "calories": round(4 * protein + 4 * carbs + 9 * fat, 1),
+            "protein": round(protein, 1),
+            "carbs": round(carbs, 1),
+            "fat": round(fat, 1),
+        })
+    return rows
+
+#history ending on end (inclusive), one user at a time: about one day in ten is skipped,
+#logged days get 1..2*entries_per_day-1 entries, mostly from the user's twenty usual foods
+def entries(size: DataSize, user_ids: List[int], food_ids: List[int], end: datetime.date) -> Iterator[BulkEntryCreate]:
+    rng = random.Random(size.seed + 1)
+    start = end - datetime.timedelta(days=size.days - 1)
+    for user_id in user_ids:
+        usual = rng.sample(food_ids, min(20, len(food_ids)))
+        for day in range(size.days):
+            if rng.random() < 0.1:
+                continue
+            date = start + datetime.timedelta(days=day)
+            for _ in range(rng.randint(1, 2 * size.entries_per_day - 1)):
+                food_id = rng.choice(usual) if rng.random() < 0.8 else rng.choice(food_ids)
+                #generated values are valid by construction, skip validation so inserts are what is measured
+                yield BulkEntryCreate.model_construct(user_id=user_id, date=date, food_id=food_id, quantity=rng.choice([0.5, 1.0, 1.0, 1.5, 2.0]))
@@ -0,0 +1,2 @@
+#registers the flush listeners that keep daily_totals and user_foods in sync
+from nutrition_logger import quickadd, totals
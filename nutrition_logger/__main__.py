@@ -0,0 +1,106 @@
+import argparse, datetime, os, sys
+
+from nutrition_logger.totals import rebuild_daily_totals
+
+def rebuild_totals(args):
+    from nutrition_logger.main import session_scope
+
+    with session_scope(primary=True) as session:
+        count = rebuild_daily_totals(session, args.user_id)
+    print(f"rebuilt daily totals for {count} logs")
+
+def bootstrap_schema(args):
+    from nutrition_logger.bootstrap import bootstrap
+    from nutrition_logger.main import get_engine
+
+    for name in bootstrap(get_engine()):
+        print(f"applied {name}")
+    print("schema up to date")
+
+def archive_logs(args):
+    from nutrition_logger.archive import ColdArchive, archive_old_logs
+    from nutrition_logger.main import Session, get_engine
+
+    get_engine()
+    with Session() as session:
+        #the months are deleted from the primary, they must be read from it too
+        session.use_primary()
+        months = archive_old_logs(session, ColdArchive(args.directory), args.keep_days)
+    for year, month in months:
+        print(f"archived {year:04d}-{month:02d}")
+    print(f"{len(months)} months archived to {args.directory}")
+
+def export_history(args):
+    from nutrition_logger.archive import ColdArchive
+    from nutrition_logger.export import export_user
+    from nutrition_logger.main import Session, get_engine
+
+    get_engine()
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        with Session() as session:
+            for chunk in export_user(session, args.user_id, args.format, archive=ColdArchive(args.archive)):
+                output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+def evaluate_adherence(args):
+    from nutrition_logger.adherence import evaluate_adherence
+    from nutrition_logger.main import get_engine
+
+    report = evaluate_adherence(get_engine(), args.date, args.chunk_size, args.workers)
+    print(f"evaluated {report.users} users in {report.chunks} chunks for {report.as_of}, {report.skipped} chunks already done")
+
+def load_foods(args):
+    from nutrition_logger.importer import import_foods
+    from nutrition_logger.main import get_engine
+
+    def report_error(line_number, row, reason):
+        print(f"line {line_number}: {reason}: {row}", file=sys.stderr)
+
+    with get_engine().begin() as connection:
+        report = import_foods(connection, args.path, args.format, args.batch_size, args.method, report_error)
+    print(report)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="nutrition_logger")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    setup = commands.add_parser("bootstrap", help="create the tables or upgrade an existing database, run once per deploy")
+    setup.set_defaults(func=bootstrap_schema)
+
+    rebuild = commands.add_parser("rebuild-totals", help="recompute daily_totals from the food entries")
+    rebuild.add_argument("--user-id", type=int, help="only rebuild this user's logs")
+    rebuild.set_defaults(func=rebuild_totals)
+
+    archive = commands.add_parser("archive", help="move whole months of old logs into compressed columnar files")
+    archive.add_argument("--directory", default=os.environ.get("ARCHIVE_DIR", "archive"), help="defaults to $ARCHIVE_DIR or ./archive")
+    archive.add_argument("--keep-days", type=int, default=90, help="months ending within this many days stay in the database")
+    archive.set_defaults(func=archive_logs)
+
+    export = commands.add_parser("export", help="stream a user's whole history as ndjson or csv")
+    export.add_argument("user_id", type=int)
+    export.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    export.add_argument("--output", help="defaults to stdout")
+    export.add_argument("--archive", default=os.environ.get("ARCHIVE_DIR", "archive"), help="archive directory, defaults to $ARCHIVE_DIR or ./archive")
+    export.set_defaults(func=export_history)
+
+    adherence = commands.add_parser("adherence", help="evaluate every user's targets over the past day, week and month, run nightly")
+    adherence.add_argument("--date", type=datetime.date.fromisoformat, help="last day evaluated, defaults to yesterday")
+    adherence.add_argument("--chunk-size", type=int, default=1000, help="user ids per chunk, a chunk commits (and is skipped on a rerun) as a whole")
+    adherence.add_argument("--workers", type=int, help="worker processes, defaults to one per core")
+    adherence.set_defaults(func=evaluate_adherence)
+
+    load = commands.add_parser("import-foods", help="bulk load a csv or jsonl food catalog, upserting on name")
+    load.add_argument("path")
+    load.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the file extension")
+    load.add_argument("--batch-size", type=int, default=5000)
+    load.add_argument("--method", choices=["insert", "copy"], default="insert")
+    load.set_defaults(func=load_foods)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import datetime, multiprocessing, os
+
+from sqlalchemy import Engine, and_, create_engine, func, or_, select
+from sqlalchemy.orm import Session, sessionmaker
+
+from nutrition_logger.dialect import upsert
+from nutrition_logger.models import Adherence, AdherenceChunk, DailyLog, DailyTotals, Target
+from nutrition_logger.totals import MACROS
+
+#evaluation windows ending on (and including) the as_of day, in days
+PERIODS: Dict[str, int] = {"day": 1, "week": 7, "month": 30}
+
+#a logged day is on target when every macro that has a target is within this fraction of it
+TOLERANCE = 0.1
+
+class AdherenceReport(NamedTuple):
+    as_of: datetime.date
+    chunks: int
+    skipped: int
+    users: int
+
+def _starts(as_of: datetime.date) -> Dict[str, datetime.date]:
+    return {period: as_of - datetime.timedelta(days=days - 1) for period, days in PERIODS.items()}
+
+#user id ranges [first, last] holding at least one target, aligned to multiples of chunk_size so a
+#restarted run cuts the same chunks whatever users were added since
+def chunks(session: Session, chunk_size: int) -> List[Tuple[int, int]]:
+    index = (Target.user_id // chunk_size).label("chunk")
+    starts = session.scalars(select(index).distinct().order_by(index))
+    return [(chunk * chunk_size, (chunk + 1) * chunk_size - 1) for chunk in starts]
+
+#chunks already evaluated for as_of, their results committed with them
+def finished_chunks(session: Session, as_of: datetime.date) -> set:
+    stmt = select(AdherenceChunk.first_user_id, AdherenceChunk.last_user_id).where(AdherenceChunk.as_of == as_of)
+    return {tuple(row) for row in session.execute(stmt)}
+
+#one row per user in the chunk: their targets, and per period the logged days, the days on target
+#and the average stored totals per logged day, all periods out of a single pass over the month
+def _chunk_query(as_of: datetime.date, first: int, last: int, tolerance: float):
+    starts = _starts(as_of)
+    totals = {macro: func.coalesce(getattr(DailyTotals, macro), 0.0) for macro in MACROS}
+    on_target = and_(*[
+        or_(getattr(Target, macro).is_(None), func.abs(totals[macro] - getattr(Target, macro)) <= tolerance * getattr(Target, macro))
+        for macro in MACROS
+    ])
+    columns = []
+    for period, start in starts.items():
+        within = DailyLog.date >= start
+        columns.append(func.count(DailyLog.id).filter(within).label(f"{period}_days"))
+        columns.append(func.count(DailyLog.id).filter(and_(within, on_target)).label(f"{period}_on_target"))
+        columns += [func.avg(totals[macro]).filter(within).label(f"{period}_{macro}") for macro in MACROS]
+    targets = [getattr(Target, macro) for macro in MACROS]
+    return (
+        select(Target.user_id, *targets, *columns)
+        .outerjoin(DailyLog, and_(DailyLog.user_id == Target.user_id, DailyLog.date.between(min(starts.values()), as_of)))
+        .outerjoin(DailyTotals, DailyTotals.daily_log_id == DailyLog.id)
+        .where(Target.user_id.between(first, last))
+        .group_by(Target.user_id, *targets)
+    )
+
+def _ratio(average: Optional[float], target: Optional[float]) -> Optional[float]:
+    return average / target if average is not None and target else None
+
+def _rows(result, as_of: datetime.date) -> List[dict]:
+    rows = []
+    for row in result.mappings():
+        for period in PERIODS:
+            averages = {macro: row[f"{period}_{macro}"] for macro in MACROS}
+            rows.append({
+                "user_id": row["user_id"],
+                "period": period,
+                "as_of": as_of,
+                "days": row[f"{period}_days"],
+                "days_on_target": row[f"{period}_on_target"],
+                **averages,
+                **{f"{macro}_ratio": _ratio(averages[macro], row[macro]) for macro in MACROS},
+            })
+    return rows
+
+#evaluate one chunk: one aggregate query, one bulk upsert of its results and the chunk's marker,
+#all in the caller's transaction so a chunk is either finished with its results or not at all,
+#returns the number of users evaluated
+def evaluate_chunk(session: Session, as_of: datetime.date, first: int, last: int, tolerance: float = TOLERANCE) -> int:
+    bind = session.get_bind()
+    rows = _rows(session.execute(_chunk_query(as_of, first, last, tolerance)), as_of)
+    if rows:
+        table = Adherence.__table__
+        stmt = upsert(bind, table)
+        keys = {"user_id", "period", "as_of"}
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.period, table.c.as_of],
+            set_={column: stmt.excluded[column] for column in rows[0] if column not in keys},
+        )
+        session.execute(stmt, rows)
+    users = len(rows) // len(PERIODS)
+    table = AdherenceChunk.__table__
+    marker = upsert(bind, table).values(as_of=as_of, first_user_id=first, last_user_id=last, users=users)
+    marker = marker.on_conflict_do_update(
+        index_elements=[table.c.as_of, table.c.first_user_id],
+        set_={"last_user_id": last, "users": users, "finished_at": func.now()},
+    )
+    session.execute(marker)
+    return users
+
+#per worker process: its own engine, connections are never shared with the parent
+_worker_session = None
+
+def _init_worker(url: str) -> None:
+    global _worker_session
+    _worker_session = sessionmaker(bind=create_engine(url, pool_size=1))
+
+def _run_chunk(as_of: datetime.date, first: int, last: int, tolerance: float) -> int:
+    with _worker_session() as session, session.begin():
+        return evaluate_chunk(session, as_of, first, last, tolerance)
+
+#nightly job: evaluate every user with targets for the day, week and month ending on as_of (yesterday
+#by default), chunk_size user ids per transaction, the chunks spread over a pool of worker processes
+#(one per core by default, 1 runs them here), chunks finished by an earlier run for the same day are skipped
+def evaluate_adherence(engine: Engine, as_of: Optional[datetime.date] = None, chunk_size: int = 1000, workers: Optional[int] = None, tolerance: float = TOLERANCE) -> AdherenceReport:
+    as_of = as_of or datetime.date.today() - datetime.timedelta(days=1)
+    with Session(engine) as session:
+        done = finished_chunks(session, as_of)
+        pending = chunks(session, chunk_size)
+    todo = [chunk for chunk in pending if chunk not in done]
+    skipped = len(pending) - len(todo)
+    workers = min(workers or os.cpu_count() or 1, len(todo))
+
+    if workers <= 1:
+        users = 0
+        for first, last in todo:
+            with Session(engine) as session, session.begin():
+                users += evaluate_chunk(session, as_of, first, last, tolerance)
+        return AdherenceReport(as_of, len(todo), skipped, users)
+
+    #spawned, not forked, so the workers start without the parent's connections
+    url = engine.url.render_as_string(hide_password=False)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(url,)) as pool:
+        futures = [pool.submit(_run_chunk, as_of, first, last, tolerance) for first, last in todo]
+        users = sum(future.result() for future in futures)
+    return AdherenceReport(as_of, len(todo), skipped, users)
@@ -0,0 +1,235 @@
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+import asyncio, datetime, os
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from nutrition_logger import async_repository as repository
+from nutrition_logger.meals import log_entries, log_entry
+from nutrition_logger.archive import ColdArchive
+from nutrition_logger.cache import log_responses
+from nutrition_logger.async_db import get_async_engine, get_async_router, get_async_session, get_async_sessionmaker
+from nutrition_logger.export import FORMATS, export_user_async
+from nutrition_logger.instrumentation import query_metrics, track_queries
+from nutrition_logger.models import DailyLog
+from nutrition_logger.pool import pool_stats
+from nutrition_logger.quickadd import quick_add
+from nutrition_logger.writebehind import close_entry_writer, get_entry_writer
+from nutrition_logger.schema import (
+    UserCreate, UserSummary, TargetUpdate, TargetSummary, AdherenceSummary, QuickAddSummary,
+    FoodCreate, FoodSummary, FoodUpdate,
+    DailyLogCreate, DailyLogWithFoods,
+    FoodEntryCreate, FoodEntrySummary, FoodEntryUpdate, BulkEntryCreate, DayEntryCreate,
+    list_adapter,
+)
+
+#queued entries are written before the process exits
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await asyncio.to_thread(close_entry_writer)
+
+app = FastAPI(title="Nutrition Logger", lifespan=lifespan)
+
+#months moved out of the database by `python -m nutrition_logger archive`
+archive = ColdArchive(os.environ.get("ARCHIVE_DIR", "archive"))
+
+#every request is one unit of work for the query instrumentation, its DB time goes out as Server-Timing
+@app.middleware("http")
+async def track_request_queries(request: Request, call_next):
+    with track_queries(f"{request.method} {request.url.path}") as stats:
+        response = await call_next(request)
+    response.headers["Server-Timing"] = f'db;dur={stats.time * 1000:.1f};desc="{stats.count} statements"'
+    return response
+
+def found(obj, name):
+    if obj is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, f"{name} not found")
+    return obj
+
+#users
+@app.post("/users", response_model=UserSummary, status_code=status.HTTP_201_CREATED)
+async def create_user(data: UserCreate, session: AsyncSession = Depends(get_async_session)):
+    user = await repository.create_user(session, data)
+    await session.commit()
+    return UserSummary.model_validate(user)
+
+@app.get("/users/{user_id}", response_model=UserSummary)
+async def get_user(user_id: int, session: AsyncSession = Depends(get_async_session)):
+    return UserSummary.model_validate(found(await repository.get_user(session, user_id), "user"))
+
+@app.put("/users/{user_id}/targets", response_model=TargetSummary)
+async def set_targets(user_id: int, data: TargetUpdate, session: AsyncSession = Depends(get_async_session)):
+    found(await repository.get_user(session, user_id), "user")
+    target = await repository.set_targets(session, user_id, data)
+    await session.commit()
+    return TargetSummary.model_validate(target)
+
+@app.get("/users/{user_id}/targets", response_model=TargetSummary)
+async def get_targets(user_id: int, session: AsyncSession = Depends(get_async_session)):
+    return TargetSummary.model_validate(found(await repository.get_targets(session, user_id), "targets"))
+
+#results of the nightly `python -m nutrition_logger adherence` run, the latest one unless as_of is given
+@app.get("/users/{user_id}/adherence", response_model=List[AdherenceSummary])
+async def get_adherence(user_id: int, as_of: Optional[datetime.date] = None, session: AsyncSession = Depends(get_async_session)):
+    found(await repository.get_user(session, user_id), "user")
+    return [AdherenceSummary.model_validate(row) for row in await repository.get_adherence(session, user_id, as_of)]
+
+#the user's most frequent and most recent foods, one indexed read of user_foods
+@app.get("/users/{user_id}/quick-add", response_model=QuickAddSummary)
+async def get_quick_add(user_id: int, limit: int = 10, session: AsyncSession = Depends(get_async_session)):
+    found(await repository.get_user(session, user_id), "user")
+    return QuickAddSummary.model_validate(await session.run_sync(quick_add, user_id, limit))
+
+#log to today (or data.date): safe under concurrent first entries of the day, the log is upserted.
+#with ENTRY_WRITE_BEHIND on the entry goes through the batching writer: by default the response waits
+#for the batch to commit, durable=false answers 202 as soon as the entry is queued
+@app.post(
+    "/users/{user_id}/entries", response_model=FoodEntrySummary, status_code=status.HTTP_201_CREATED,
+    responses={status.HTTP_202_ACCEPTED: {"description": "queued by the write-behind writer, not committed yet"}},
+)
+async def log_user_entry(user_id: int, data: DayEntryCreate, durable: bool = True, session: AsyncSession = Depends(get_async_session)):
+    found(await repository.get_user(session, user_id), "user")
+    writer = get_entry_writer()
+    if writer is None:
+        entry = await session.run_sync(log_entry, user_id, data.food_id, data.quantity, data.date)
+        await session.commit()
+        return FoodEntrySummary.model_validate(entry)
+
+    item = BulkEntryCreate(user_id=user_id, date=data.date or datetime.date.today(), food_id=data.food_id, quantity=data.quantity)
+    #submit() blocks while the queue is full, that wait is the backpressure on this request
+    future = await asyncio.to_thread(writer.submit, item)
+    if not durable:
+        return Response(status_code=status.HTTP_202_ACCEPTED)
+    try:
+        row = await asyncio.wrap_future(future)
+    except ValueError as error:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, str(error))
+    return FoodEntrySummary.trusted(row._mapping)
+
+#the user's whole history, archived months included, streamed as it is read so the first bytes go out at once
+@app.get("/users/{user_id}/export")
+async def export_history(user_id: int, format: Literal["ndjson", "csv"] = "ndjson", start: Optional[datetime.date] = None, end: Optional[datetime.date] = None, session: AsyncSession = Depends(get_async_session), sessionmaker = Depends(get_async_sessionmaker)):
+    found(await repository.get_user(session, user_id), "user")
+
+    async def stream():
+        async with sessionmaker() as export_session:
+            async for chunk in export_user_async(export_session, user_id, format, start, end, archive):
+                yield chunk
+
+    headers = {"Content-Disposition": f'attachment; filename="user-{user_id}-history.{format}"'}
+    return StreamingResponse(stream(), media_type=FORMATS[format], headers=headers)
+
+#foods
+@app.post("/foods", response_model=FoodSummary, status_code=status.HTTP_201_CREATED)
+async def create_food(data: FoodCreate, session: AsyncSession = Depends(get_async_session)):
+    food = await repository.create_food(session, data)
+    await session.commit()
+    return FoodSummary.model_validate(food)
+
+@app.get("/foods/{food_id}", response_model=FoodSummary)
+async def get_food(food_id: int, session: AsyncSession = Depends(get_async_session)):
+    return FoodSummary.model_validate(found(await repository.get_food(session, food_id), "food"))
+
+@app.patch("/foods/{food_id}", response_model=FoodSummary)
+async def update_food(food_id: int, data: FoodUpdate, session: AsyncSession = Depends(get_async_session)):
+    food = found(await repository.update_food(session, food_id, data), "food")
+    await session.commit()
+    return FoodSummary.model_validate(food)
+
+@app.delete("/foods/{food_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_food(food_id: int, session: AsyncSession = Depends(get_async_session)):
+    if not await repository.delete_food(session, food_id):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "food not found")
+    await session.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+#logs
+@app.post("/logs", response_model=DailyLogWithFoods, status_code=status.HTTP_201_CREATED)
+async def create_log(data: DailyLogCreate, session: AsyncSession = Depends(get_async_session)):
+    log = await repository.create_log(session, data)
+    await session.commit()
+    return DailyLogWithFoods.model_validate(log)
+
+def log_etag(log_id: int, version: int) -> str:
+    return f'"log-{log_id}-{version}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+#polled by clients: the log's version is a single primary-key lookup, an unchanged log answers 304
+#(or the cached body for clients without it) so neither the log nor its foods are loaded or serialized
+@app.get("/logs/{log_id}", response_model=DailyLogWithFoods)
+async def get_log(log_id: int, if_none_match: Optional[str] = Header(None), session: AsyncSession = Depends(get_async_session)):
+    version = found(await session.scalar(select(DailyLog.version).where(DailyLog.id == log_id)), "log")
+    headers = {"ETag": log_etag(log_id, version), "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    body = log_responses.get(log_id, version)
+    if body is None:
+        log = found(await repository.get_log(session, log_id), "log")
+        #the log may have moved on since the version was read, key the body by what was loaded
+        body = DailyLogWithFoods.trusted(log).model_dump_json().encode()
+        log_responses.put(log_id, log.version, body)
+        headers["ETag"] = log_etag(log_id, log.version)
+    return Response(body, media_type="application/json", headers=headers)
+
+#entries
+@app.post("/entries", response_model=FoodEntrySummary, status_code=status.HTTP_201_CREATED)
+async def add_entry(data: FoodEntryCreate, session: AsyncSession = Depends(get_async_session)):
+    entry = await repository.add_entry(session, data)
+    await session.commit()
+    return FoodEntrySummary.model_validate(entry)
+
+#offline sync: entries for any number of users and days, their logs are created as needed
+@app.post("/entries/bulk", response_model=List[FoodEntrySummary], status_code=status.HTTP_201_CREATED)
+async def add_entries(items: List[BulkEntryCreate], session: AsyncSession = Depends(get_async_session)):
+    try:
+        entries = await session.run_sync(log_entries, items)
+    except ValueError as error:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, str(error))
+    await session.commit()
+    #rows straight from RETURNING, serialized as is rather than re-validated item by item
+    body = list_adapter(FoodEntrySummary).dump_json([FoodEntrySummary.trusted(entry._mapping) for entry in entries])
+    return Response(body, status_code=status.HTTP_201_CREATED, media_type="application/json")
+
+@app.patch("/entries/{entry_id}", response_model=FoodEntrySummary)
+async def update_entry(entry_id: int, data: FoodEntryUpdate, session: AsyncSession = Depends(get_async_session)):
+    entry = found(await repository.update_entry(session, entry_id, data), "entry")
+    await session.commit()
+    return FoodEntrySummary.model_validate(entry)
+
+@app.delete("/entries/{entry_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_entry(entry_id: int, session: AsyncSession = Depends(get_async_session)):
+    if not await repository.delete_entry(session, entry_id):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "entry not found")
+    await session.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+#connection pool of this process: checked out/in, overflow and how long checkouts waited
+@app.get("/pool")
+async def get_pool_stats():
+    return pool_stats(get_async_engine())
+
+#read replicas of this process and whether reads are currently routed to them
+@app.get("/replicas")
+async def get_replicas():
+    return get_async_router().status()
+
+#write-behind queue depth and batches written, null when entries are written directly
+@app.get("/entries/writer")
+async def get_entry_writer_stats():
+    writer = get_entry_writer()
+    return None if writer is None else writer.stats()
+
+#statement counts, DB time, units with likely N+1 patterns and the slowest statements since startup
+@app.get("/metrics/queries")
+async def get_query_metrics():
+    return query_metrics.stats()
@@ -0,0 +1,232 @@
+from __future__ import annotations
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import datetime, os, re
+
+import numpy as np
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from nutrition_logger.models import DailyLog, DailyTotals, Food, FoodEntry
+from nutrition_logger.quickadd import archive_entries
+from nutrition_logger.rollups import DayColumns, EntryColumns, to_date, to_day
+from nutrition_logger.totals import MACROS, TOTAL_COLUMNS
+
+FILE_NAME = re.compile(r"^logs-(\d{4})-(\d{2})\.npz$")
+LOG_COLUMNS = ("log_id", "user_id", "day", *TOTAL_COLUMNS)
+ENTRY_COLUMNS = ("entry_id", "entry_log_id", "entry_user_id", "entry_day", "food_id", "quantity", *(f"entry_{macro}" for macro in MACROS))
+
+#an archived day, same fields as the rows of totals.daily_totals
+class ArchivedTotals(NamedTuple):
+    daily_log_id: int
+    user_id: int
+    date: datetime.date
+    calories: float
+    protein: float
+    carbs: float
+    fat: float
+    entry_count: int
+
+def _month_range(year: int, month: int) -> Tuple[datetime.date, datetime.date]:
+    first = datetime.date(year, month, 1)
+    following = datetime.date(year + month // 12, month % 12 + 1, 1)
+    return first, following - datetime.timedelta(days=1)
+
+def _months_between(start: datetime.date, end: datetime.date) -> Iterable[Tuple[int, int]]:
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield year, month
+        year, month = year + month // 12, month % 12 + 1
+
+#cold storage for whole calendar months of old logs, the month is the partition: every archived month is one
+#compressed columnar file holding its logs with their stored totals and its entries valued at archive time
+#(later changes to a food's macros do not reach archived history). readers only open the months a range touches
+class ColdArchive:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.loads = 0
+        self._loaded: Dict[Tuple[int, int], Tuple[float, dict]] = {}
+
+    def path(self, year: int, month: int) -> str:
+        return os.path.join(self.directory, f"logs-{year:04d}-{month:02d}.npz")
+
+    def months(self) -> List[Tuple[int, int]]:
+        if not os.path.isdir(self.directory):
+            return []
+        found = (FILE_NAME.match(name) for name in os.listdir(self.directory))
+        return sorted((int(match[1]), int(match[2])) for match in found if match)
+
+    #archived months overlapping the inclusive range, None for an open end
+    def covering(self, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> List[Tuple[int, int]]:
+        low = (start.year, start.month) if start is not None else (0, 0)
+        high = (end.year, end.month) if end is not None else (9999, 12)
+        return [month for month in self.months() if low <= month <= high]
+
+    def load(self, year: int, month: int) -> dict:
+        path = self.path(year, month)
+        mtime = os.path.getmtime(path)
+        cached = self._loaded.get((year, month))
+        if cached is None or cached[0] != mtime:
+            with np.load(path) as data:
+                cached = (mtime, {name: data[name] for name in data.files})
+            self._loaded[(year, month)] = cached
+            self.loads += 1
+        return cached[1]
+
+    def write(self, year: int, month: int, columns: dict) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(year, month)
+        #a month archived again (late rows, or a run whose delete did not commit) is merged, the newest copy of a log wins
+        if os.path.exists(path):
+            old = self.load(year, month)
+            keep = ~np.isin(old["log_id"], columns["log_id"])
+            keep_entries = ~np.isin(old["entry_log_id"], columns["log_id"])
+            columns = {
+                name: np.concatenate([old[name][keep if name in LOG_COLUMNS else keep_entries], values])
+                for name, values in columns.items()
+            }
+        order = np.lexsort((columns["day"], columns["user_id"]))
+        columns.update({name: columns[name][order] for name in LOG_COLUMNS})
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as file:
+            np.savez_compressed(file, **columns)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+        self._loaded.pop((year, month), None)
+
+    @staticmethod
+    def _mask(data, prefix, user_ids, start, end):
+        days = data[f"{prefix}day"]
+        mask = np.ones(len(days), dtype=bool)
+        if start is not None:
+            mask &= days >= to_day(start)
+        if end is not None:
+            mask &= days <= to_day(end)
+        if user_ids is not None:
+            mask &= np.isin(data[f"{prefix}user_id"], np.fromiter(user_ids, dtype=np.int64))
+        return mask
+
+    def _select(self, prefix, user_ids, start, end):
+        user_ids = None if user_ids is None else list(user_ids)
+        for year, month in self.covering(start, end):
+            data = self.load(year, month)
+            yield data, self._mask(data, prefix, user_ids, start, end)
+
+    #one archived month's logs in range as columns, ordered by day
+    def month_logs(self, year: int, month: int, user_ids: Optional[Iterable[int]] = None, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> Dict[str, np.ndarray]:
+        data = self.load(year, month)
+        mask = self._mask(data, "", user_ids, start, end)
+        order = np.argsort(data["day"][mask], kind="stable")
+        return {name: data[name][mask][order] for name in LOG_COLUMNS}
+
+    #one archived month's entries in range as columns, ordered by day then entry id
+    def month_entries(self, year: int, month: int, user_ids: Optional[Iterable[int]] = None, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> Dict[str, np.ndarray]:
+        data = self.load(year, month)
+        mask = self._mask(data, "entry_", user_ids, start, end)
+        order = np.lexsort((data["entry_id"][mask], data["entry_day"][mask]))
+        return {name: data[name][mask][order] for name in ENTRY_COLUMNS}
+
+    #stored totals of the archived days in range, sorted by user then day
+    def day_columns(self, user_ids: Optional[Iterable[int]] = None, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> DayColumns:
+        parts = [
+            [data[name][mask] for name in ("user_id", "day", *MACROS, "entry_count")]
+            for data, mask in self._select("", user_ids, start, end)
+        ]
+        return DayColumns(*_concatenate(parts, 7, (np.int64, np.int64, *(np.float64 for _ in MACROS), np.int64)))
+
+    #archived entries in range, macros multiplied by quantity like rollups.entry_columns
+    def entry_columns(self, user_ids: Optional[Iterable[int]] = None, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> EntryColumns:
+        parts = [
+            [data[name][mask] for name in ("entry_user_id", "entry_day", *(f"entry_{macro}" for macro in MACROS))]
+            for data, mask in self._select("entry_", user_ids, start, end)
+        ]
+        return EntryColumns(*_concatenate(parts, 6, (np.int64, np.int64, *(np.float64 for _ in MACROS))))
+
+    def daily_totals(self, user_id: int, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> List[ArchivedTotals]:
+        rows = []
+        for data, mask in self._select("", [user_id], start, end):
+            for values in zip(*(data[name][mask].tolist() for name in LOG_COLUMNS)):
+                log_id, user, day, *totals = values
+                rows.append(ArchivedTotals(log_id, user, to_date(day), *totals))
+        return sorted(rows, key=lambda row: row.date)
+
+FLOAT_COLUMNS = {*MACROS, "quantity", *(f"entry_{macro}" for macro in MACROS)}
+
+#query rows to named int64/float64 arrays, dates become day numbers
+def _columns(names, rows):
+    values = list(zip(*rows)) if rows else [() for _ in names]
+    columns = {}
+    for name, column in zip(names, values):
+        if name in ("day", "entry_day"):
+            column = [to_day(date) for date in column]
+        columns[name] = np.array(column, dtype=np.float64 if name in FLOAT_COLUMNS else np.int64)
+    return columns
+
+def _concatenate(parts, width, dtypes):
+    if not parts:
+        return [np.empty(0, dtype=dtype) for dtype in dtypes]
+    return [np.concatenate([part[i] for part in parts]).astype(dtypes[i], copy=False) for i in range(width)]
+
+#(user_id, food_id, date) of the latest entry of every user's food in the entry columns
+def _latest_days(columns):
+    users, foods, days = columns["entry_user_id"], columns["food_id"], columns["entry_day"]
+    if len(days) == 0:
+        return []
+    order = np.lexsort((days, foods, users))
+    users, foods, days = users[order], foods[order], days[order]
+    last = np.flatnonzero(np.append((users[1:] != users[:-1]) | (foods[1:] != foods[:-1]), True))
+    return [(user, food, to_date(day)) for user, food, day in zip(users[last].tolist(), foods[last].tolist(), days[last].tolist())]
+
+#move one month of logs, their entries and stored totals into the archive, returns the number of logs moved,
+#the file is written before the rows are deleted, the caller commits. the month's logs are locked first so
+#no entry can be added to or moved out of them meanwhile, and only the rows written to the file are deleted:
+#a log created concurrently stays for the next run
+def archive_month(session: Session, archive: ColdArchive, year: int, month: int) -> int:
+    first, last = _month_range(year, month)
+    in_month = (DailyLog.date >= first) & (DailyLog.date <= last)
+    locked = session.scalars(select(DailyLog.id).where(in_month).order_by(DailyLog.id).with_for_update()).all()
+    if not locked:
+        return 0
+    in_locked = DailyLog.id.in_(locked)
+    totals = [func.coalesce(getattr(DailyTotals, column), 0) for column in TOTAL_COLUMNS]
+    logs = session.execute(
+        select(DailyLog.id, DailyLog.user_id, DailyLog.date, *totals)
+        .outerjoin(DailyTotals, DailyTotals.daily_log_id == DailyLog.id)
+        .where(in_locked)
+    ).all()
+    entries = session.execute(
+        select(
+            FoodEntry.id, FoodEntry.daily_log_id, DailyLog.user_id, DailyLog.date, FoodEntry.food_id, FoodEntry.quantity,
+            *[FoodEntry.quantity * getattr(Food, macro) for macro in MACROS],
+        )
+        .join(DailyLog, DailyLog.id == FoodEntry.daily_log_id)
+        .join(Food, Food.id == FoodEntry.food_id)
+        .where(in_locked)
+    ).all()
+
+    columns = {**_columns(LOG_COLUMNS, logs), **_columns(ENTRY_COLUMNS, entries)}
+    archive.write(year, month, columns)
+
+    #core deletes: user_foods keeps counting the archived entries, by now their weight has decayed anyway,
+    #and keeps the latest archived date of every food
+    archive_entries(session.connection(), _latest_days(columns))
+    session.execute(delete(FoodEntry.__table__).where(FoodEntry.id.in_(columns["entry_id"].tolist())))
+    session.execute(delete(DailyTotals.__table__).where(DailyTotals.daily_log_id.in_(locked)))
+    session.execute(delete(DailyLog.__table__).where(in_locked))
+    return len(logs)
+
+#archive every whole month that ended more than keep_days before today, one transaction per month,
+#returns the (year, month) pairs archived
+def archive_old_logs(session: Session, archive: ColdArchive, keep_days: int = 90, today: Optional[datetime.date] = None) -> List[Tuple[int, int]]:
+    cutoff = (today or datetime.date.today()) - datetime.timedelta(days=keep_days)
+    oldest = session.scalar(select(func.min(DailyLog.date)).where(DailyLog.date < cutoff))
+    archived = []
+    if oldest is None:
+        return archived
+    for year, month in _months_between(oldest, cutoff):
+        if _month_range(year, month)[1] >= cutoff:
+            break
+        if archive_month(session, archive, year, month):
+            archived.append((year, month))
+        session.commit()
+    return archived
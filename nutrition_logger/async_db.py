@@ -0,0 +1,42 @@
+from functools import lru_cache
+from typing import AsyncIterator
+
+from fastapi import Request
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+from nutrition_logger.config import database_url, engine_options, replica_urls, router_options
+from nutrition_logger.pool import TimedAsyncQueuePool
+from nutrition_logger.routing import ReplicaRouter, RoutingSession
+
+#objects stay usable after commit so responses can be built from them without another round trip,
+#bound by get_async_engine(), reads are routed to the replicas like the sync sessions in main.py
+AsyncSessionLocal = async_sessionmaker(expire_on_commit=False, sync_session_class=RoutingSession)
+
+#same mappings as the sync engine in main.py, asyncpg as the driver, built on first use so importing does no I/O
+@lru_cache(maxsize=None)
+def get_async_engine() -> AsyncEngine:
+    engine = create_async_engine(database_url("asyncpg"), poolclass=TimedAsyncQueuePool, **engine_options("asyncpg"))
+    replicas = [
+        create_async_engine(url, poolclass=TimedAsyncQueuePool, **engine_options("asyncpg")).sync_engine
+        for url in replica_urls("asyncpg")
+    ]
+    AsyncSessionLocal.configure(bind=engine, router=ReplicaRouter(engine.sync_engine, replicas, **router_options()))
+    return engine
+
+def get_async_router() -> ReplicaRouter:
+    get_async_engine()
+    return AsyncSessionLocal.kw["router"]
+
+#FastAPI dependency, one session per request, anything left uncommitted is rolled back on close,
+#requests that change something read from the primary throughout
+async def get_async_session(request: Request) -> AsyncIterator[AsyncSession]:
+    get_async_engine()
+    async with AsyncSessionLocal() as session:
+        if request.method not in ("GET", "HEAD"):
+            session.sync_session.use_primary()
+        yield session
+
+#for streaming responses, which outlive the request's dependencies and so open (and close) their own session
+def get_async_sessionmaker() -> async_sessionmaker:
+    get_async_engine()
+    return AsyncSessionLocal
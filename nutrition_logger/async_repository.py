@@ -0,0 +1,127 @@
+from typing import List, Optional
+import datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from nutrition_logger.adherence import PERIODS
+from nutrition_logger.models import User, Food, DailyLog, FoodEntry, Target, Adherence
+from nutrition_logger.schema import (
+    UserCreate, FoodCreate, FoodUpdate, DailyLogCreate, FoodEntryCreate, FoodEntryUpdate, DailyLogWithFoods, TargetUpdate
+)
+
+#async counterparts of the ORM writes and reads, they flush but leave committing to the caller
+
+#users
+async def create_user(session: AsyncSession, data: UserCreate) -> User:
+    user = User(**data.model_dump())
+    session.add(user)
+    await session.flush()
+    return user
+
+async def get_user(session: AsyncSession, user_id: int) -> Optional[User]:
+    return await session.get(User, user_id)
+
+async def get_user_by_username(session: AsyncSession, username: str) -> Optional[User]:
+    return await session.scalar(select(User).where(User.username == username))
+
+#targets replace the previous ones as a whole, macros left out have no target
+async def set_targets(session: AsyncSession, user_id: int, data: TargetUpdate) -> Target:
+    target = await session.get(Target, user_id)
+    if target is None:
+        target = Target(user_id=user_id)
+        session.add(target)
+    for field, value in data.model_dump().items():
+        setattr(target, field, value)
+    await session.flush()
+    return target
+
+async def get_targets(session: AsyncSession, user_id: int) -> Optional[Target]:
+    return await session.get(Target, user_id)
+
+#the user's day, week and month results from the latest (or the given) evaluation
+async def get_adherence(session: AsyncSession, user_id: int, as_of: Optional[datetime.date] = None) -> List[Adherence]:
+    if as_of is None:
+        as_of = select(func.max(Adherence.as_of)).where(Adherence.user_id == user_id).scalar_subquery()
+    stmt = select(Adherence).where(Adherence.user_id == user_id, Adherence.as_of == as_of)
+    return sorted(await session.scalars(stmt), key=lambda row: PERIODS[row.period])
+
+#foods
+async def create_food(session: AsyncSession, data: FoodCreate) -> Food:
+    food = Food(**data.model_dump())
+    session.add(food)
+    await session.flush()
+    return food
+
+async def get_food(session: AsyncSession, food_id: int) -> Optional[Food]:
+    return await session.get(Food, food_id)
+
+async def update_food(session: AsyncSession, food_id: int, data: FoodUpdate) -> Optional[Food]:
+    food = await session.get(Food, food_id)
+    if food is None:
+        return None
+    for field, value in data.model_dump(exclude_unset=True).items():
+        setattr(food, field, value)
+    await session.flush()
+    return food
+
+async def delete_food(session: AsyncSession, food_id: int) -> bool:
+    food = await session.get(Food, food_id)
+    if food is None:
+        return False
+    await session.delete(food)
+    await session.flush()
+    return True
+
+#logs, loaded with their entries and foods so they serialize as DailyLogWithFoods without lazy loads
+async def create_log(session: AsyncSession, data: DailyLogCreate, date: Optional[datetime.date] = None) -> DailyLog:
+    log = DailyLog(**data.model_dump(), date=date or datetime.date.today(), food_entries=[])
+    session.add(log)
+    await session.flush()
+    return log
+
+async def get_log(session: AsyncSession, log_id: int) -> Optional[DailyLog]:
+    return await session.get(DailyLog, log_id, options=DailyLogWithFoods.loader_options())
+
+async def get_log_by_date(session: AsyncSession, user_id: int, date: datetime.date) -> Optional[DailyLog]:
+    stmt = (
+        select(DailyLog)
+        .where(DailyLog.user_id == user_id, DailyLog.date == date)
+        .options(*DailyLogWithFoods.loader_options())
+    )
+    return await session.scalar(stmt)
+
+async def list_logs(session: AsyncSession, user_id: int, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> List[DailyLog]:
+    stmt = select(DailyLog).where(DailyLog.user_id == user_id).order_by(DailyLog.date)
+    if start is not None:
+        stmt = stmt.where(DailyLog.date >= start)
+    if end is not None:
+        stmt = stmt.where(DailyLog.date <= end)
+    return list(await session.scalars(stmt))
+
+#entries
+async def add_entry(session: AsyncSession, data: FoodEntryCreate) -> FoodEntry:
+    entry = FoodEntry(**data.model_dump())
+    session.add(entry)
+    await session.flush()
+    return entry
+
+async def get_entry(session: AsyncSession, entry_id: int) -> Optional[FoodEntry]:
+    return await session.get(FoodEntry, entry_id)
+
+async def update_entry(session: AsyncSession, entry_id: int, data: FoodEntryUpdate) -> Optional[FoodEntry]:
+    entry = await session.get(FoodEntry, entry_id)
+    if entry is None:
+        return None
+    for field, value in data.model_dump(exclude_unset=True).items():
+        setattr(entry, field, value)
+    await session.flush()
+    return entry
+
+async def delete_entry(session: AsyncSession, entry_id: int) -> bool:
+    entry = await session.get(FoodEntry, entry_id)
+    if entry is None:
+        return False
+    await session.delete(entry)
+    await session.flush()
+    return True
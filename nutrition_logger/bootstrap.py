@@ -0,0 +1,94 @@
+from typing import Callable, List, Tuple
+
+from sqlalchemy import Connection, Engine, inspect, select, text
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.orm import Session
+
+from nutrition_logger.models import Base, DailyLog, Food, FoodEntry, DailyTotals, SchemaMigration, UserFood, trigram_extension
+from nutrition_logger.quickadd import rebuild_user_foods
+from nutrition_logger.totals import rebuild_daily_totals
+
+#any constant works, it only has to be the same for every process bootstrapping this database
+LOCK_KEY = 0x6E75747269
+
+#manufacturers make many foods, the unique constraint was dropped from the model
+def _drop_manufacturer_unique(connection):
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("ALTER TABLE foods DROP CONSTRAINT IF EXISTS foods_manufacturer_key"))
+
+#create_all skips tables that already exist, and with them their indexes
+def _create_search_indexes(connection):
+    trigram_extension(Food.__table__, connection)
+    for index in Food.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+#daily_totals starts empty when it is added next to existing logs
+def _backfill_daily_totals(connection):
+    rebuild_daily_totals(Session(bind=connection))
+
+#foreign key indexes on food_entries, covering indexes for totals, id carried in _user_date_uc
+def _create_hot_query_indexes(connection):
+    for table in (FoodEntry.__table__, DailyTotals.__table__):
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    if connection.dialect.name == "postgresql":
+        connection.execute(text(
+            "ALTER TABLE daily_logs DROP CONSTRAINT _user_date_uc, "
+            "ADD CONSTRAINT _user_date_uc UNIQUE (user_id, date) INCLUDE (id)"
+        ))
+
+#columns of the model the table does not have yet, added with their defaults (or generation expressions)
+def _add_missing_columns(connection, table):
+    existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in existing:
+            spec = CreateColumn(column).compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {spec}"))
+
+#generated columns are filled for every existing row as they are added, which is the backfill
+def _add_normalized_food_columns(connection):
+    if connection.dialect.name == "postgresql":
+        _add_missing_columns(connection, Food.__table__)
+
+#existing logs start at version 0
+def _add_log_versions(connection):
+    _add_missing_columns(connection, DailyLog.__table__)
+
+#user_foods starts empty when it is added next to existing entries
+def _backfill_user_foods(connection):
+    rebuild_user_foods(Session(bind=connection))
+
+#foods archived before the column existed keep their last_date when their live entries go
+def _add_user_foods_archived_date(connection):
+    _add_missing_columns(connection, UserFood.__table__)
+
+#ordered upgrade steps for databases created by older versions, each runs once and is recorded
+#in schema_migrations, a database created from scratch already has all of them
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    ("0001_drop_foods_manufacturer_unique", _drop_manufacturer_unique),
+    ("0002_food_search_indexes", _create_search_indexes),
+    ("0003_backfill_daily_totals", _backfill_daily_totals),
+    ("0004_hot_query_indexes", _create_hot_query_indexes),
+    ("0005_normalized_food_nutrients", _add_normalized_food_columns),
+    ("0006_daily_log_versions", _add_log_versions),
+    ("0007_backfill_user_foods", _backfill_user_foods),
+    ("0008_user_foods_archived_date", _add_user_foods_archived_date),
+]
+
+#create or upgrade the schema in one transaction, returns the migrations it applied,
+#on postgres concurrent callers wait on an advisory lock and then find nothing left to do
+def bootstrap(engine: Engine) -> List[str]:
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOCK_KEY})
+        fresh = not inspect(connection).has_table(Food.__tablename__)
+        Base.metadata.create_all(connection)
+
+        table = SchemaMigration.__table__
+        applied = set(connection.scalars(select(table.c.name)))
+        pending = [(name, step) for name, step in MIGRATIONS if name not in applied]
+        for name, step in pending:
+            if not fresh:
+                step(connection)
+            connection.execute(table.insert().values(name=name))
+        return [] if fresh else [name for name, _ in pending]
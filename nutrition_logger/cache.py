@@ -0,0 +1,210 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import os, threading, time
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from nutrition_logger.models import DailyLog, Food, FoodEntry
+
+#detached, immutable copy of a foods row, safe to share between sessions and threads
+class CachedFood(NamedTuple):
+    id: int
+    name: str
+    manufacturer: str
+    serving_size: float
+    unit: str
+    calories: float
+    protein: float
+    carbs: float
+    fat: float
+
+FOOD_COLUMNS = [getattr(Food, field) for field in CachedFood._fields]
+
+#process-local read-through LRU cache of foods by id, entries expire after ttl seconds,
+#watch() invalidates foods written through ORM sessions as they are flushed, committed or rolled back
+class FoodCache:
+    def __init__(self, maxsize: int = 10_000, ttl: float = 300.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: OrderedDict[int, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+        self._key = f"food_cache_{id(self)}"
+        self._listeners = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+    def _lookup(self, food_id, now):
+        entry = self._entries.get(food_id)
+        if entry is None:
+            return None
+        food, expires = entry
+        if expires <= now:
+            del self._entries[food_id]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(food_id)
+        return food
+
+    def _store(self, food, now):
+        self._entries[food.id] = (food, now + self.ttl)
+        self._entries.move_to_end(food.id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, session: Session, food_id: int) -> Optional[CachedFood]:
+        return self.get_many(session, [food_id]).get(food_id)
+
+    #foods for all ids, misses are loaded in one query, ids that do not exist are left out
+    def get_many(self, session: Session, food_ids: Iterable[int]) -> Dict[int, CachedFood]:
+        #foods this session wrote but has not committed yet must come from its own transaction, uncached
+        written = session.info.get(self._key, set())
+        found, missing = {}, []
+        now = self.clock()
+        with self._lock:
+            for food_id in set(food_ids):
+                food = None if food_id in written else self._lookup(food_id, now)
+                if food is None:
+                    missing.append(food_id)
+                else:
+                    found[food_id] = food
+            self.hits += len(found)
+            self.misses += len(missing)
+        if not missing:
+            return found
+
+        rows = session.execute(select(*FOOD_COLUMNS).where(Food.id.in_(missing)))
+        loaded = [CachedFood(*row) for row in rows]
+        now = self.clock()
+        with self._lock:
+            for food in loaded:
+                found[food.id] = food
+                if food.id not in written:
+                    self._store(food, now)
+        return found
+
+    def invalidate(self, food_ids: Iterable[int]) -> None:
+        with self._lock:
+            for food_id in food_ids:
+                self._entries.pop(food_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    #foods are dropped as soon as a flush writes them and again when the transaction ends,
+    #so a concurrent reader cannot leave the pre-commit row behind
+    def watch(self, target=Session) -> FoodCache:
+        def stage(session, flush_context):
+            changed = {obj.id for obj in session.dirty if isinstance(obj, Food) and session.is_modified(obj)}
+            changed |= {obj.id for obj in session.deleted if isinstance(obj, Food)}
+            if changed:
+                session.info.setdefault(self._key, set()).update(changed)
+                self.invalidate(changed)
+
+        def finish(session, *args):
+            written = session.info.pop(self._key, None)
+            if written:
+                self.invalidate(written)
+
+        self._listeners = [(target, "after_flush", stage), (target, "after_commit", finish), (target, "after_soft_rollback", finish)]
+        for listener in self._listeners:
+            event.listen(*listener)
+        return self
+
+    def unwatch(self) -> None:
+        for listener in self._listeners:
+            event.remove(*listener)
+        self._listeners = []
+
+food_cache = FoodCache(
+    maxsize=int(os.environ.get("FOOD_CACHE_SIZE", 10_000)),
+    ttl=float(os.environ.get("FOOD_CACHE_TTL", 300)),
+).watch()
+
+#ids are reused once the table is recreated
+@event.listens_for(Food.__table__, "after_drop")
+def _clear_food_cache(target, connection, **kw):
+    food_cache.clear()
+
+#serialized responses by (key, version), one version per key: a newer version replaces the older one,
+#an older one is never served, least recently used keys go first once maxsize is reached
+class ResponseCache:
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[object, Tuple[int, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+    def get(self, key, version: int) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version: int, body: bytes) -> None:
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[0] > version:
+                return
+            self._entries[key] = (version, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+#GET /logs/{id} bodies by log id and version
+log_responses = ResponseCache(maxsize=int(os.environ.get("LOG_RESPONSE_CACHE_SIZE", 1024)))
+
+@event.listens_for(DailyLog.__table__, "after_drop")
+def _clear_log_responses(target, connection, **kw):
+    log_responses.clear()
+
+#the food of every entry through the cache, keyed by food id
+def resolve_foods(session: Session, entries: Iterable[FoodEntry], cache: FoodCache = food_cache) -> Dict[int, CachedFood]:
+    return cache.get_many(session, [entry.food_id for entry in entries])
+
+#totals of already loaded entries without touching entry.food, same fields as totals.log_totals
+def entries_totals(session: Session, entries: List[FoodEntry], cache: FoodCache = food_cache) -> Dict[str, float]:
+    foods = resolve_foods(session, entries, cache)
+    totals = {"calories": 0.0, "protein": 0.0, "carbs": 0.0, "fat": 0.0}
+    for entry in entries:
+        food = foods[entry.food_id]
+        for macro in totals:
+            totals[macro] += entry.quantity * getattr(food, macro)
+    totals["entry_count"] = len(entries)
+    return totals
@@ -0,0 +1,69 @@
+from typing import List, Optional
+import os
+
+from dotenv import load_dotenv
+
+#postgres connection url from the environment (or .env), driver picks the dbapi: psycopg2 or asyncpg
+def database_url(driver: str = "psycopg2", database: str = None, host: str = None, port: str = None) -> str:
+    load_dotenv()
+    user = os.environ.get("POSTGRES_USER")
+    password = os.environ.get("POSTGRES_PW")
+    db = database or os.environ.get("POSTGRES_DB")
+    host = host or os.environ.get("POSTGRES_HOST", "localhost") #postgres running from docker image
+    port = port or os.environ.get("POSTGRES_PORT", 5432)
+    return f"postgresql+{driver}://{user}:{password}@{host}:{port}/{db}"
+
+#read replicas from POSTGRES_REPLICAS, comma separated host[:port][/database] with the primary's credentials,
+#the port and database default to the primary's
+def replica_urls(driver: str = "psycopg2") -> List[str]:
+    load_dotenv()
+    urls = []
+    for replica in filter(None, (item.strip() for item in os.environ.get("POSTGRES_REPLICAS", "").split(","))):
+        address, _, database = replica.partition("/")
+        host, _, port = address.partition(":")
+        urls.append(database_url(driver, database or None, host or None, port or None))
+    return urls
+
+#ReplicaRouter keyword arguments: seconds between replica health checks and, if set,
+#the replication lag in seconds past which a replica counts as down
+def router_options() -> dict:
+    load_dotenv()
+    options = {"check_interval": float(os.environ.get("POSTGRES_REPLICA_CHECK_INTERVAL", 10))}
+    if os.environ.get("POSTGRES_REPLICA_MAX_LAG"):
+        options["max_lag"] = float(os.environ["POSTGRES_REPLICA_MAX_LAG"])
+    return options
+
+def _flag(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+#EntryWriter keyword arguments when ENTRY_WRITE_BEHIND is on, None when entries are written directly:
+#a batch is written every ENTRY_BATCH_DELAY_MS milliseconds or ENTRY_BATCH_SIZE entries, whichever
+#comes first, with at most ENTRY_QUEUE_SIZE entries waiting
+def write_behind_options() -> Optional[dict]:
+    load_dotenv()
+    if not _flag(os.environ.get("ENTRY_WRITE_BEHIND", "false")):
+        return None
+    return {
+        "max_batch": int(os.environ.get("ENTRY_BATCH_SIZE", 500)),
+        "max_delay": float(os.environ.get("ENTRY_BATCH_DELAY_MS", 50)) / 1000,
+        "maxsize": int(os.environ.get("ENTRY_QUEUE_SIZE", 10_000)),
+    }
+
+#create_engine/create_async_engine keyword arguments for the pool and per-connection statement timeout,
+#POSTGRES_STATEMENT_TIMEOUT is in milliseconds, 0 (the default) leaves it to the server
+def engine_options(driver: str = "psycopg2") -> dict:
+    load_dotenv()
+    options = {
+        "pool_size": int(os.environ.get("POSTGRES_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("POSTGRES_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.environ.get("POSTGRES_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.environ.get("POSTGRES_POOL_RECYCLE", -1)),
+        "pool_pre_ping": _flag(os.environ.get("POSTGRES_POOL_PRE_PING", "true")),
+    }
+    timeout = int(os.environ.get("POSTGRES_STATEMENT_TIMEOUT", 0))
+    if timeout:
+        if driver == "asyncpg":
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(timeout)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={timeout}"}
+    return options
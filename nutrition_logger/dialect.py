@@ -0,0 +1,16 @@
+import datetime
+
+from sqlalchemy import Date, func, literal
+from sqlalchemy.dialects import postgresql, sqlite
+
+#INSERT construct supporting ON CONFLICT for whichever database the bind talks to
+def upsert(bind, table):
+    if bind.dialect.name == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+#whole days from epoch to a date expression, as a number
+def days_since(bind, date, epoch: datetime.date):
+    if bind.dialect.name == "sqlite":
+        return func.julianday(date) - func.julianday(epoch.isoformat())
+    return date - literal(epoch, Date)
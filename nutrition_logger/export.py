@@ -0,0 +1,94 @@
+from __future__ import annotations
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional, Tuple
+import csv, datetime, io, json
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from nutrition_logger.archive import ColdArchive
+from nutrition_logger.cache import food_cache
+from nutrition_logger.models import DailyLog, Food, FoodEntry
+from nutrition_logger.rollups import to_date
+from nutrition_logger.totals import MACROS
+
+#one row per entry, macros are what was eaten (quantity x the food's macros), a log without entries is one row of blanks
+EXPORT_COLUMNS = ("date", "log_id", "entry_id", "food_id", "food", "manufacturer", "serving_size", "unit", "quantity", *MACROS)
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+CHUNK_SIZE = 1000
+
+def export_query(user_id: int, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None):
+    stmt = (
+        select(
+            DailyLog.date, DailyLog.id, FoodEntry.id, Food.id, Food.name, Food.manufacturer, Food.serving_size, Food.unit,
+            FoodEntry.quantity, *[FoodEntry.quantity * getattr(Food, macro) for macro in MACROS],
+        )
+        .select_from(DailyLog)
+        .outerjoin(FoodEntry, FoodEntry.daily_log_id == DailyLog.id)
+        .outerjoin(Food, Food.id == FoodEntry.food_id)
+        .where(DailyLog.user_id == user_id)
+        .order_by(DailyLog.date, FoodEntry.id)
+    )
+    if start is not None:
+        stmt = stmt.where(DailyLog.date >= start)
+    if end is not None:
+        stmt = stmt.where(DailyLog.date <= end)
+    return stmt
+
+#rows of one archived month, food details come from the foods table through the cache, archived logs
+#without entries are blank rows like in export_query
+def archived_rows(session: Session, archive: ColdArchive, year: int, month: int, user_id: int, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> List[tuple]:
+    entries = archive.month_entries(year, month, [user_id], start, end)
+    columns = [entries[name].tolist() for name in ("entry_day", "entry_log_id", "entry_id", "food_id", "quantity", *(f"entry_{macro}" for macro in MACROS))]
+    foods = food_cache.get_many(session, set(columns[3]))
+    rows = []
+    for day, log_id, entry_id, food_id, quantity, *macros in zip(*columns):
+        food = foods.get(food_id)
+        details = (food.name, food.manufacturer, food.serving_size, food.unit) if food else (None, None, None, None)
+        rows.append((to_date(day), log_id, entry_id, food_id, *details, quantity, *macros))
+    logs = archive.month_logs(year, month, [user_id], start, end)
+    empty = logs["entry_count"] == 0
+    for day, log_id in zip(logs["day"][empty].tolist(), logs["log_id"][empty].tolist()):
+        rows.append((to_date(day), log_id, *(None for _ in EXPORT_COLUMNS[2:])))
+    #stable, entries keep their order within a day
+    rows.sort(key=lambda row: row[0])
+    return rows
+
+#(header, encode rows) for a format, every chunk is complete lines so it can be flushed as is
+def encoder(format: str) -> Tuple[bytes, Callable[[Iterable[tuple]], bytes]]:
+    if format == "ndjson":
+        def encode(rows):
+            return "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=str) + "\n" for row in rows).encode()
+        return b"", encode
+    if format == "csv":
+        def encode(rows):
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            return buffer.getvalue().encode()
+        return encode([EXPORT_COLUMNS]), encode
+    raise ValueError(f"unsupported export format: {format!r}")
+
+#a user's whole history (archived months first) as encoded chunks, rows come through a server-side cursor
+#chunk_size at a time so memory stays flat however long the history is
+def export_user(session: Session, user_id: int, format: str = "ndjson", start: Optional[datetime.date] = None, end: Optional[datetime.date] = None, archive: Optional[ColdArchive] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    header, encode = encoder(format)
+    if header:
+        yield header
+    if archive is not None:
+        for year, month in archive.covering(start, end):
+            yield encode(archived_rows(session, archive, year, month, user_id, start, end))
+    result = session.execute(export_query(user_id, start, end).execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        yield encode(rows)
+
+#async counterpart for streaming responses
+async def export_user_async(session: AsyncSession, user_id: int, format: str = "ndjson", start: Optional[datetime.date] = None, end: Optional[datetime.date] = None, archive: Optional[ColdArchive] = None, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    header, encode = encoder(format)
+    if header:
+        yield header
+    if archive is not None:
+        for year, month in archive.covering(start, end):
+            yield encode(await session.run_sync(archived_rows, archive, year, month, user_id, start, end))
+    result = await session.stream(export_query(user_id, start, end).execution_options(yield_per=chunk_size))
+    async for rows in result.partitions():
+        yield encode(rows)
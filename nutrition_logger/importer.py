@@ -0,0 +1,144 @@
+from __future__ import annotations
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import csv, io, itertools, json, os
+
+from sqlalchemy import Connection, select, text
+from sqlalchemy.exc import DBAPIError
+
+from nutrition_logger.cache import food_cache
+from nutrition_logger.dialect import upsert
+from nutrition_logger.models import Food
+from nutrition_logger.schema import FoodCreate, validate_many
+from nutrition_logger.totals import FOOD_FIELDS, MACROS, apply_deltas, food_change_deltas
+
+FOOD_COLUMNS = list(FoodCreate.model_fields)
+STAGING_TABLE = "foods_import_staging"
+
+#what happened to a load: rows read, rows written (inserted or updated on name) and rows rejected
+class ImportReport:
+    def __init__(self):
+        self.read = 0
+        self.written = 0
+        self.rejected = 0
+
+    def __repr__(self):
+        return f"ImportReport(read={self.read}, written={self.written}, rejected={self.rejected})"
+
+#called with the line number, the raw row and the reason for every rejected row
+ErrorHandler = Callable[[Optional[int], dict, str], None]
+
+#yield (line number, row) from a csv or jsonl file one line at a time
+def read_rows(path: str, format: Optional[str] = None) -> Iterator[Tuple[int, dict]]:
+    format = format or os.path.splitext(path)[1].lstrip(".").lower()
+    with open(path, newline="", encoding="utf-8") as file:
+        if format == "csv":
+            reader = csv.DictReader(file)
+            for row in reader:
+                #empty cells fall back to the schema defaults
+                yield reader.line_num, {key: value for key, value in row.items() if value not in ("", None)}
+        elif format in ("jsonl", "ndjson"):
+            for line_number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError:
+                    #passed on as is so validation rejects it instead of the whole load failing
+                    yield line_number, line.strip()
+        else:
+            raise ValueError(f"unsupported food catalog format: {format!r}")
+
+#validate a batch against FoodCreate, rejected rows go to on_error, the last row wins for a repeated name
+def validate_batch(batch: List[Tuple[int, dict]], on_error: ErrorHandler) -> List[dict]:
+    checked = validate_many(FoodCreate, [row for _, row in batch])
+    valid: Dict[str, dict] = {}
+    for index, (line_number, row) in enumerate(batch):
+        if index in checked.errors:
+            on_error(line_number, row, "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in checked.errors[index]))
+            continue
+        food = checked.valid[index]
+        valid[food.name] = food.model_dump()
+    return list(valid.values())
+
+def _upsert_statement(connection):
+    table = Food.__table__
+    stmt = upsert(connection, table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.name],
+        set_={column: stmt.excluded[column] for column in FOOD_COLUMNS if column != "name"},
+    )
+
+def _write_insert(connection, rows):
+    #RETURNING makes sqlalchemy send the executemany as multi-row VALUES pages (insertmanyvalues)
+    #instead of one statement per row
+    connection.execute(_upsert_statement(connection).returning(Food.id), rows)
+
+#postgres only: COPY the batch into a temp staging table, then upsert from it in one statement
+def _write_copy(connection, rows):
+    connection.execute(text(
+        f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} "
+        f"(LIKE {Food.__tablename__} INCLUDING DEFAULTS INCLUDING GENERATED) ON COMMIT DROP"
+    ))
+    connection.execute(text(f"TRUNCATE {STAGING_TABLE}"))
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([row[column] for column in FOOD_COLUMNS] for row in rows)
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {STAGING_TABLE} ({', '.join(FOOD_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+    staged = select(*[text(column) for column in FOOD_COLUMNS]).select_from(text(STAGING_TABLE))
+    connection.execute(_upsert_statement(connection).from_select(FOOD_COLUMNS, staged))
+
+WRITERS = {"insert": _write_insert, "copy": _write_copy}
+
+#upserting on name can change foods that are already logged, keep daily_totals and the log versions in line
+def _write_batch(connection, rows, writer):
+    stmt = select(Food.id, *[getattr(Food, field) for field in FOOD_FIELDS]).where(Food.name.in_([row["name"] for row in rows]))
+    old = {row.name: row for row in connection.execute(stmt)}
+    writer(connection, rows)
+    food_cache.invalidate(row.id for row in old.values())
+
+    changes = {}
+    for row in rows:
+        previous = old.get(row["name"])
+        if previous is not None and any(row[field] != getattr(previous, field) for field in FOOD_FIELDS):
+            changes[previous.id] = ([getattr(previous, macro) for macro in MACROS], [row[macro] for macro in MACROS])
+    apply_deltas(connection, food_change_deltas(connection, changes))
+
+#stream a catalog file into foods in batches, each batch in its own savepoint so a failing batch
+#is retried row by row and only the offending rows are rejected, the caller owns the transaction
+def import_foods(connection: Connection, path: str, format: Optional[str] = None, batch_size: int = 5000, method: str = "insert", on_error: Optional[ErrorHandler] = None) -> ImportReport:
+    if method == "copy" and connection.dialect.name != "postgresql":
+        raise ValueError("COPY imports need a postgresql connection")
+    writer = WRITERS[method]
+    report = ImportReport()
+
+    def reject(line_number, row, reason):
+        report.rejected += 1
+        if on_error is not None:
+            on_error(line_number, row, reason)
+
+    rows = read_rows(path, format)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        report.read += len(batch)
+        valid = validate_batch(batch, reject)
+        if not valid:
+            continue
+        try:
+            with connection.begin_nested():
+                _write_batch(connection, valid, writer)
+            report.written += len(valid)
+        except DBAPIError:
+            for row in valid:
+                try:
+                    with connection.begin_nested():
+                        _write_batch(connection, [row], _write_insert)
+                    report.written += 1
+                except DBAPIError as error:
+                    reject(None, row, str(error.orig).strip())
+    return report
@@ -0,0 +1,133 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+import heapq, logging, threading, time
+
+from sqlalchemy import Engine, event
+
+logger = logging.getLogger(__name__)
+
+#statements, DB time and the slowest statements of one unit of work (a request, a session scope, a test).
+#the same SQL text run repeat_threshold times or more with different parameters is most likely a lazy load in a loop
+class QueryStats:
+    def __init__(self, name: str = "", slowest: int = 5, repeat_threshold: int = 3):
+        self.name = name
+        self.count = 0
+        self.time = 0.0
+        self.statements: Dict[str, List] = {}
+        self.repeat_threshold = repeat_threshold
+        self._slowest_size = slowest
+        self._slowest: List[Tuple[float, int, str]] = []
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.time += duration
+        seen = self.statements.setdefault(statement, [0, 0.0])
+        seen[0] += 1
+        seen[1] += duration
+        #the count breaks ties so statements themselves are never compared
+        item = (duration, self.count, statement)
+        if len(self._slowest) < self._slowest_size:
+            heapq.heappush(self._slowest, item)
+        else:
+            heapq.heappushpop(self._slowest, item)
+
+    def slowest(self) -> List[Tuple[float, str]]:
+        return [(duration, statement) for duration, _, statement in sorted(self._slowest, reverse=True)]
+
+    #likely N+1 patterns: (statement, times run), most repeated first
+    def repeated(self) -> List[Tuple[str, int]]:
+        return [(statement, count) for statement, count in self.statements_by_count() if count >= self.repeat_threshold]
+
+    def statements_by_count(self) -> List[Tuple[str, int]]:
+        return sorted(((statement, seen[0]) for statement, seen in self.statements.items()), key=lambda item: -item[1])
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "statements": self.count,
+            "db_time": self.time,
+            "slowest": [{"seconds": duration, "statement": statement} for duration, statement in self.slowest()],
+            "repeated": [{"statement": statement, "count": count} for statement, count in self.repeated()],
+        }
+
+#process-wide totals over every finished unit of work
+class QueryMetrics:
+    def __init__(self, slowest: int = 10):
+        self.units = 0
+        self.statements = 0
+        self.db_time = 0.0
+        self.n_plus_one = 0
+        self._slowest_size = slowest
+        self._slowest: List[Tuple[float, str, str]] = []
+        self._lock = threading.Lock()
+
+    def add(self, stats: QueryStats) -> None:
+        with self._lock:
+            self.units += 1
+            self.statements += stats.count
+            self.db_time += stats.time
+            if stats.repeated():
+                self.n_plus_one += 1
+            for duration, statement in stats.slowest():
+                item = (duration, stats.name, statement)
+                if len(self._slowest) < self._slowest_size:
+                    heapq.heappush(self._slowest, item)
+                elif item > self._slowest[0]:
+                    heapq.heapreplace(self._slowest, item)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "units": self.units,
+                "statements": self.statements,
+                "db_time": self.db_time,
+                "n_plus_one": self.n_plus_one,
+                "slowest": [
+                    {"seconds": duration, "unit": name, "statement": statement}
+                    for duration, name, statement in sorted(self._slowest, reverse=True)
+                ],
+            }
+
+query_metrics = QueryMetrics()
+
+#units of work active in this thread/task, nested units all see the statements of the inner ones
+_active: ContextVar[Tuple[QueryStats, ...]] = ContextVar("query_stats", default=())
+
+#record every statement any engine runs in this context (sync, async or threads started inside are separate),
+#finished units go to query_metrics and likely N+1 patterns are logged as warnings
+@contextmanager
+def track_queries(name: str = "", slowest: int = 5, repeat_threshold: int = 3, metrics: Optional[QueryMetrics] = query_metrics) -> Iterator[QueryStats]:
+    stats = QueryStats(name, slowest, repeat_threshold)
+    token = _active.set(_active.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _active.reset(token)
+        if metrics is not None:
+            metrics.add(stats)
+        for statement, count in stats.repeated():
+            logger.warning("%s: statement ran %d times, likely N+1: %s", name or "unit of work", count, " ".join(statement.split())[:200])
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    if _active.get():
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    active = _active.get()
+    starts = conn.info.get("query_start")
+    if not active or not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    for stats in active:
+        stats.record(statement, duration)
+
+#a statement that raised never reaches after_cursor_execute
+@event.listens_for(Engine, "handle_error")
+def _drop_timer(context):
+    starts = context.connection.info.get("query_start") if context.connection is not None else None
+    if starts and context.execution_context is not None:
+        starts.pop()
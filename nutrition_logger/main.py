@@ -1,29 +1,52 @@
-from dotenv import load_dotenv
-import os
-
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-from models import Base, User, DailyLog, Food, FoodEntry
-
-load_dotenv()
-
-user = os.environ.get("POSTGRES_USER")
-password = os.environ.get("POSTGRES_PW")
-db = os.environ.get("POSTGRES_DB")
-host = os.environ.get("POSTGRES_HOST", "localhost") #postgres running from docker image
-port = os.environ.get("POSTGRES_PORT", 5432)
-
-url = f"postgresql://{user}:{password}@{host}:{port}/{db}"
-
-engine = create_engine(url)
-
-#create all tables
-Base.metadata.create_all(engine)
-
-Session = sessionmaker(bind=engine)
-
-#create a session
-session = Session()
-
-
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator
+
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.orm import Session as OrmSession, sessionmaker
+
+from nutrition_logger.config import database_url, engine_options, replica_urls, router_options
+from nutrition_logger.instrumentation import track_queries
+from nutrition_logger.models import Base, User, DailyLog, Food, FoodEntry
+from nutrition_logger.pool import TimedQueuePool
+from nutrition_logger.routing import ReplicaRouter, RoutingSession
+
+#bound by get_engine(), tables are created by `python -m nutrition_logger bootstrap`, not on import,
+#reads go to the replicas in POSTGRES_REPLICAS (if any) until the session writes
+Session = sessionmaker(class_=RoutingSession)
+
+#importing this module does no I/O, the environment is read and the engines built on first use
+@lru_cache(maxsize=None)
+def get_engine() -> Engine:
+    engine = create_engine(database_url(), poolclass=TimedQueuePool, **engine_options())
+    replicas = [create_engine(url, poolclass=TimedQueuePool, **engine_options()) for url in replica_urls()]
+    Session.configure(bind=engine, router=ReplicaRouter(engine, replicas, **router_options()))
+    return engine
+
+def get_router() -> ReplicaRouter:
+    get_engine()
+    return Session.kw["router"]
+
+#`from nutrition_logger.main import engine` keeps working, it just builds the engine at that point
+def __getattr__(name):
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+#one session per unit of work: committed when the block finishes, rolled back if it raises, always closed,
+#its statements are tracked as one unit in instrumentation.query_metrics, primary=True keeps its reads
+#off the replicas for work that reads and then writes based on what it read
+@contextmanager
+def session_scope(name: str = "session_scope", primary: bool = False) -> Iterator[OrmSession]:
+    get_engine()
+    with track_queries(name), Session() as session:
+        if primary:
+            session.use_primary()
+        with session.begin():
+            yield session
+
+#FastAPI style dependency for sync routes, the route decides when to commit
+def get_session() -> Iterator[OrmSession]:
+    get_engine()
+    with Session() as session:
+        yield session
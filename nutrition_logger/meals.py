@@ -0,0 +1,78 @@
+from collections import Counter, defaultdict
+from typing import List, Optional, Sequence
+import datetime
+
+from sqlalchemy import Row, insert, select
+from sqlalchemy.orm import Session
+
+from nutrition_logger.dialect import upsert
+from nutrition_logger.models import DailyLog, FoodEntry, User
+from nutrition_logger.quickadd import add_entries
+from nutrition_logger.schema import BulkEntryCreate
+from nutrition_logger.totals import TOTAL_COLUMNS, apply_deltas, food_macros
+
+#ids of the logs for every (user_id, date) pair, created where missing, in one statement.
+#the conflict update is a no-op that makes RETURNING include logs that already existed
+def get_or_create_logs(session: Session, keys) -> dict:
+    keys = sorted(set(keys))
+    if not keys:
+        return {}
+    table = DailyLog.__table__
+    stmt = upsert(session.get_bind(), table).values([{"user_id": user_id, "date": date} for user_id, date in keys])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.date],
+        set_={"user_id": stmt.excluded.user_id},
+    ).returning(table.c.id, table.c.user_id, table.c.date)
+    return {(row.user_id, row.date): row.id for row in session.execute(stmt)}
+
+#id of the user's log for date (today by default) without ever failing on _user_date_uc:
+#concurrent callers for the same day all get the same row back, no exception-driven retry
+def get_or_create_log(session: Session, user_id: int, date: Optional[datetime.date] = None) -> int:
+    date = date or datetime.date.today()
+    return get_or_create_logs(session, [(user_id, date)])[(user_id, date)]
+
+#add an entry to the user's log for date (today by default), creating the log if needed,
+#flushed so daily_totals is updated, the caller commits
+def log_entry(session: Session, user_id: int, food_id: int, quantity: float = 1.0, date: Optional[datetime.date] = None) -> FoodEntry:
+    entry = FoodEntry(daily_log_id=get_or_create_log(session, user_id, date), food_id=food_id, quantity=quantity)
+    session.add(entry)
+    session.flush()
+    return entry
+
+#bulk sync of offline-logged entries spread over many users and days: one upsert for the logs,
+#one multi-row insert for the entries, one batch of daily_totals deltas and one of user_foods counts,
+#whatever the batch size. unknown food or user ids are a ValueError before anything is written.
+#these are core statements, objects already loaded in the session do not see the new entries.
+#returns (id, daily_log_id, food_id, quantity) rows in the order of items
+def log_entries(session: Session, items: Sequence[BulkEntryCreate]) -> List[Row]:
+    if not items:
+        return []
+    foods = food_macros(session, {item.food_id for item in items})
+    unknown = sorted({item.food_id for item in items} - foods.keys())
+    if unknown:
+        raise ValueError(f"unknown food ids {unknown}")
+    user_ids = {item.user_id for item in items}
+    unknown = sorted(user_ids - set(session.scalars(select(User.id).where(User.id.in_(user_ids)))))
+    if unknown:
+        raise ValueError(f"unknown user ids {unknown}")
+
+    logs = get_or_create_logs(session, [(item.user_id, item.date) for item in items])
+    rows = [
+        {"daily_log_id": logs[(item.user_id, item.date)], "food_id": item.food_id, "quantity": item.quantity}
+        for item in items
+    ]
+    table = FoodEntry.__table__
+    stmt = insert(table).returning(
+        table.c.id, table.c.daily_log_id, table.c.food_id, table.c.quantity, sort_by_parameter_order=True,
+    )
+    entries = list(session.execute(stmt, rows))
+
+    deltas = defaultdict(lambda: [0.0] * len(TOTAL_COLUMNS))
+    for entry in entries:
+        delta = deltas[entry.daily_log_id]
+        for i, value in enumerate(foods[entry.food_id]):
+            delta[i] += entry.quantity * value
+        delta[-1] += 1
+    apply_deltas(session.connection(), deltas)
+    add_entries(session.connection(), Counter((entry.daily_log_id, entry.food_id) for entry in entries))
+    return entries
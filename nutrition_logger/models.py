@@ -1,9 +1,13 @@
 from __future__ import annotations
-from typing import List
+from typing import List, Optional
 import datetime
 
-from sqlalchemy import ForeignKey, UniqueConstraint, Date
+from sqlalchemy import DDL, Computed, ForeignKey, Index, UniqueConstraint, Date, event, func, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+#registers the postgres full-text functions (to_tsvector) before the search index below is built
+import sqlalchemy.dialects.postgresql
+
+from nutrition_logger.units import base_amount_sql, base_unit_sql, per_basis_sql
 
 class Base(DeclarativeBase):
     pass
@@ -24,7 +28,7 @@ class Food(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(unique=True, nullable=False)
-    manufacturer: Mapped[str] = mapped_column(unique=True, nullable=False)
+    manufacturer: Mapped[str] = mapped_column(nullable=False)
     serving_size: Mapped[float] = mapped_column(nullable=False)
     unit: Mapped[str] = mapped_column(nullable=False)
     calories: Mapped[float] = mapped_column(nullable=False)
@@ -32,6 +36,43 @@ class Food(Base):
     carbs: Mapped[float] = mapped_column(nullable=False)
     fat: Mapped[float] = mapped_column(nullable=False)
 
+    #normalized by the database on every write: the serving in g, ml or its own unit and the macros
+    #per 100 of that, so foods entered in different units compare directly. totals still count servings
+    base_unit: Mapped[str] = mapped_column(Computed(base_unit_sql()), nullable=False)
+    base_amount: Mapped[float] = mapped_column(Computed(base_amount_sql()), nullable=False)
+    calories_per_100: Mapped[Optional[float]] = mapped_column(Computed(per_basis_sql("calories")))
+    protein_per_100: Mapped[Optional[float]] = mapped_column(Computed(per_basis_sql("protein")))
+    carbs_per_100: Mapped[Optional[float]] = mapped_column(Computed(per_basis_sql("carbs")))
+    fat_per_100: Mapped[Optional[float]] = mapped_column(Computed(per_basis_sql("fat")))
+
+    #read the generated columns back on updates too, not only inserts
+    __mapper_args__ = {"eager_defaults": True}
+
+#text the food search indexes are built over, search queries must use the same expression to hit them
+def food_search_document():
+    return Food.name + " " + Food.manufacturer
+
+#the 'simple' configuration neither stems nor drops stop words, which suits product names
+def food_search_vector():
+    return func.to_tsvector(text("'simple'"), food_search_document())
+
+def _trigram_available(ddl, target, bind, **kw):
+    stmt = text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    return bind.execute(stmt).first() is not None
+
+#postgres search indexes: full-text for word prefixes, trigram for typos when the pg_trgm extension is there
+trigram_extension = DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql", callable_=_trigram_available)
+event.listen(Food.__table__, "before_create", trigram_extension)
+Index(
+    "ix_foods_search_fts", food_search_vector(), postgresql_using="gin",
+).ddl_if(dialect="postgresql")
+#exact name prefixes in name order, the ranked candidates of search_foods
+Index("ix_foods_name_prefix", func.lower(Food.name).collate("C")).ddl_if(dialect="postgresql")
+Index(
+    "ix_foods_search_trgm", func.lower(food_search_document()).label("search_text"),
+    postgresql_using="gin", postgresql_ops={"search_text": "gin_trgm_ops"},
+).ddl_if(dialect="postgresql", callable_=_trigram_available)
+
 #table of logs, user can only have one log per date
 class DailyLog(Base):
     __tablename__ = 'daily_logs'
@@ -39,11 +80,14 @@ class DailyLog(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     date: Mapped[datetime.date] = mapped_column(Date, nullable=False, default=datetime.date.today)
     user_id: Mapped[int] = mapped_column(ForeignKey('users.id'), nullable=False)
+    #bumped with daily_totals whenever the log's entries (or the foods they show) change, see totals.apply_deltas
+    version: Mapped[int] = mapped_column(nullable=False, server_default=text("0"))
 
     user: Mapped[User] = relationship(back_populates="logs")
     food_entries: Mapped[List[FoodEntry]] = relationship(back_populates="daily_log", cascade="all, delete-orphan")
 
-    __table_args__ = (UniqueConstraint('user_id', 'date', name='_user_date_uc'),)
+    #the unique index also serves per-user date ranges, on postgres it carries the id so those are index-only
+    __table_args__ = (UniqueConstraint('user_id', 'date', name='_user_date_uc', postgresql_include=['id']),)
 
 #table of food entries associated with individual logs
 class FoodEntry(Base):
@@ -57,3 +101,101 @@ class FoodEntry(Base):
     daily_log: Mapped[DailyLog] = relationship(back_populates="food_entries")
     food: Mapped[Food] = relationship()
 
+    #entries by log (totals, loading a log) and by food (revaluing totals when macros change),
+    #each covering the columns those queries read
+    __table_args__ = (
+        Index('ix_food_entries_daily_log_id', 'daily_log_id', postgresql_include=['food_id', 'quantity']),
+        Index('ix_food_entries_food_id', 'food_id', postgresql_include=['daily_log_id', 'quantity']),
+    )
+
+
+#denormalized totals per log, kept in sync incrementally by nutrition_logger.totals
+class DailyTotals(Base):
+    __tablename__ = 'daily_totals'
+
+    daily_log_id: Mapped[int] = mapped_column(ForeignKey('daily_logs.id', ondelete='CASCADE'), primary_key=True)
+    calories: Mapped[float] = mapped_column(nullable=False, default=0.0)
+    protein: Mapped[float] = mapped_column(nullable=False, default=0.0)
+    carbs: Mapped[float] = mapped_column(nullable=False, default=0.0)
+    fat: Mapped[float] = mapped_column(nullable=False, default=0.0)
+    entry_count: Mapped[int] = mapped_column(nullable=False, default=0)
+
+    #stored totals for a user's date range read straight from the index
+    __table_args__ = (
+        Index(
+            'ix_daily_totals_covering', 'daily_log_id',
+            postgresql_include=['calories', 'protein', 'carbs', 'fat', 'entry_count'],
+        ).ddl_if(dialect='postgresql'),
+    )
+
+#quick-add: one row per food a user has logged, kept in sync on every entry insert and delete by
+#nutrition_logger.quickadd. score sums 2^(days since quickadd.EPOCH / half-life) over the entries, so
+#ordering by it is ordering by a frequency where every entry's weight halves with each half-life of age
+class UserFood(Base):
+    __tablename__ = 'user_foods'
+
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    food_id: Mapped[int] = mapped_column(ForeignKey('foods.id', ondelete='CASCADE'), primary_key=True)
+    entry_count: Mapped[int] = mapped_column(nullable=False)
+    score: Mapped[float] = mapped_column(nullable=False)
+    last_date: Mapped[datetime.date] = mapped_column(Date, nullable=False)
+    #latest date of the food's entries moved to the cold archive, what last_date falls back to once
+    #no later entry is left in the database
+    archived_date: Mapped[Optional[datetime.date]] = mapped_column(Date)
+
+    #most frequent and most recent foods of a user, each read backwards from one index
+    __table_args__ = (
+        Index('ix_user_foods_frequent', 'user_id', 'score', postgresql_include=['food_id', 'entry_count', 'last_date']),
+        Index('ix_user_foods_recent', 'user_id', 'last_date', 'food_id', postgresql_include=['entry_count', 'score']),
+    )
+
+#a user's daily goals, a macro left null has no target
+class Target(Base):
+    __tablename__ = 'targets'
+
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    calories: Mapped[Optional[float]] = mapped_column()
+    protein: Mapped[Optional[float]] = mapped_column()
+    carbs: Mapped[Optional[float]] = mapped_column()
+    fat: Mapped[Optional[float]] = mapped_column()
+    updated_at: Mapped[datetime.datetime] = mapped_column(nullable=False, server_default=func.now(), onupdate=func.now())
+
+    #updated_at comes back from the flush, so a target serializes without a reload
+    __mapper_args__ = {"eager_defaults": True}
+
+#how a user did against their targets over the day, week or month ending on as_of, written by
+#nutrition_logger.adherence: averages per logged day, their ratio to the target and the days whose
+#calories were within tolerance of it
+class Adherence(Base):
+    __tablename__ = 'adherence'
+
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    period: Mapped[str] = mapped_column(primary_key=True)
+    as_of: Mapped[datetime.date] = mapped_column(Date, primary_key=True)
+    days: Mapped[int] = mapped_column(nullable=False)
+    days_on_target: Mapped[int] = mapped_column(nullable=False)
+    calories: Mapped[Optional[float]] = mapped_column()
+    protein: Mapped[Optional[float]] = mapped_column()
+    carbs: Mapped[Optional[float]] = mapped_column()
+    fat: Mapped[Optional[float]] = mapped_column()
+    calories_ratio: Mapped[Optional[float]] = mapped_column()
+    protein_ratio: Mapped[Optional[float]] = mapped_column()
+    carbs_ratio: Mapped[Optional[float]] = mapped_column()
+    fat_ratio: Mapped[Optional[float]] = mapped_column()
+
+#user id ranges the adherence job has finished for a date, written in the same transaction as their results
+class AdherenceChunk(Base):
+    __tablename__ = 'adherence_chunks'
+
+    as_of: Mapped[datetime.date] = mapped_column(Date, primary_key=True)
+    first_user_id: Mapped[int] = mapped_column(primary_key=True)
+    last_user_id: Mapped[int] = mapped_column(nullable=False)
+    users: Mapped[int] = mapped_column(nullable=False)
+    finished_at: Mapped[datetime.datetime] = mapped_column(nullable=False, server_default=func.now())
+
+#upgrade steps already applied to this database, written by nutrition_logger.bootstrap
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+
+    name: Mapped[str] = mapped_column(primary_key=True)
+    applied_at: Mapped[datetime.datetime] = mapped_column(nullable=False, server_default=func.now())
@@ -0,0 +1,56 @@
+from __future__ import annotations
+from typing import Dict
+import threading, time
+
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+#queue pools that time how long every checkout waited for a connection, pool_stats() reads them
+class _TimedPool:
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self._wait_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            with self._wait_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._wait_lock:
+                self.waits += 1
+                self.wait_time += waited
+                self.max_wait = max(self.max_wait, waited)
+
+class TimedQueuePool(_TimedPool, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(_TimedPool, AsyncAdaptedQueuePool):
+    pass
+
+#live numbers for an engine's pool, wait figures are seconds and only there for the timed pools
+def pool_stats(engine) -> Dict[str, float]:
+    pool = getattr(engine, "sync_engine", engine).pool
+    stats = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+    }
+    if isinstance(pool, _TimedPool):
+        with pool._wait_lock:
+            stats.update({
+                "waits": pool.waits,
+                "wait_time": pool.wait_time,
+                "max_wait": pool.max_wait,
+                "timeouts": pool.timeouts,
+            })
+    return stats
@@ -0,0 +1,192 @@
+from __future__ import annotations
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import datetime
+
+from sqlalchemy import Date, Float, Integer, bindparam, case, cast, delete, event, func, insert, inspect, literal, or_, select, tuple_, union_all, update
+from sqlalchemy.orm import Session
+
+from nutrition_logger.dialect import days_since, upsert
+from nutrition_logger.models import DailyLog, Food, FoodEntry, UserFood
+
+#entry weights are 2^(age in half-lives) relative to EPOCH instead of decayed in place, which keeps every
+#stored score valid forever (ratios between them are the decayed ones) and float64 within range until 2100
+EPOCH = datetime.date(2020, 1, 1)
+HALF_LIFE_DAYS = 30.0
+
+class QuickAddFood(NamedTuple):
+    food_id: int
+    name: str
+    manufacturer: str
+    entry_count: int
+    score: float
+    last_date: datetime.date
+
+class QuickAdd(NamedTuple):
+    frequent: List[QuickAddFood]
+    recent: List[QuickAddFood]
+
+#a stored score as of today, where an entry made today weighs 1 and one a half-life old 0.5
+def decayed(score: float, today: Optional[datetime.date] = None) -> float:
+    today = today or datetime.date.today()
+    return score / 2.0 ** ((today - EPOCH).days / HALF_LIFE_DAYS)
+
+def _weight(bind, date):
+    return func.power(literal(2.0, Float), cast(days_since(bind, date, EPOCH), Float) / HALF_LIFE_DAYS)
+
+def _last_date(table, excluded):
+    return case((excluded.last_date > table.c.last_date, excluded.last_date), else_=table.c.last_date)
+
+#count entries in, counts maps (daily_log_id, food_id) to the number of entries added, the user and
+#weight come from the log, one executemany whatever the number of pairs
+def add_entries(connection, counts: Dict[Tuple[int, int], int]) -> None:
+    if not counts:
+        return
+    table = UserFood.__table__
+    count = cast(bindparam("q_count"), Integer)
+    values = select(
+        DailyLog.user_id,
+        cast(bindparam("q_food_id"), Integer),
+        count,
+        count * _weight(connection, DailyLog.date),
+        DailyLog.date,
+    ).where(DailyLog.id == bindparam("q_log_id"))
+    stmt = upsert(connection, table).from_select(["user_id", "food_id", "entry_count", "score", "last_date"], values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.food_id],
+        set_={
+            "entry_count": table.c.entry_count + stmt.excluded.entry_count,
+            "score": table.c.score + stmt.excluded.score,
+            "last_date": _last_date(table, stmt.excluded),
+        },
+    )
+    params = [{"q_log_id": log_id, "q_food_id": food_id, "q_count": n} for (log_id, food_id), n in sorted(counts.items())]
+    connection.execute(stmt, params)
+
+#take entries out, rows are (user_id, food_id, date) of entries already deleted (or moved) in this
+#transaction: counts and scores go down, foods no longer logged leave the table and the others get
+#their last date back from the entries that are left, archived ones included
+def remove_entries(connection, rows: List[Tuple[int, int, datetime.date]]) -> None:
+    if not rows:
+        return
+    table = UserFood.__table__
+    date = bindparam("q_date", type_=Date)
+    stmt = (
+        update(table)
+        .where(table.c.user_id == bindparam("q_user_id"), table.c.food_id == bindparam("q_food_id"))
+        .values(entry_count=table.c.entry_count - 1, score=table.c.score - _weight(connection, date))
+    )
+    connection.execute(stmt, [{"q_user_id": user_id, "q_food_id": food_id, "q_date": day} for user_id, food_id, day in rows])
+
+    pairs = sorted({(user_id, food_id) for user_id, food_id, _ in rows})
+    connection.execute(delete(table).where(tuple_(table.c.user_id, table.c.food_id).in_(pairs), table.c.entry_count <= 0))
+    latest = (
+        select(func.max(DailyLog.date))
+        .join(FoodEntry, FoodEntry.daily_log_id == DailyLog.id)
+        .where(DailyLog.user_id == table.c.user_id, FoodEntry.food_id == table.c.food_id)
+        .scalar_subquery()
+    )
+    archived = table.c.archived_date
+    #rows archived before archived_date existed keep the date they had
+    last_date = case(
+        (archived.is_(None), func.coalesce(latest, table.c.last_date)),
+        (or_(latest.is_(None), archived > latest), archived),
+        else_=latest,
+    )
+    connection.execute(update(table).where(tuple_(table.c.user_id, table.c.food_id).in_(pairs)).values(last_date=last_date))
+
+#entries moved to the cold archive still count, rows are (user_id, food_id, date) with the latest date
+#archived for that food, kept as the date last_date falls back to
+def archive_entries(connection, rows: List[Tuple[int, int, datetime.date]]) -> None:
+    if not rows:
+        return
+    table = UserFood.__table__
+    date = bindparam("q_date", type_=Date)
+    archived = table.c.archived_date
+    stmt = (
+        update(table)
+        .where(table.c.user_id == bindparam("q_user_id"), table.c.food_id == bindparam("q_food_id"))
+        .values(archived_date=case((or_(archived.is_(None), archived < date), date), else_=archived))
+    )
+    connection.execute(stmt, [{"q_user_id": user_id, "q_food_id": food_id, "q_date": day} for user_id, food_id, day in rows])
+
+#recompute user_foods from the entries, for one user or everybody, returns the number of rows written
+def rebuild_user_foods(session: Session, user_id: Optional[int] = None) -> int:
+    table = UserFood.__table__
+    stmt = delete(table)
+    if user_id is not None:
+        stmt = stmt.where(table.c.user_id == user_id)
+    session.execute(stmt)
+
+    aggregate = (
+        select(
+            DailyLog.user_id,
+            FoodEntry.food_id,
+            func.count(FoodEntry.id),
+            func.sum(_weight(session.get_bind(), DailyLog.date)),
+            func.max(DailyLog.date),
+        )
+        .join(DailyLog, DailyLog.id == FoodEntry.daily_log_id)
+        .group_by(DailyLog.user_id, FoodEntry.food_id)
+    )
+    if user_id is not None:
+        aggregate = aggregate.where(DailyLog.user_id == user_id)
+    result = session.execute(insert(table).from_select(["user_id", "food_id", "entry_count", "score", "last_date"], aggregate))
+    return result.rowcount
+
+#the user's limit most frequent (decayed) and most recent foods in one statement, each half read
+#backwards off its own index, scores decayed to today
+def quick_add(session: Session, user_id: int, limit: int = 10, today: Optional[datetime.date] = None) -> QuickAdd:
+    columns = (UserFood.food_id, Food.name, Food.manufacturer, UserFood.entry_count, UserFood.score, UserFood.last_date)
+
+    def ranked(kind, *order):
+        stmt = select(literal(kind).label("kind"), *columns).join(Food, Food.id == UserFood.food_id)
+        return stmt.where(UserFood.user_id == user_id).order_by(*order).limit(limit).subquery()
+
+    frequent = ranked("frequent", UserFood.score.desc())
+    recent = ranked("recent", UserFood.last_date.desc(), UserFood.food_id.desc())
+    result = QuickAdd([], [])
+    for row in session.execute(union_all(select(frequent), select(recent))):
+        food = QuickAddFood(row.food_id, row.name, row.manufacturer, row.entry_count, decayed(row.score, today), row.last_date)
+        getattr(result, row.kind).append(food)
+    result.frequent.sort(key=lambda food: food.score, reverse=True)
+    result.recent.sort(key=lambda food: (food.last_date, food.food_id), reverse=True)
+    return result
+
+# flush listeners, the ORM counterpart of add_entries/remove_entries
+
+ADDED_KEY = "user_foods_added"
+REMOVED_KEY = "user_foods_removed"
+
+def _moved(entry):
+    state = inspect(entry)
+    return any(state.attrs[attr].history.has_changes() for attr in ("food_id", "daily_log_id", "food", "daily_log"))
+
+#entries leaving (deleted, or moved to another food or log) are read with their user and date
+#while their logs still exist, entries arriving are counted after the flush gave them their ids
+@event.listens_for(Session, "before_flush")
+def _collect_entries(session, flush_context, instances):
+    moved = [obj for obj in session.dirty if isinstance(obj, FoodEntry) and _moved(obj)]
+    leaving = [obj for obj in session.deleted if isinstance(obj, FoodEntry)] + moved
+    arriving = [obj for obj in session.new if isinstance(obj, FoodEntry)] + moved
+    if leaving:
+        ids = [inspect(obj).identity[0] for obj in leaving]
+        stmt = (
+            select(DailyLog.user_id, FoodEntry.food_id, DailyLog.date)
+            .join(DailyLog, DailyLog.id == FoodEntry.daily_log_id)
+            .where(FoodEntry.id.in_(ids))
+        )
+        session.info.setdefault(REMOVED_KEY, []).extend(tuple(row) for row in session.execute(stmt))
+    if arriving:
+        session.info.setdefault(ADDED_KEY, []).extend(arriving)
+
+#arrivals first, so an entry moved between the logs of one food never takes its count through zero
+@event.listens_for(Session, "after_flush")
+def _apply_entries(session, flush_context):
+    arriving = session.info.pop(ADDED_KEY, [])
+    leaving = session.info.pop(REMOVED_KEY, [])
+    if arriving:
+        add_entries(session.connection(), Counter(
+            (entry.daily_log_id, entry.food_id) for entry in arriving if entry.daily_log_id is not None and entry.food_id is not None
+        ))
+    remove_entries(session.connection(), leaving)
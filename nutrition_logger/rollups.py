@@ -0,0 +1,249 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Iterable, Mapping, NamedTuple, Optional, Union
+import datetime
+
+import numpy as np
+from sqlalchemy import Integer, cast, func, select
+from sqlalchemy.orm import Session
+
+from nutrition_logger.models import DailyLog, DailyTotals, Food, FoodEntry
+from nutrition_logger.totals import MACROS
+
+if TYPE_CHECKING:
+    from nutrition_logger.archive import ColdArchive
+
+#days are int64 counts since 1970-01-01 everywhere in this module, a 1970-01-05 was a monday
+EPOCH = datetime.date(1970, 1, 1)
+CHUNK_SIZE = 100_000
+
+#one element per food entry, macros already multiplied by the quantity
+class EntryColumns(NamedTuple):
+    user_id: np.ndarray
+    day: np.ndarray
+    calories: np.ndarray
+    protein: np.ndarray
+    carbs: np.ndarray
+    fat: np.ndarray
+
+#one element per (user, day), sorted by user then day
+class DayColumns(NamedTuple):
+    user_id: np.ndarray
+    day: np.ndarray
+    calories: np.ndarray
+    protein: np.ndarray
+    carbs: np.ndarray
+    fat: np.ndarray
+    entry_count: np.ndarray
+
+#one element per (user, week or month), averages are per logged day
+class PeriodRollup(NamedTuple):
+    user_id: np.ndarray
+    period_start: np.ndarray
+    days_logged: np.ndarray
+    calories: np.ndarray
+    protein: np.ndarray
+    carbs: np.ndarray
+    fat: np.ndarray
+
+#dense users x calendar grid, column i is first_day + i, nan where the window holds no logged day
+class TrendSeries(NamedTuple):
+    user_id: np.ndarray
+    first_day: int
+    calories: np.ndarray
+    protein: np.ndarray
+    carbs: np.ndarray
+    fat: np.ndarray
+
+#per user streaks of consecutive days on target, current is the streak ending on the last day
+class Streaks(NamedTuple):
+    user_id: np.ndarray
+    current: np.ndarray
+    longest: np.ndarray
+
+def to_day(date: datetime.date) -> int:
+    return (date - EPOCH).days
+
+def to_date(day: int) -> datetime.date:
+    return EPOCH + datetime.timedelta(days=int(day))
+
+def _day_column(column):
+    return cast(func.extract("epoch", column) / 86400, Integer)
+
+def _filter(stmt, user_ids, start, end):
+    if user_ids is not None:
+        stmt = stmt.where(DailyLog.user_id.in_(list(user_ids)))
+    if start is not None:
+        stmt = stmt.where(DailyLog.date >= start)
+    if end is not None:
+        stmt = stmt.where(DailyLog.date <= end)
+    return stmt
+
+#stream a query into float64 columns without holding the rows as python objects all at once
+def _fetch_columns(session, stmt, width):
+    chunks = [
+        np.array(rows, dtype=np.float64).reshape(-1, width)
+        for rows in session.execute(stmt).tuples().partitions(CHUNK_SIZE)
+    ]
+    if not chunks:
+        return np.empty((0, width))
+    return np.concatenate(chunks)
+
+#the entry/food join as columns, None for user_ids means everybody,
+#archived months are added only when the range reaches them
+def entry_columns(session: Session, user_ids: Optional[Iterable[int]] = None, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None, archive: Optional[ColdArchive] = None) -> EntryColumns:
+    user_ids = None if user_ids is None else list(user_ids)
+    stmt = (
+        select(DailyLog.user_id, _day_column(DailyLog.date), *[FoodEntry.quantity * getattr(Food, macro) for macro in MACROS])
+        .select_from(FoodEntry)
+        .join(DailyLog, DailyLog.id == FoodEntry.daily_log_id)
+        .join(Food, Food.id == FoodEntry.food_id)
+        .execution_options(yield_per=CHUNK_SIZE)
+    )
+    data = _fetch_columns(session, _filter(stmt, user_ids, start, end), 6)
+    entries = EntryColumns(data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), *(data[:, i].copy() for i in range(2, 6)))
+    if archive is None or not archive.covering(start, end):
+        return entries
+    archived = archive.entry_columns(user_ids, start, end)
+    return EntryColumns(*(np.concatenate(columns) for columns in zip(entries, archived)))
+
+#per day columns straight from the stored daily_totals, skipping the entry join entirely,
+#archived months are merged in only when the range reaches them
+def stored_day_columns(session: Session, user_ids: Optional[Iterable[int]] = None, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None, archive: Optional[ColdArchive] = None) -> DayColumns:
+    user_ids = None if user_ids is None else list(user_ids)
+    stmt = (
+        select(DailyLog.user_id, _day_column(DailyLog.date), *[getattr(DailyTotals, macro) for macro in MACROS], DailyTotals.entry_count)
+        .join(DailyTotals, DailyTotals.daily_log_id == DailyLog.id)
+        .where(DailyTotals.entry_count > 0)
+        .order_by(DailyLog.user_id, DailyLog.date)
+        .execution_options(yield_per=CHUNK_SIZE)
+    )
+    data = _fetch_columns(session, _filter(stmt, user_ids, start, end), 7)
+    days = DayColumns(
+        data[:, 0].astype(np.int64), data[:, 1].astype(np.int64),
+        *(data[:, i].copy() for i in range(2, 6)), data[:, 6].astype(np.int64),
+    )
+    if archive is None or not archive.covering(start, end):
+        return days
+    archived = archive.day_columns(user_ids, start, end)
+    #like the query above, days without entries are left out
+    logged = archived.entry_count > 0
+    return merge_day_columns(days, DayColumns(*(column[logged] for column in archived)))
+
+#start index of every run of equal (user, key) in already sorted arrays
+def _group_starts(user_id, key):
+    if len(user_id) == 0:
+        return np.empty(0, dtype=np.intp)
+    change = (np.diff(user_id) != 0) | (np.diff(key) != 0)
+    return np.concatenate(([0], np.flatnonzero(change) + 1))
+
+#sum entries into days, entries may come in any order
+def daily_columns(entries: EntryColumns) -> DayColumns:
+    if len(entries.day) == 0:
+        return DayColumns(*(np.empty(0, dtype=np.int64) for _ in range(2)), *(np.empty(0) for _ in MACROS), np.empty(0, dtype=np.int64))
+    #pack (user, day) into one int64 key, bincount straight over the key space when it is dense enough,
+    #otherwise sort the keys first
+    first_user, first_day = entries.user_id.min(), entries.day.min()
+    span = int(entries.day.max() - first_day) + 1
+    key = (entries.user_id - first_user) * span + (entries.day - first_day)
+    size = int(key.max()) + 1
+    if size <= 4 * len(key):
+        counts = np.bincount(key, minlength=size)
+        keys = np.flatnonzero(counts)
+        sums = [np.bincount(key, weights=getattr(entries, macro), minlength=size)[keys] for macro in MACROS]
+        counts = counts[keys]
+    else:
+        keys, groups = np.unique(key, return_inverse=True)
+        sums = [np.bincount(groups, weights=getattr(entries, macro), minlength=len(keys)) for macro in MACROS]
+        counts = np.bincount(groups, minlength=len(keys))
+    return DayColumns(keys // span + first_user, keys % span + first_day, *sums, counts)
+
+#sorted day columns from several sources, a (user, day) present in more than one is summed
+def merge_day_columns(*parts: DayColumns) -> DayColumns:
+    merged = DayColumns(*(np.concatenate(columns) for columns in zip(*parts)))
+    order = np.lexsort((merged.day, merged.user_id))
+    merged = DayColumns(*(column[order] for column in merged))
+    starts = _group_starts(merged.user_id, merged.day)
+    if len(starts) == len(merged.day):
+        return merged
+    return DayColumns(merged.user_id[starts], merged.day[starts], *(np.add.reduceat(column, starts) for column in merged[2:]))
+
+def _period_rollup(days: DayColumns, period_start: np.ndarray) -> PeriodRollup:
+    starts = _group_starts(days.user_id, period_start)
+    logged = np.diff(np.append(starts, len(days.day)))
+    means = [np.add.reduceat(getattr(days, macro), starts) / logged if len(starts) else np.empty(0) for macro in MACROS]
+    return PeriodRollup(days.user_id[starts], period_start[starts], logged, *means)
+
+#weeks start on monday, period_start is the day number of that monday
+def weekly_averages(days: DayColumns) -> PeriodRollup:
+    return _period_rollup(days, days.day - (days.day + 3) % 7)
+
+#period_start is the day number of the first of the month
+def monthly_averages(days: DayColumns) -> PeriodRollup:
+    months = days.day.astype("datetime64[D]").astype("datetime64[M]")
+    return _period_rollup(days, months.astype("datetime64[D]").astype(np.int64))
+
+#scatter days onto a users x calendar grid, returns the user ids, first day, row/column of every day
+def _grid_index(days: DayColumns, first_day: Optional[int], last_day: Optional[int]):
+    users, rows = np.unique(days.user_id, return_inverse=True)
+    if first_day is None:
+        first_day = int(days.day.min()) if len(days.day) else 0
+    if last_day is None:
+        last_day = int(days.day.max()) if len(days.day) else first_day
+    inside = (days.day >= first_day) & (days.day <= last_day)
+    return users, first_day, last_day - first_day + 1, rows[inside], days.day[inside] - first_day, inside
+
+#trailing window mean over logged days, a day without a log does not count as zero
+def rolling_means(days: DayColumns, window: int = 7, first_day: Optional[int] = None, last_day: Optional[int] = None) -> TrendSeries:
+    users, first_day, width, rows, cols, inside = _grid_index(days, first_day, last_day)
+
+    def window_sums(grid):
+        cumulative = np.cumsum(grid, axis=1)
+        cumulative[:, window:] -= cumulative[:, :-window].copy()
+        return cumulative
+
+    logged = np.zeros((len(users), width))
+    logged[rows, cols] = 1
+    counts = window_sums(logged)
+    series = []
+    for macro in MACROS:
+        grid = np.zeros((len(users), width))
+        grid[rows, cols] = getattr(days, macro)[inside]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            series.append(np.where(counts > 0, window_sums(grid) / counts, np.nan))
+    return TrendSeries(users, first_day, *series)
+
+#a day is on target when its calories are within tolerance of the user's target, a day without a log breaks the streak
+def adherence_streaks(days: DayColumns, targets: Union[float, Mapping[int, float]], tolerance: float = 0.1, first_day: Optional[int] = None, last_day: Optional[int] = None) -> Streaks:
+    users, first_day, width, rows, cols, inside = _grid_index(days, first_day, last_day)
+    if width == 0 or len(users) == 0:
+        return Streaks(users, np.zeros(len(users), dtype=np.int64), np.zeros(len(users), dtype=np.int64))
+    if isinstance(targets, Mapping):
+        target = np.array([targets.get(int(user), np.nan) for user in users])
+    else:
+        target = np.full(len(users), float(targets))
+
+    calories = days.calories[inside]
+    on_target = np.abs(calories - target[rows]) <= tolerance * target[rows]
+    grid = np.zeros((len(users), width), dtype=np.int64)
+    grid[rows[on_target], cols[on_target]] = 1
+
+    #length of the run of ones ending at every cell: running count minus the count at the last zero
+    running = np.cumsum(grid, axis=1)
+    at_last_miss = np.maximum.accumulate(np.where(grid == 0, running, 0), axis=1)
+    runs = running - at_last_miss
+    return Streaks(users, runs[:, -1], runs.max(axis=1))
+
+#every rollup for every selected user from a single pass over the stored totals
+def user_rollups(session: Session, user_ids: Optional[Iterable[int]] = None, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None, targets: Union[float, Mapping[int, float], None] = None, archive: Optional[ColdArchive] = None) -> dict:
+    days = stored_day_columns(session, user_ids, start, end, archive)
+    first_day = to_day(start) if start is not None else None
+    last_day = to_day(end) if end is not None else None
+    rollups = {
+        "days": days,
+        "weekly": weekly_averages(days),
+        "monthly": monthly_averages(days),
+        "rolling_7d": rolling_means(days, 7, first_day, last_day),
+    }
+    if targets is not None:
+        rollups["streaks"] = adherence_streaks(days, targets, first_day=first_day, last_day=last_day)
+    return rollups
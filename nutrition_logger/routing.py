@@ -0,0 +1,122 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence
+import itertools, logging, threading, time
+
+from sqlalchemy import Engine, event, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import CompoundSelect, Select
+
+logger = logging.getLogger(__name__)
+
+#seconds the replica is behind its primary, NULL when it is not in recovery (not a streaming replica)
+LAG_QUERY = text(
+    "SELECT CASE WHEN pg_is_in_recovery() "
+    "THEN extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+#a replica engine and what the last health check (or failed statement) found
+class Replica:
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.healthy = True
+        self.checked_at: Optional[float] = None
+        self.lag: Optional[float] = None
+        #times it went from healthy to down
+        self.failures = 0
+
+    def as_dict(self) -> Dict:
+        return {
+            "url": self.engine.url.render_as_string(hide_password=True),
+            "healthy": self.healthy,
+            "lag": self.lag,
+            "failures": self.failures,
+        }
+
+#picks the engine for reads: healthy replicas in turn, the primary when there are none,
+#replicas are checked again every check_interval seconds so one that went down (or fell more than
+#max_lag seconds behind) is left out until a later check finds it back
+class ReplicaRouter:
+    def __init__(self, primary: Engine, replicas: Sequence[Engine] = (), check_interval: float = 10.0, max_lag: Optional[float] = None, clock=time.monotonic):
+        self.primary = primary
+        self.replicas = [Replica(engine) for engine in replicas]
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.clock = clock
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        for replica in self.replicas:
+            event.listen(replica.engine, "handle_error", self._on_error)
+
+    #a statement that lost (or never got) its connection takes the replica out right away
+    def _on_error(self, context):
+        if context.is_disconnect or context.connection is None:
+            for replica in self.replicas:
+                if replica.engine is context.engine:
+                    self.mark_down(replica)
+
+    def mark_down(self, replica: Replica) -> None:
+        if replica.healthy:
+            logger.warning("replica %s is down, reads go elsewhere", replica.engine.url.render_as_string(hide_password=True))
+            replica.failures += 1
+        replica.healthy = False
+        replica.checked_at = self.clock()
+
+    def check(self, replica: Replica) -> bool:
+        try:
+            with replica.engine.connect() as connection:
+                lag = connection.execute(LAG_QUERY).scalar()
+        except DBAPIError:
+            self.mark_down(replica)
+            return False
+        replica.lag = None if lag is None else float(lag)
+        replica.healthy = self.max_lag is None or replica.lag is None or replica.lag <= self.max_lag
+        replica.checked_at = self.clock()
+        return replica.healthy
+
+    #only one thread runs the due checks, the others route on the previous results meanwhile
+    def _check_due(self) -> None:
+        now = self.clock()
+        due = [replica for replica in self.replicas if replica.checked_at is None or now - replica.checked_at >= self.check_interval]
+        if due and self._lock.acquire(blocking=False):
+            try:
+                for replica in due:
+                    self.check(replica)
+            finally:
+                self._lock.release()
+
+    def reader(self) -> Engine:
+        if not self.replicas:
+            return self.primary
+        self._check_due()
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return self.primary
+        return healthy[next(self._turn) % len(healthy)].engine
+
+    def status(self) -> List[Dict]:
+        return [replica.as_dict() for replica in self.replicas]
+
+def _is_read(clause) -> bool:
+    return isinstance(clause, (Select, CompoundSelect)) and getattr(clause, "_for_update_arg", None) is None
+
+#ORM session that sends plain SELECTs to router.reader() and everything else (flushes, DML,
+#SELECT ... FOR UPDATE, raw connections) to the primary, once it has written, or use_primary()
+#was called, all its statements stay on the primary so it reads its own writes
+class RoutingSession(Session):
+    def __init__(self, *args, router: Optional[ReplicaRouter] = None, **kw):
+        super().__init__(*args, **kw)
+        self.router = router
+
+    def use_primary(self) -> None:
+        self.info["primary"] = True
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.router is None:
+            return super().get_bind(mapper, clause=clause, **kw)
+        if self._flushing or (clause is not None and not _is_read(clause)):
+            self.use_primary()
+        if self.info.get("primary") or not _is_read(clause):
+            #no statement (get_bind() for the dialect, session.connection()) also means the primary
+            return self.router.primary
+        return self.router.reader()
@@ -1,7 +1,14 @@
 from __future__ import annotations
 
-from pydantic import BaseModel, EmailStr, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, EmailStr, Field, ConfigDict, TypeAdapter, ValidationError, model_validator
+from typing import Any, ClassVar, Dict, List, NamedTuple, Optional, Sequence, Tuple, get_args, get_origin
+from functools import lru_cache
+import datetime
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import InstanceState, selectinload
+
+from nutrition_logger.models import User, Food, DailyLog, FoodEntry, Target, Adherence
 
 #User classes
 class UserBase(BaseModel):
@@ -87,4 +94,210 @@ class FoodEntryResponse(FoodEntryBase):
 
 
 class FoodEntryUpdate(BaseModel):
-    quantity: Optional[float] = Field(gt=0)
\ No newline at end of file
+    quantity: Optional[float] = Field(gt=0)
+
+#an entry for one of the user's logs, today's unless a date is given, the log is created if needed
+class DayEntryCreate(BaseModel):
+    food_id: int = Field(gt=0)
+    quantity: float = Field(gt=0, default=1)
+    date: Optional[datetime.date] = None
+
+#one entry of a bulk sync, its log is found or created from (user_id, date)
+class BulkEntryCreate(BaseModel):
+    user_id: int = Field(gt=0)
+    date: datetime.date
+    food_id: int = Field(gt=0)
+    quantity: float = Field(gt=0, default=1)
+
+#Target classes, a macro left out (or null) has no target
+class TargetUpdate(BaseModel):
+    calories: Optional[float] = Field(gt=0, default=None)
+    protein: Optional[float] = Field(gt=0, default=None)
+    carbs: Optional[float] = Field(gt=0, default=None)
+    fat: Optional[float] = Field(gt=0, default=None)
+
+
+#Depth-bounded response classes: no back-references, and built only from attributes that are
+#already loaded so serializing never lazy-loads, loader_options() gives the eager loads they need
+class LoadedResponse(BaseModel):
+    orm_class: ClassVar[Optional[type]] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+    @classmethod
+    def _loaded(cls, data) -> Dict[str, Any]:
+        #expired and never loaded attributes are both missing from the instance dict
+        loaded = inspect(data).dict
+        try:
+            return {name: loaded[name] for name in cls.model_fields}
+        except KeyError:
+            unloaded = [name for name in cls.model_fields if name not in loaded]
+            raise ValueError(f"{type(data).__name__} has unloaded attributes {unloaded}, use {cls.__name__}.loader_options()")
+
+    @model_validator(mode="before")
+    @classmethod
+    def loaded_attributes_only(cls, data):
+        state = inspect(data, raiseerr=False)
+        if not isinstance(state, InstanceState):
+            return data
+        return cls._loaded(data)
+
+    @classmethod
+    def loader_options(cls):
+        return [
+            selectinload(getattr(cls.orm_class, name)).options(*nested.loader_options())
+            for name, (nested, _) in _nested_responses(cls).items()
+        ]
+
+    #trusted construction for objects read back from the database: their columns were validated when
+    #they were written, so the response is assembled from the loaded attributes (or a row mapping)
+    #without checking them again, nested responses included. Not for anything a client sent
+    @classmethod
+    def trusted(cls, data):
+        fields = cls.model_fields
+        if hasattr(data, "_sa_instance_state"):
+            loaded = data.__dict__
+            if not fields.keys() <= loaded.keys():
+                cls._loaded(data)
+        else:
+            loaded = data
+        values = {name: loaded[name] for name in fields}
+        for name, (nested, many) in _nested_responses(cls).items():
+            value = values[name]
+            if many:
+                values[name] = [nested.trusted(item) for item in value]
+            elif value is not None:
+                values[name] = nested.trusted(value)
+        #what model_construct() ends up doing, without its per-call walk over defaults and aliases
+        response = cls.__new__(cls)
+        object.__setattr__(response, "__dict__", values)
+        object.__setattr__(response, "__pydantic_fields_set__", set(fields))
+        object.__setattr__(response, "__pydantic_extra__", None)
+        object.__setattr__(response, "__pydantic_private__", None)
+        return response
+
+#fields of a response class that hold other responses: name -> (response class, whether it is a list)
+@lru_cache(maxsize=None)
+def _nested_responses(cls) -> Dict[str, Tuple[type, bool]]:
+    nested = {}
+    for name, field in cls.model_fields.items():
+        classes = [arg for arg in (field.annotation, *get_args(field.annotation)) if isinstance(arg, type) and issubclass(arg, LoadedResponse)]
+        if classes:
+            nested[name] = (classes[0], get_origin(field.annotation) in (list, List))
+    return nested
+
+class UserSummary(LoadedResponse):
+    orm_class = User
+
+    id: int = Field(gt=0)
+    username: str = Field(min_length=1)
+    email: EmailStr
+
+#the serving as it was entered plus the normalized basis the database derived from it
+class FoodSummary(LoadedResponse, FoodBase):
+    orm_class = Food
+
+    id: int = Field(gt=0)
+    base_unit: str
+    base_amount: float
+    calories_per_100: Optional[float] = None
+    protein_per_100: Optional[float] = None
+    carbs_per_100: Optional[float] = None
+    fat_per_100: Optional[float] = None
+
+class DailyLogSummary(LoadedResponse):
+    orm_class = DailyLog
+
+    id: int = Field(gt=0)
+    user_id: int = Field(gt=0)
+    date: datetime.date
+
+class FoodEntrySummary(LoadedResponse):
+    orm_class = FoodEntry
+
+    id: int = Field(gt=0)
+    daily_log_id: int = Field(gt=0)
+    food_id: int = Field(gt=0)
+    quantity: float = Field(gt=0)
+
+#depth 1: an entry with its food embedded
+class FoodEntryDetail(FoodEntrySummary):
+    food: FoodSummary
+
+#depth 1: a log with its entries, foods by id only
+class DailyLogDetail(DailyLogSummary):
+    food_entries: List[FoodEntrySummary] = []
+
+#depth 2: a log with its entries and their foods embedded
+class DailyLogWithFoods(DailyLogSummary):
+    food_entries: List[FoodEntryDetail] = []
+
+#depth 1: a user with the summaries of their logs
+class UserDetail(UserSummary):
+    logs: List[DailyLogSummary] = []
+
+class TargetSummary(LoadedResponse, TargetUpdate):
+    orm_class = Target
+
+    user_id: int = Field(gt=0)
+    updated_at: datetime.datetime
+
+#quick-add lists, read from user_foods, scores are decayed to today
+class QuickAddFoodSummary(BaseModel):
+    food_id: int = Field(gt=0)
+    name: str
+    manufacturer: str
+    entry_count: int = Field(gt=0)
+    score: float
+    last_date: datetime.date
+
+    model_config = ConfigDict(from_attributes=True)
+
+class QuickAddSummary(BaseModel):
+    frequent: List[QuickAddFoodSummary] = []
+    recent: List[QuickAddFoodSummary] = []
+
+    model_config = ConfigDict(from_attributes=True)
+
+#written by the nightly adherence job: averages per logged day and their ratio to the target
+class AdherenceSummary(LoadedResponse):
+    orm_class = Adherence
+
+    period: str
+    as_of: datetime.date
+    days: int = Field(ge=0)
+    days_on_target: int = Field(ge=0)
+    calories: Optional[float] = None
+    protein: Optional[float] = None
+    carbs: Optional[float] = None
+    fat: Optional[float] = None
+    calories_ratio: Optional[float] = None
+    protein_ratio: Optional[float] = None
+    carbs_ratio: Optional[float] = None
+    fat_ratio: Optional[float] = None
+
+
+#validation of many payloads at once through one cached TypeAdapter per model, instead of a
+#model_validate call (and its Python-level overhead) per item
+@lru_cache(maxsize=None)
+def list_adapter(model: type) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+#valid models by their index in the input, errors (pydantic error dicts, loc relative to the item) by index
+class ValidatedBatch(NamedTuple):
+    valid: Dict[int, BaseModel]
+    errors: Dict[int, List[dict]]
+
+#pydantic gives no partial results, so a batch with invalid items is validated once more without them
+def validate_many(model: type, items: Sequence) -> ValidatedBatch:
+    adapter = list_adapter(model)
+    errors: Dict[int, List[dict]] = {}
+    try:
+        return ValidatedBatch(dict(enumerate(adapter.validate_python(items))), errors)
+    except ValidationError as error:
+        for detail in error.errors():
+            index, *loc = detail["loc"]
+            errors.setdefault(index, []).append({**detail, "loc": tuple(loc)})
+    indexes = [index for index in range(len(items)) if index not in errors]
+    valid = adapter.validate_python([items[index] for index in indexes])
+    return ValidatedBatch(dict(zip(indexes, valid)), errors)
@@ -0,0 +1,294 @@
+from __future__ import annotations
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import bisect, heapq, re
+
+from sqlalchemy import Text, and_, case, event, func, literal, select, text, union
+from sqlalchemy.orm import Session
+
+from nutrition_logger.models import Food, food_search_document, food_search_vector
+
+WORD = re.compile(r"\w+")
+
+#full-text matches and name-prefix matches each read at most this many rows before the ranking sort,
+#so a one-letter query does not sort every food that has a word starting with it
+SEARCH_CANDIDATES = 1000
+
+class FoodMatch(NamedTuple):
+    id: int
+    name: str
+    manufacturer: str
+
+def _words(value: str) -> List[str]:
+    return WORD.findall(value.lower())
+
+#ranked top-k foods whose name/manufacturer words start with every word typed so far,
+#postgres uses the full-text index (plus trigram similarity as a typo fallback when pg_trgm is installed),
+#anything else goes through the given in-memory index or a plain scan
+def search_foods(session: Session, query: str, limit: int = 10, index: Optional[FoodSearchIndex] = None) -> List[FoodMatch]:
+    words = _words(query)
+    if not words:
+        return []
+    if index is not None:
+        return index.search(query, limit)
+    if session.get_bind().dialect.name == "postgresql":
+        matches = _search_postgres(session, query, words, limit)
+        if len(matches) < limit and _has_trigram(session.connection()):
+            seen = {match.id for match in matches}
+            matches += [match for match in _similar_postgres(session, query, limit) if match.id not in seen]
+        return matches[:limit]
+    return _search_scan(session, query, words, limit)
+
+def _rank(query, name=Food.name):
+    #exact name prefix first, then shorter names
+    return (
+        case((func.lower(name).startswith(query.lower(), autoescape=True), 0), else_=1),
+        func.length(name),
+        name,
+    )
+
+#candidates are the first SEARCH_CANDIDATES full-text matches plus as many exact name prefixes, read in
+#name order off ix_foods_name_prefix so the best-ranked ones are among them, only those are ranked
+def _search_postgres(session, query, words, limit):
+    tsquery = func.to_tsquery(text("'simple'"), " & ".join(f"{word}:*" for word in words))
+    columns = (Food.id, Food.name, Food.manufacturer)
+    name = func.lower(Food.name).collate("C")
+    prefixed = (
+        select(*columns).where(name.startswith(query.lower(), autoescape=True))
+        .order_by(name).limit(SEARCH_CANDIDATES).subquery()
+    )
+    #the same document as food_search_vector(), over the prefixed rows only
+    document = func.to_tsvector(text("'simple'"), prefixed.c.name + " " + prefixed.c.manufacturer)
+    candidates = union(
+        select(*columns).where(food_search_vector().op("@@")(tsquery)).limit(SEARCH_CANDIDATES),
+        select(prefixed).where(document.op("@@")(tsquery)),
+    ).subquery()
+    stmt = select(candidates).order_by(*_rank(query, candidates.c.name)).limit(limit)
+    return [FoodMatch(*row) for row in session.execute(stmt)]
+
+#checked once per pooled connection, not on every search that comes up short
+def _has_trigram(connection):
+    if "pg_trgm" not in connection.info:
+        stmt = text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        connection.info["pg_trgm"] = connection.execute(stmt).first() is not None
+    return connection.info["pg_trgm"]
+
+def _similar_postgres(session, query, limit):
+    document = func.lower(food_search_document())
+    lowered = literal(query.lower(), Text)
+    stmt = (
+        select(Food.id, Food.name, Food.manufacturer)
+        .where(lowered.op("<%")(document))
+        .order_by(func.word_similarity(lowered, document).desc(), func.length(Food.name))
+        .limit(limit)
+    )
+    return [FoodMatch(*row) for row in session.execute(stmt)]
+
+#correct everywhere but scans foods, only used without postgres and without an in-memory index
+def _search_scan(session, query, words, limit):
+    document = " " + func.lower(food_search_document())
+    conditions = [document.contains(" " + word, autoescape=True) for word in words]
+    stmt = select(Food.id, Food.name, Food.manufacturer).where(and_(*conditions)).order_by(*_rank(query)).limit(limit)
+    return [FoodMatch(*row) for row in session.execute(stmt)]
+
+#ranked foods kept per busy prefix, and the range size up to which a prefix is ranked on the spot instead
+TOP_RANKED = 64
+RANK_ON_THE_SPOT = 2048
+NAMES, WORDS = 0, 1
+
+#in-memory autocomplete index for sqlite/embedded use. sorted lists of (word, food id) and (lowercased name,
+#food id) answer every prefix with two bisects; prefixes matching more than RANK_ON_THE_SPOT entries keep
+#their TOP_RANKED best foods, ranked once (at load for one and two letters, on first use otherwise) and kept
+#up to date by writes, so a query reads the most selective word's ranked foods and stops after limit matches.
+#watch() keeps it in sync with committed ORM writes to foods
+class FoodSearchIndex:
+    def __init__(self):
+        self.foods: Dict[int, Tuple[str, str]] = {}
+        self.words: List[Tuple[str, int]] = []
+        self.names: List[Tuple[str, int]] = []
+        self._tokens: Dict[int, Tuple[str, ...]] = {}
+        #(NAMES or WORDS, prefix) to the smallest rank keys of its range, every key of the range up to the last one
+        self._top: Dict[Tuple[int, str], List[tuple]] = {}
+        self._key = f"food_search_index_{id(self)}"
+        self._listeners = []
+
+    def __len__(self):
+        return len(self.foods)
+
+    #(re)build from the foods table, session or connection
+    def load(self, connection) -> FoodSearchIndex:
+        self.foods, self._tokens, self._top = {}, {}, {}
+        words, names = [], []
+        stmt = select(Food.id, Food.name, Food.manufacturer).execution_options(yield_per=10_000)
+        for food_id, name, manufacturer in connection.execute(stmt):
+            self.foods[food_id] = (name, manufacturer)
+            tokens = self._tokens[food_id] = tuple(set(_words(f"{name} {manufacturer}")))
+            words.extend((word, food_id) for word in tokens)
+            names.append((name.lower(), food_id))
+        words.sort()
+        names.sort()
+        self.words, self.names = words, names
+        self._warm()
+        return self
+
+    #rankings of the busy one and two letter prefixes in one pass over the foods in rank order,
+    #which stops once every one of them is full
+    def _warm(self):
+        wanted = {}
+        for kind, entries in ((NAMES, self.names), (WORDS, self.words)):
+            for length in (1, 2):
+                position = 0
+                while position < len(entries):
+                    prefix = entries[position][0][:length]
+                    if len(prefix) < length:
+                        position += 1
+                        continue
+                    start, end = self._range(entries, prefix)
+                    if end - start > RANK_ON_THE_SPOT:
+                        wanted[(kind, prefix)] = []
+                    position = end
+        pending = set(wanted)
+        ranks = [self._rank(food_id) for food_id in self.foods]
+        heapq.heapify(ranks)
+        while pending and ranks:
+            rank = heapq.heappop(ranks)
+            lowered = rank[1].lower()
+            keys = {(NAMES, lowered[:1]), (NAMES, lowered[:2])}
+            keys.update((WORDS, word[:length]) for word in self._tokens[rank[2]] for length in (1, 2))
+            for key in keys & pending:
+                top = wanted[key]
+                top.append(rank)
+                if len(top) == TOP_RANKED:
+                    pending.discard(key)
+        self._top = wanted
+
+    def _rank(self, food_id):
+        name = self.foods[food_id][0]
+        return (len(name), name, food_id)
+
+    #(kind, prefix) of every cached ranking the food is part of
+    def _cached(self, food_id):
+        name, _ = self.foods[food_id]
+        lowered = name.lower()
+        keys = [(NAMES, lowered[:length]) for length in range(1, len(lowered) + 1)]
+        keys += [(WORDS, word[:length]) for word in self._tokens[food_id] for length in range(1, len(word) + 1)]
+        return [key for key in set(keys) if key in self._top]
+
+    def put(self, food_id: int, name: str, manufacturer: str) -> None:
+        self.remove(food_id)
+        self.foods[food_id] = (name, manufacturer)
+        self._tokens[food_id] = tuple(set(_words(f"{name} {manufacturer}")))
+        for word in self._tokens[food_id]:
+            bisect.insort(self.words, (word, food_id))
+        bisect.insort(self.names, (name.lower(), food_id))
+        rank = self._rank(food_id)
+        for key in self._cached(food_id):
+            top = self._top[key]
+            #a rank past the last kept one may have unkept ranks before it
+            if top and rank < top[-1]:
+                bisect.insort(top, rank)
+                del top[TOP_RANKED:]
+
+    def remove(self, food_id: int) -> None:
+        if food_id not in self.foods:
+            return
+        rank = self._rank(food_id)
+        for key in self._cached(food_id):
+            top = self._top[key]
+            position = bisect.bisect_left(top, rank)
+            if position < len(top) and top[position] == rank:
+                del top[position]
+                #ranked again on next use once too few are left
+                if len(top) < TOP_RANKED // 2:
+                    del self._top[key]
+        for entries, value in [(self.words, word) for word in self._tokens.pop(food_id)] + [(self.names, self.foods[food_id][0].lower())]:
+            position = bisect.bisect_left(entries, (value, food_id))
+            if position < len(entries) and entries[position] == (value, food_id):
+                del entries[position]
+        del self.foods[food_id]
+
+    @staticmethod
+    def _range(entries, prefix):
+        return bisect.bisect_left(entries, (prefix, -1)), bisect.bisect_left(entries, (prefix + "\U0010ffff", -1))
+
+    def _ranked_top(self, kind, prefix, start, end):
+        if end - start <= RANK_ON_THE_SPOT:
+            return None
+        top = self._top.get((kind, prefix))
+        if top is None:
+            entries = self.names if kind == NAMES else self.words
+            top = self._top[(kind, prefix)] = heapq.nsmallest(TOP_RANKED, {self._rank(food_id) for _, food_id in entries[start:end]})
+        return top
+
+    #food ids with a name (NAMES) or a word (WORDS) starting with prefix, best ranked first
+    def _ranked(self, kind, prefix):
+        entries = self.names if kind == NAMES else self.words
+        start, end = self._range(entries, prefix)
+        top = self._ranked_top(kind, prefix, start, end)
+        if top is None:
+            for rank in sorted({self._rank(food_id) for _, food_id in entries[start:end]}):
+                yield rank[2]
+            return
+        for rank in list(top):
+            yield rank[2]
+        #past the kept ranks (the other words filtered most of them out) the whole range is ranked
+        if len(top) < end - start:
+            last = top[-1] if top else None
+            for rank in sorted({self._rank(food_id) for _, food_id in entries[start:end]}):
+                if last is None or rank > last:
+                    yield rank[2]
+
+    def search(self, query: str, limit: int = 10) -> List[FoodMatch]:
+        words = _words(query)
+        if not words or limit <= 0:
+            return []
+
+        def matches(food_id, words):
+            tokens = self._tokens[food_id]
+            return all(any(token.startswith(word) for token in tokens) for word in words)
+
+        #exact name prefixes first, then the foods of the word matching the fewest entries, checked against the others
+        found: List[int] = []
+        for food_id in self._ranked(NAMES, query.lower()):
+            if matches(food_id, words):
+                found.append(food_id)
+                if len(found) == limit:
+                    break
+        if len(found) < limit:
+            sizes = [self._range(self.words, word) for word in words]
+            seed = min(range(len(words)), key=lambda i: sizes[i][1] - sizes[i][0])
+            others = words[:seed] + words[seed + 1:]
+            seen = set(found)
+            for food_id in self._ranked(WORDS, words[seed]):
+                if food_id not in seen and matches(food_id, others):
+                    found.append(food_id)
+                    if len(found) == limit:
+                        break
+        return [FoodMatch(food_id, *self.foods[food_id]) for food_id in found]
+
+    #apply food writes from flushes once their transaction commits, drop them on rollback
+    def watch(self, target=Session) -> FoodSearchIndex:
+        def stage(session, flush_context):
+            pending = session.info.setdefault(self._key, [])
+            pending.extend(("put", obj.id, obj.name, obj.manufacturer) for obj in session.new if isinstance(obj, Food))
+            pending.extend(("put", obj.id, obj.name, obj.manufacturer) for obj in session.dirty if isinstance(obj, Food))
+            pending.extend(("remove", obj.id) for obj in session.deleted if isinstance(obj, Food))
+
+        def apply(session):
+            for change in session.info.pop(self._key, []):
+                if change[0] == "put":
+                    self.put(*change[1:])
+                else:
+                    self.remove(change[1])
+
+        def discard(session, previous_transaction):
+            session.info.pop(self._key, None)
+
+        self._listeners = [(target, "after_flush", stage), (target, "after_commit", apply), (target, "after_soft_rollback", discard)]
+        for listener in self._listeners:
+            event.listen(*listener)
+        return self
+
+    def unwatch(self) -> None:
+        for listener in self._listeners:
+            event.remove(*listener)
+        self._listeners = []
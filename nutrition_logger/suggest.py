@@ -0,0 +1,216 @@
+from __future__ import annotations
+from typing import Dict, List, NamedTuple, Optional, Sequence
+import datetime
+
+import numpy as np
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from nutrition_logger.models import DailyLog, DailyTotals, Food, Target
+from nutrition_logger.totals import MACROS
+
+#distances are in kcal: calories as they are, protein, carbs and fat at their energy per gram,
+#so a gram of fat too many weighs like 9 kcal too many
+WEIGHTS = np.array([1.0, 4.0, 4.0, 9.0])
+
+class FoodFit(NamedTuple):
+    id: int
+    distance: float
+
+#in-memory nearest-neighbour index over the per-serving (calories, protein, carbs, fat) of every food,
+#the foods sit in one contiguous float64 matrix ordered by the leaves of a KD-tree (median splits on
+#the widest dimension, leaf_size rows per leaf) with each leaf's bounding box kept alongside. A query
+#bounds its distance to every box at once, then scans the leaves nearest first with vectorized
+#distances until the next box cannot beat the k-th best. Writes do not touch the tree: removed foods
+#are masked out, added and changed ones go to a small side matrix scanned in full, and the tree is
+#rebuilt from memory once that grows past max(4 leaves, 1/32 of the tree)
+class NutrientIndex:
+    def __init__(self, leaf_size: int = 256):
+        self.leaf_size = leaf_size
+        self.points = np.empty((0, len(MACROS)))
+        self.ids = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self.starts = np.zeros(1, dtype=np.int64)
+        self.lo = np.empty((0, len(MACROS)))
+        self.hi = np.empty((0, len(MACROS)))
+        self._sorted = np.empty(0, dtype=np.int64)
+        self._dead = 0
+        self.pending: Dict[int, np.ndarray] = {}
+        #pending as (ids, points) arrays, built by the first query after a write
+        self._pending_arrays = None
+        self._key = f"nutrient_index_{id(self)}"
+        self._listeners = []
+
+    def __len__(self):
+        return len(self.ids) - self._dead + len(self.pending)
+
+    #(re)build from the foods table, session or connection
+    def load(self, connection) -> NutrientIndex:
+        stmt = select(Food.id, *[getattr(Food, macro) for macro in MACROS]).execution_options(yield_per=100_000)
+        rows = np.array(connection.execute(stmt).all(), dtype=np.float64).reshape(-1, 1 + len(MACROS))
+        self.build(rows[:, 0].astype(np.int64), rows[:, 1:] * WEIGHTS)
+        return self
+
+    #points are already weighted
+    def build(self, ids: np.ndarray, points: np.ndarray) -> None:
+        leaves = []
+        stack = [np.arange(len(ids))]
+        while stack:
+            rows = stack.pop()
+            if len(rows) <= self.leaf_size:
+                leaves.append(rows)
+                continue
+            subset = points[rows]
+            dimension = np.argmax(subset.max(axis=0) - subset.min(axis=0))
+            half = len(rows) // 2
+            split = np.argpartition(subset[:, dimension], half)
+            stack.append(rows[split[half:]])
+            stack.append(rows[split[:half]])
+        order = np.concatenate(leaves) if leaves else np.empty(0, dtype=np.int64)
+
+        self.points = np.ascontiguousarray(points[order])
+        self.ids = ids[order]
+        self.alive = np.ones(len(order), dtype=bool)
+        self.starts = np.concatenate(([0], np.cumsum([len(leaf) for leaf in leaves], dtype=np.int64)))
+        if leaves:
+            self.lo = np.minimum.reduceat(self.points, self.starts[:-1], axis=0)
+            self.hi = np.maximum.reduceat(self.points, self.starts[:-1], axis=0)
+        else:
+            self.lo = self.hi = np.empty((0, len(MACROS)))
+        self._sorted = np.argsort(self.ids, kind="stable")
+        self._dead = 0
+        self.pending = {}
+        self._pending_arrays = None
+
+    def _position(self, food_id: int) -> Optional[int]:
+        at = np.searchsorted(self.ids, food_id, sorter=self._sorted)
+        if at < len(self.ids) and self.ids[self._sorted[at]] == food_id:
+            position = self._sorted[at]
+            if self.alive[position]:
+                return position
+        return None
+
+    def _pending(self):
+        if self._pending_arrays is None:
+            ids = np.fromiter(self.pending, dtype=np.int64, count=len(self.pending))
+            self._pending_arrays = ids, np.array(list(self.pending.values())).reshape(-1, len(MACROS))
+        return self._pending_arrays
+
+    def put(self, food_id: int, calories: float, protein: float, carbs: float, fat: float) -> None:
+        self.remove(food_id)
+        self.pending[food_id] = np.array([calories, protein, carbs, fat], dtype=np.float64) * WEIGHTS
+        if len(self.pending) > max(4 * self.leaf_size, len(self.ids) // 32):
+            self.rebuild()
+
+    def remove(self, food_id: int) -> None:
+        self._pending_arrays = None
+        if self.pending.pop(food_id, None) is not None:
+            return
+        position = self._position(food_id)
+        if position is not None:
+            self.alive[position] = False
+            self._dead += 1
+
+    #a fresh tree over the live foods, pending ones included
+    def rebuild(self) -> None:
+        ids, points = self._pending()
+        self.build(np.concatenate((self.ids[self.alive], ids)), np.concatenate((self.points[self.alive], points)))
+
+    #the k foods nearest to remaining (calories, protein, carbs, fat), None leaves that macro out of the
+    #distance, fits=True only returns foods within remaining on every macro that is given, nearest first
+    def nearest(self, remaining: Sequence[Optional[float]], k: int = 10, fits: bool = False) -> List[FoodFit]:
+        dimensions = [i for i, value in enumerate(remaining) if value is not None]
+        if not dimensions or k <= 0:
+            return []
+        query = np.maximum(np.array([remaining[i] for i in dimensions], dtype=np.float64), 0.0) * WEIGHTS[dimensions]
+
+        def distances(points):
+            points = points[:, dimensions]
+            result = np.einsum("ij,ij->i", points - query, points - query)
+            if fits:
+                result[(points > query).any(axis=1)] = np.inf
+            return result
+
+        pending_ids, pending_points = self._pending()
+        best_ids, best = self._top(pending_ids, distances(pending_points), k)
+
+        lo, hi = self.lo[:, dimensions], self.hi[:, dimensions]
+        gap = np.maximum(lo - query, 0.0) + np.maximum(query - hi, 0.0)
+        bounds = np.einsum("ij,ij->i", gap, gap)
+        if fits:
+            bounds[(lo > query).any(axis=1)] = np.inf
+        for leaf in np.argsort(bounds, kind="stable"):
+            bound = bounds[leaf]
+            if bound == np.inf or (len(best) == k and bound > best[-1]):
+                break
+            start, end = self.starts[leaf], self.starts[leaf + 1]
+            found = distances(self.points[start:end])
+            found[~self.alive[start:end]] = np.inf
+            best_ids, best = self._top(np.concatenate((best_ids, self.ids[start:end])), np.concatenate((best, found)), k)
+        return [FoodFit(int(food_id), float(np.sqrt(distance))) for food_id, distance in zip(best_ids, best)]
+
+    #the k smallest finite distances, sorted
+    @staticmethod
+    def _top(ids, distances, k):
+        keep = np.isfinite(distances)
+        ids, distances = ids[keep], distances[keep]
+        if len(distances) > k:
+            part = np.argpartition(distances, k - 1)[:k]
+            ids, distances = ids[part], distances[part]
+        order = np.argsort(distances, kind="stable")
+        return ids[order], distances[order]
+
+    #apply food writes from flushes once their transaction commits, drop them on rollback,
+    #bulk loads through Core (nutrition_logger.importer) are not seen, load() again after them
+    def watch(self, target=Session) -> NutrientIndex:
+        def stage(session, flush_context):
+            pending = session.info.setdefault(self._key, [])
+            pending.extend(("put", obj.id, *[getattr(obj, macro) for macro in MACROS]) for obj in session.new if isinstance(obj, Food))
+            pending.extend(("put", obj.id, *[getattr(obj, macro) for macro in MACROS]) for obj in session.dirty if isinstance(obj, Food))
+            pending.extend(("remove", obj.id) for obj in session.deleted if isinstance(obj, Food))
+
+        def apply(session):
+            for change in session.info.pop(self._key, []):
+                if change[0] == "put":
+                    self.put(*change[1:])
+                else:
+                    self.remove(change[1])
+
+        def discard(session, previous_transaction):
+            session.info.pop(self._key, None)
+
+        self._listeners = [(target, "after_flush", stage), (target, "after_commit", apply), (target, "after_soft_rollback", discard)]
+        for listener in self._listeners:
+            event.listen(*listener)
+        return self
+
+    def unwatch(self) -> None:
+        for listener in self._listeners:
+            event.remove(*listener)
+        self._listeners = []
+
+#what is left of the user's targets on date (today by default) after the stored totals of that day,
+#None for macros without a target, None altogether when the user has no targets
+def remaining_macros(session: Session, user_id: int, date: Optional[datetime.date] = None) -> Optional[List[Optional[float]]]:
+    date = date or datetime.date.today()
+    stmt = (
+        select(*[getattr(Target, macro) for macro in MACROS], *[getattr(DailyTotals, macro) for macro in MACROS])
+        .select_from(Target)
+        .outerjoin(DailyLog, (DailyLog.user_id == Target.user_id) & (DailyLog.date == date))
+        .outerjoin(DailyTotals, DailyTotals.daily_log_id == DailyLog.id)
+        .where(Target.user_id == user_id)
+    )
+    row = session.execute(stmt).first()
+    if row is None:
+        return None
+    targets, eaten = row[:len(MACROS)], row[len(MACROS):]
+    return [None if target is None else target - (spent or 0.0) for target, spent in zip(targets, eaten)]
+
+#the k foods whose serving best fits what is left of the user's targets on date, nearest first
+def suggest_foods(session: Session, user_id: int, index: NutrientIndex, date: Optional[datetime.date] = None, k: int = 10, fits: bool = True) -> List[Food]:
+    remaining = remaining_macros(session, user_id, date)
+    if remaining is None:
+        return []
+    ids = [fit.id for fit in index.nearest(remaining, k, fits)]
+    foods = {food.id: food for food in session.scalars(select(Food).where(Food.id.in_(ids)))}
+    return [foods[food_id] for food_id in ids if food_id in foods]
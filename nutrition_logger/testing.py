@@ -0,0 +1,19 @@
+from contextlib import contextmanager
+from typing import Optional
+
+import pytest
+
+from nutrition_logger.instrumentation import track_queries
+
+#pytest fixture: `with query_budget(3): ...` fails the test when the block runs more than 3 statements
+#or repeats one statement max_repeats times or more (an N+1 pattern), import it into a test module to use it
+@pytest.fixture
+def query_budget():
+    @contextmanager
+    def budget(max_statements: int, max_repeats: Optional[int] = 3):
+        with track_queries("query_budget", repeat_threshold=max_repeats or 2**31, metrics=None) as stats:
+            yield stats
+        report = "\n".join(f"  {count}x {' '.join(statement.split())[:200]}" for statement, count in stats.statements_by_count())
+        assert stats.count <= max_statements, f"{stats.count} statements, budget {max_statements}:\n{report}"
+        assert not stats.repeated(), f"likely N+1, statements repeated {max_repeats}+ times:\n{report}"
+    return budget
@@ -0,0 +1,285 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional
+from collections import defaultdict
+import datetime
+
+from sqlalchemy import Float, Integer, Row, bindparam, cast, delete, event, func, insert, inspect, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from nutrition_logger.dialect import upsert
+from nutrition_logger.models import DailyLog, DailyTotals, Food, FoodEntry
+
+if TYPE_CHECKING:
+    from nutrition_logger.archive import ColdArchive
+
+MACROS = ("calories", "protein", "carbs", "fat")
+TOTAL_COLUMNS = (*MACROS, "entry_count")
+#food columns a log shows with its entries, changing any of them changes the logs the food is in
+FOOD_FIELDS = ("name", "manufacturer", "serving_size", "unit", *MACROS)
+
+#SUM(quantity * food.macro) for every macro plus the number of entries, zero for empty logs
+def macro_sums():
+    sums = [
+        func.coalesce(func.sum(FoodEntry.quantity * getattr(Food, macro)), 0.0).label(macro)
+        for macro in MACROS
+    ]
+    return (*sums, func.count(FoodEntry.id).label("entry_count"))
+
+#logs joined to their entries and foods, outer joins so logs without entries still show up
+def _log_totals_query():
+    return (
+        select(DailyLog.id.label("daily_log_id"), DailyLog.user_id, DailyLog.date, *macro_sums())
+        .outerjoin(FoodEntry, FoodEntry.daily_log_id == DailyLog.id)
+        .outerjoin(Food, Food.id == FoodEntry.food_id)
+        .group_by(DailyLog.id, DailyLog.user_id, DailyLog.date)
+    )
+
+def _date_range(stmt, start: Optional[datetime.date], end: Optional[datetime.date]):
+    if start is not None:
+        stmt = stmt.where(DailyLog.date >= start)
+    if end is not None:
+        stmt = stmt.where(DailyLog.date <= end)
+    return stmt
+
+#totals of a single log, None if the log does not exist
+def log_totals(session: Session, daily_log_id: int) -> Optional[Row]:
+    stmt = _log_totals_query().where(DailyLog.id == daily_log_id)
+    return session.execute(stmt).first()
+
+#totals of many logs in one query, ordered by log id
+def logs_totals(session: Session, daily_log_ids: Iterable[int]) -> List[Row]:
+    stmt = _log_totals_query().where(DailyLog.id.in_(list(daily_log_ids))).order_by(DailyLog.id)
+    return list(session.execute(stmt))
+
+#database rows and the archived days in range by date, archive files are only opened when the range reaches
+#an archived month. a day logged again after its month was archived is in both, like rollups.merge_day_columns
+#its totals are summed into one row, under the id of the live log
+def _with_archived(rows, archive, user_id, start, end):
+    if archive is None or not archive.covering(start, end):
+        return rows
+    days = {day.date: day for day in archive.daily_totals(user_id, start, end)}
+    for row in rows:
+        archived = days.get(row.date)
+        days[row.date] = row if archived is None else archived._replace(
+            daily_log_id=row.daily_log_id, **{column: getattr(archived, column) + getattr(row, column) for column in TOTAL_COLUMNS},
+        )
+    return [days[date] for date in sorted(days)]
+
+#one row per day for a user, inclusive date range, ordered by date
+def daily_totals(session: Session, user_id: int, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None, archive: Optional[ColdArchive] = None) -> List[Row]:
+    stmt = _date_range(_log_totals_query().where(DailyLog.user_id == user_id), start, end)
+    return _with_archived(list(session.execute(stmt.order_by(DailyLog.date))), archive, user_id, start, end)
+
+#one row per (user, day) for many users at once, ordered by user then date
+def users_daily_totals(session: Session, user_ids: Iterable[int], start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> List[Row]:
+    stmt = _date_range(_log_totals_query().where(DailyLog.user_id.in_(list(user_ids))), start, end)
+    return list(session.execute(stmt.order_by(DailyLog.user_id, DailyLog.date)))
+
+#range_totals once archived days are added in
+class RangeTotals(NamedTuple):
+    days: int
+    calories: float
+    protein: float
+    carbs: float
+    fat: float
+    entry_count: int
+
+#a single row summed over the whole date range for a user
+def range_totals(session: Session, user_id: int, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None, archive: Optional[ColdArchive] = None) -> Row:
+    stmt = (
+        select(func.count(func.distinct(DailyLog.id)).label("days"), *macro_sums())
+        .select_from(DailyLog)
+        .outerjoin(FoodEntry, FoodEntry.daily_log_id == DailyLog.id)
+        .outerjoin(Food, Food.id == FoodEntry.food_id)
+        .where(DailyLog.user_id == user_id)
+    )
+    totals = session.execute(_date_range(stmt, start, end)).one()
+    if archive is None or not archive.covering(start, end):
+        return totals
+    archived = archive.daily_totals(user_id, start, end)
+    #archived days that also have a live log are already counted
+    dates = [day.date for day in archived]
+    both = session.scalar(select(func.count(DailyLog.id)).where(DailyLog.user_id == user_id, DailyLog.date.in_(dates))) if dates else 0
+    return RangeTotals(
+        totals.days + len(archived) - both,
+        *(getattr(totals, column) + sum(getattr(day, column) for day in archived) for column in TOTAL_COLUMNS),
+    )
+
+# stored totals, maintained incrementally on every flush
+
+#single primary-key lookup, None only for logs that do not exist
+def stored_totals(session: Session, daily_log_id: int) -> Optional[DailyTotals]:
+    return session.get(DailyTotals, daily_log_id, populate_existing=True)
+
+#stored totals for a user's days, same shape as daily_totals
+def stored_daily_totals(session: Session, user_id: int, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None, archive: Optional[ColdArchive] = None) -> List[Row]:
+    columns = [func.coalesce(getattr(DailyTotals, column), 0).label(column) for column in TOTAL_COLUMNS]
+    stmt = (
+        select(DailyLog.id.label("daily_log_id"), DailyLog.user_id, DailyLog.date, *columns)
+        .outerjoin(DailyTotals, DailyTotals.daily_log_id == DailyLog.id)
+        .where(DailyLog.user_id == user_id)
+    )
+    return _with_archived(list(session.execute(_date_range(stmt, start, end).order_by(DailyLog.date))), archive, user_id, start, end)
+
+#recompute stored totals from the entries, for one user or everybody, returns the number of logs written
+def rebuild_daily_totals(session: Session, user_id: Optional[int] = None) -> int:
+    logs = select(DailyLog.id)
+    if user_id is not None:
+        logs = logs.where(DailyLog.user_id == user_id)
+    session.execute(delete(DailyTotals.__table__).where(DailyTotals.daily_log_id.in_(logs)))
+
+    aggregate = (
+        select(DailyLog.id, *macro_sums())
+        .outerjoin(FoodEntry, FoodEntry.daily_log_id == DailyLog.id)
+        .outerjoin(Food, Food.id == FoodEntry.food_id)
+        .group_by(DailyLog.id)
+    )
+    if user_id is not None:
+        aggregate = aggregate.where(DailyLog.user_id == user_id)
+    result = session.execute(insert(DailyTotals.__table__).from_select(["daily_log_id", *TOTAL_COLUMNS], aggregate))
+    return result.rowcount
+
+#add deltas to stored totals, creating missing rows, deltas for logs that no longer exist are dropped,
+#every log with a delta (even an all-zero one) gets its version bumped, returns the new versions by log id
+def apply_deltas(connection, deltas: Dict[int, List[float]]) -> Dict[int, int]:
+    if not deltas:
+        return {}
+    table = DailyTotals.__table__
+    values = select(
+        DailyLog.id,
+        *[cast(bindparam(f"d_{column}"), Float) for column in MACROS],
+        cast(bindparam("d_entry_count"), Integer),
+    ).where(DailyLog.id == bindparam("d_log_id"))
+    stmt = upsert(connection, table).from_select(["daily_log_id", *TOTAL_COLUMNS], values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.daily_log_id],
+        set_={column: table.c[column] + stmt.excluded[column] for column in TOTAL_COLUMNS},
+    )
+    params = [
+        {"d_log_id": log_id, **{f"d_{column}": value for column, value in zip(TOTAL_COLUMNS, delta)}}
+        for log_id, delta in sorted(deltas.items())
+    ]
+    connection.execute(stmt, params)
+
+    logs = DailyLog.__table__
+    bump = (
+        update(logs)
+        .where(logs.c.id.in_(sorted(deltas)))
+        .values(version=logs.c.version + 1)
+        .returning(logs.c.id, logs.c.version)
+    )
+    return dict(connection.execute(bump).all())
+
+#deltas revaluing the entries already stored for foods whose macros change, changes maps food id to (old, new) macros
+def food_change_deltas(connection, changes: Dict[int, tuple]) -> Dict[int, List[float]]:
+    deltas = defaultdict(lambda: [0.0] * len(TOTAL_COLUMNS))
+    if not changes:
+        return deltas
+    stmt = (
+        select(FoodEntry.daily_log_id, FoodEntry.food_id, func.sum(FoodEntry.quantity))
+        .where(FoodEntry.food_id.in_(list(changes)))
+        .group_by(FoodEntry.daily_log_id, FoodEntry.food_id)
+    )
+    for log_id, food_id, quantity in connection.execute(stmt):
+        old, new = changes[food_id]
+        delta = deltas[log_id]
+        for i, (new_value, old_value) in enumerate(zip(new, old)):
+            delta[i] += quantity * (new_value - old_value)
+    return deltas
+
+DELTAS_KEY = "daily_totals_deltas"
+
+#per-serving macros of foods by id, read in the caller's transaction: whatever goes into the stored totals
+#is valued from the database, never from the process-local food cache another process cannot invalidate
+def food_macros(session: Session, food_ids: Iterable[int]) -> Dict[int, List[float]]:
+    stmt = select(Food.id, *[getattr(Food, macro) for macro in MACROS]).where(Food.id.in_(list(food_ids)))
+    return {row[0]: list(row[1:]) for row in session.execute(stmt)}
+
+def _macros(obj):
+    return [getattr(obj, macro) for macro in MACROS]
+
+def _changed(obj, attrs):
+    state = inspect(obj)
+    return any(state.attrs[attr].history.has_changes() for attr in attrs)
+
+#the log an entry belongs to after the flush, the object itself when it is not flushed yet
+def _entry_log(entry):
+    log = inspect(entry).dict.get("daily_log")
+    return log if log is not None else entry.daily_log_id
+
+#everything is valued at the post-flush macros: foods whose macros change first revalue the entries
+#already in the database, then removed entries are taken out and added entries put in at the new values,
+#foods changed in other shown fields give zero deltas so only the versions of their logs move
+@event.listens_for(Session, "before_flush")
+def _collect_deltas(session, flush_context, instances):
+    entry_attrs = ("quantity", "food_id", "daily_log_id", "food", "daily_log")
+    new_entries = [obj for obj in session.new if isinstance(obj, FoodEntry)]
+    old_entries = [obj for obj in session.deleted if isinstance(obj, FoodEntry)]
+    old_entries += [obj for obj in session.dirty if isinstance(obj, FoodEntry) and _changed(obj, entry_attrs)]
+    changed_foods = [obj for obj in session.dirty if isinstance(obj, Food) and _changed(obj, FOOD_FIELDS)]
+    new_logs = [obj for obj in session.new if isinstance(obj, DailyLog)]
+    if not (new_entries or old_entries or changed_foods or new_logs):
+        return
+
+    deltas = defaultdict(lambda: [0.0] * len(TOTAL_COLUMNS))
+    for log in new_logs:
+        deltas[log] = [0.0] * len(TOTAL_COLUMNS)
+
+    def add(log, macros, factor, count):
+        delta = deltas[log]
+        for i, value in enumerate(macros):
+            delta[i] += factor * value
+        delta[-1] += count
+
+    macros = {food.id: _macros(food) for food in changed_foods}
+    old_rows = []
+    if old_entries:
+        ids = [inspect(obj).identity[0] for obj in old_entries]
+        stmt = select(FoodEntry.daily_log_id, FoodEntry.food_id, FoodEntry.quantity).where(FoodEntry.id.in_(ids))
+        old_rows = list(session.execute(stmt))
+
+    new_refs = []
+    for entry in new_entries + [obj for obj in old_entries if obj not in session.deleted]:
+        food = inspect(entry).dict.get("food")
+        food = food if food is not None else entry.food_id
+        if food is not None:
+            new_refs.append((entry, food))
+
+    missing = {row.food_id for row in old_rows} | {ref for _, ref in new_refs if isinstance(ref, int)}
+    missing -= macros.keys()
+    if missing:
+        macros.update(food_macros(session, missing))
+
+    if changed_foods:
+        old = food_macros(session, [food.id for food in changed_foods])
+        changes = {food_id: (values, macros[food_id]) for food_id, values in old.items()}
+        for log_id, delta in food_change_deltas(session, changes).items():
+            add(log_id, delta, 1, 0)
+
+    for row in old_rows:
+        add(row.daily_log_id, macros[row.food_id], -row.quantity, -1)
+    for entry, food in new_refs:
+        #quantity is still None on new entries relying on the column default
+        quantity = entry.quantity if entry.quantity is not None else FoodEntry.__table__.c.quantity.default.arg
+        add(_entry_log(entry), _macros(food) if isinstance(food, Food) else macros[food], quantity, 1)
+
+    session.info[DELTAS_KEY] = deltas
+
+@event.listens_for(Session, "after_flush")
+def _apply_flush_deltas(session, flush_context):
+    deltas = session.info.pop(DELTAS_KEY, None)
+    if not deltas:
+        return
+    resolved = defaultdict(lambda: [0.0] * len(TOTAL_COLUMNS))
+    for log, delta in deltas.items():
+        log_id = log.id if isinstance(log, DailyLog) else log
+        if log_id is None:
+            continue
+        resolved[log_id] = [a + b for a, b in zip(resolved[log_id], delta)]
+    versions = apply_deltas(session.connection(), resolved)
+    #logs already loaded in this session see their new version without another query
+    for log_id, version in versions.items():
+        log = session.identity_map.get(session.identity_key(DailyLog, log_id))
+        if log is not None:
+            set_committed_value(log, "version", version)
@@ -0,0 +1,51 @@
+from typing import Dict, List, Tuple
+
+#unit conversion table: unit as written on a food -> (base unit, amount of the base unit in one of it),
+#masses are kept in grams, volumes in millilitres, anything else (piece, slice, ...) counts as itself
+UNITS: Dict[str, Tuple[str, float]] = {
+    "g": ("g", 1.0),
+    "gram": ("g", 1.0),
+    "grams": ("g", 1.0),
+    "mg": ("g", 0.001),
+    "kg": ("g", 1000.0),
+    "oz": ("g", 28.349523125),
+    "lb": ("g", 453.59237),
+    "ml": ("ml", 1.0),
+    "millilitre": ("ml", 1.0),
+    "milliliter": ("ml", 1.0),
+    "cl": ("ml", 10.0),
+    "dl": ("ml", 100.0),
+    "l": ("ml", 1000.0),
+    "litre": ("ml", 1000.0),
+    "liter": ("ml", 1000.0),
+    "tsp": ("ml", 4.92892159375),
+    "tbsp": ("ml", 14.78676478125),
+    "fl oz": ("ml", 29.5735295625),
+    "cup": ("ml", 240.0),
+    "piece": ("piece", 1.0),
+    "pieces": ("piece", 1.0),
+    "pc": ("piece", 1.0),
+    "pcs": ("piece", 1.0),
+}
+
+#nutrients are stored per this many base units (per 100g / 100ml)
+BASIS = 100.0
+
+#the conversions as SQL over a unit column, used for the generated columns on foods (the database is the
+#only place they are computed), units that map to the same value share one WHEN
+def _case_sql(column, values, default):
+    grouped: Dict[str, List[str]] = {}
+    for unit, value in values.items():
+        grouped.setdefault(value, []).append(f"'{unit}'")
+    whens = " ".join(f"WHEN lower(trim({column})) IN ({', '.join(units)}) THEN {value}" for value, units in grouped.items())
+    return f"CASE {whens} ELSE {default} END"
+
+def base_unit_sql(column: str = "unit") -> str:
+    return _case_sql(column, {unit: f"'{base}'" for unit, (base, _) in UNITS.items()}, f"lower(trim({column}))")
+
+def base_amount_sql(serving_column: str = "serving_size", unit_column: str = "unit") -> str:
+    factor = _case_sql(unit_column, {unit: repr(factor) for unit, (_, factor) in UNITS.items()}, "1.0")
+    return f"{serving_column} * {factor}"
+
+def per_basis_sql(column: str, serving_column: str = "serving_size", unit_column: str = "unit") -> str:
+    return f"{column} * {BASIS!r} / NULLIF({base_amount_sql(serving_column, unit_column)}, 0)"
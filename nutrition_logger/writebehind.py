@@ -0,0 +1,155 @@
+from __future__ import annotations
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+import atexit, logging, queue, threading, time
+
+from sqlalchemy.orm import Session
+
+from nutrition_logger.config import write_behind_options
+from nutrition_logger.main import Session as SessionLocal, get_engine
+from nutrition_logger.meals import log_entries
+from nutrition_logger.schema import BulkEntryCreate
+
+logger = logging.getLogger(__name__)
+
+#opt-in write-behind for food entries: submit() puts the entry in a bounded in-process queue and returns
+#a Future, a background thread drains the queue and writes up to max_batch entries per transaction, at the
+#latest max_delay seconds after the first of them was queued. The future resolves to the
+#(id, daily_log_id, food_id, quantity) row once its transaction has committed, or to the error that kept
+#the entry out. A full queue blocks submit() (backpressure), close() writes whatever is still queued
+class EntryWriter:
+    def __init__(self, sessionmaker: Callable[[], Session], max_batch: int = 500, max_delay: float = 0.05, maxsize: int = 10_000):
+        self.sessionmaker = sessionmaker
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.entries = 0
+        self.failed = 0
+        self._queue: queue.Queue[Optional[Tuple[BulkEntryCreate, Future]]] = queue.Queue(maxsize)
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="entry-writer", daemon=True)
+        self._thread.start()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "maxsize": self._queue.maxsize,
+            "batches": self.batches,
+            "entries": self.entries,
+            "failed": self.failed,
+        }
+
+    #blocks while the queue is full, raises queue.Full if that lasts longer than timeout seconds
+    def submit(self, item: BulkEntryCreate, timeout: Optional[float] = None) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._closed.is_set():
+                raise RuntimeError("entry writer is closed")
+        self._queue.put((item, future), timeout=timeout)
+        return future
+
+    #stop taking entries, write the queued ones and wait for the writer thread
+    def close(self, timeout: Optional[float] = None) -> None:
+        with self._lock:
+            if self._closed.is_set():
+                return
+            self._closed.set()
+        #wakes the writer if it is waiting to fill a batch
+        self._queue.put(None)
+        self._thread.join(timeout)
+        #a submit() that was blocked on the full queue can land after the thread saw it empty
+        if not self._thread.is_alive():
+            while not self._queue.empty():
+                batch = self._next_batch()
+                if batch:
+                    self._write(batch)
+
+    #entries queued until max_batch or max_delay, cut short by the None close() queues
+    def _next_batch(self) -> List[Tuple[BulkEntryCreate, Future]]:
+        try:
+            first = self._queue.get(timeout=self.max_delay)
+        except queue.Empty:
+            return []
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self) -> None:
+        while not (self._closed.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    #log_entries reads logs and foods before writing, on a routing session those reads go to the
+    #primary too, a plain Session (tests, benchmarks) has a single bind anyway
+    def _commit(self, batch):
+        with self.sessionmaker() as session:
+            if hasattr(session, "use_primary"):
+                session.use_primary()
+            with session.begin():
+                return log_entries(session, [item for item, _ in batch])
+
+    #entries whose future was cancelled (the request went away) are dropped, the others can no longer
+    #be cancelled from here on
+    def _write(self, batch) -> None:
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if batch:
+            self._write_batch(batch)
+
+    #one transaction for the whole batch, when it fails every entry is tried in its own
+    #so only the entries at fault get the error
+    def _write_batch(self, batch) -> None:
+        try:
+            rows = self._commit(batch)
+        except Exception as error:
+            if len(batch) == 1:
+                self.failed += 1
+                _deliver(batch[0][1].set_exception, error)
+                return
+            logger.warning("batch of %d entries failed (%s), writing them one by one", len(batch), error)
+        else:
+            self.batches += 1
+            self.entries += len(rows)
+            for (_, future), row in zip(batch, rows):
+                _deliver(future.set_result, row)
+            return
+        for entry in batch:
+            self._write_batch([entry])
+
+#a future that cannot take its outcome must not stop the writer thread
+def _deliver(resolve, value) -> None:
+    try:
+        resolve(value)
+    except Exception:
+        logger.exception("could not deliver a write-behind result")
+
+#the process-wide writer when ENTRY_WRITE_BEHIND is on, None otherwise, closed (and drained) at exit
+@lru_cache(maxsize=None)
+def get_entry_writer() -> Optional[EntryWriter]:
+    options = write_behind_options()
+    if options is None:
+        return None
+    get_engine()
+    writer = EntryWriter(SessionLocal, **options)
+    atexit.register(writer.close)
+    return writer
+
+#drain the writer on shutdown, if this process started one
+def close_entry_writer() -> None:
+    if get_entry_writer.cache_info().currsize:
+        writer = get_entry_writer()
+        if writer is not None:
+            writer.close()
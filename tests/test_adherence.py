@@ -0,0 +1,112 @@
+import pytest, os, datetime
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.adherence import chunks, evaluate_adherence, evaluate_chunk
+from nutrition_logger.config import database_url
+from nutrition_logger.meals import log_entry
+from nutrition_logger.models import Base, User, Food, Target, Adherence, AdherenceChunk
+
+# Load environment variables
+load_dotenv()
+
+# Construct database URL
+TEST_DB_URL = database_url(database=os.environ.get("POSTGRES_TEST_DB"))
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# the job commits per chunk (and from other processes), so the data is committed too and dropped with the tables
+@pytest.fixture(scope="function")
+def Session(engine, tables):
+    return sessionmaker(bind=engine)
+
+AS_OF = datetime.date(2024, 3, 31)
+
+#a 100 kcal food, users get targets by the ids given
+def seed(Session, user_ids, targets=None):
+    with Session() as session:
+        food = Food(name="Unit", manufacturer="Acme", serving_size=1, unit="piece", calories=100, protein=10, carbs=10, fat=1)
+        session.add(food)
+        session.add_all([User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com") for user_id in user_ids])
+        session.flush()
+        session.add_all([Target(user_id=user_id, **(targets or {"calories": 2000})) for user_id in user_ids])
+        session.commit()
+        return food.id
+
+def results(session, user_id):
+    rows = session.scalars(select(Adherence).where(Adherence.user_id == user_id, Adherence.as_of == AS_OF))
+    return {row.period: row for row in rows}
+
+def test_periods(Session):
+    food_id = seed(Session, [1], {"calories": 2000, "protein": 200})
+    with Session() as session:
+        #on target yesterday and 5 days ago, 50% over two weeks ago, over a month ago does not count
+        log_entry(session, 1, food_id, 20, AS_OF)
+        log_entry(session, 1, food_id, 19, AS_OF - datetime.timedelta(days=5))
+        log_entry(session, 1, food_id, 30, AS_OF - datetime.timedelta(days=14))
+        log_entry(session, 1, food_id, 5, AS_OF - datetime.timedelta(days=30))
+        session.commit()
+
+        with session.begin():
+            assert evaluate_chunk(session, AS_OF, 0, 999) == 1
+        found = results(session, 1)
+    assert {period: (row.days, row.days_on_target) for period, row in found.items()} == {"day": (1, 1), "week": (2, 2), "month": (3, 2)}
+    assert found["week"].calories == pytest.approx(1950)
+    assert found["month"].calories == pytest.approx(6900 / 3)
+    assert found["month"].calories_ratio == pytest.approx(6900 / 3 / 2000)
+    assert found["month"].protein_ratio == pytest.approx(690 / 3 / 200)
+    assert (found["month"].carbs, found["month"].carbs_ratio) == (pytest.approx(690 / 3), None)
+
+def test_users_without_logs(Session):
+    seed(Session, [1])
+    with Session() as session:
+        with session.begin():
+            evaluate_chunk(session, AS_OF, 0, 999)
+        day = results(session, 1)["day"]
+    assert (day.days, day.days_on_target, day.calories, day.calories_ratio) == (0, 0, None, None)
+
+def test_chunks_are_aligned(Session):
+    seed(Session, [3, 7, 25, 26, 61])
+    with Session() as session:
+        assert chunks(session, 10) == [(0, 9), (20, 29), (60, 69)]
+
+def test_job_in_process_and_restart(engine, Session):
+    seed(Session, range(1, 31))
+    report = evaluate_adherence(engine, AS_OF, chunk_size=10, workers=1)
+    assert (report.chunks, report.skipped, report.users) == (4, 0, 30)
+    with Session() as session:
+        assert session.scalar(select(func.count()).select_from(Adherence)) == 90
+        assert session.scalar(select(func.sum(AdherenceChunk.users))) == 30
+
+        #a run that died after two chunks: the rerun only does the two missing
+        session.execute(AdherenceChunk.__table__.delete().where(AdherenceChunk.first_user_id >= 20))
+        session.commit()
+    report = evaluate_adherence(engine, AS_OF, chunk_size=10, workers=1)
+    assert (report.chunks, report.skipped, report.users) == (2, 2, 11)
+    assert evaluate_adherence(engine, AS_OF, chunk_size=10, workers=1).chunks == 0
+
+def test_job_in_process_pool(engine, Session):
+    food_id = seed(Session, range(1, 21))
+    with Session() as session:
+        for user_id in range(1, 21):
+            log_entry(session, user_id, food_id, user_id, AS_OF)
+        session.commit()
+
+    report = evaluate_adherence(engine, AS_OF, chunk_size=5, workers=2)
+    assert (report.chunks, report.users) == (5, 20)
+    with Session() as session:
+        assert results(session, 20)["day"].calories == pytest.approx(2000)
+        assert results(session, 20)["day"].days_on_target == 1
+        assert results(session, 3)["day"].days_on_target == 0
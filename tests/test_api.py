@@ -0,0 +1,279 @@
+import pytest, os, datetime, json
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from nutrition_logger.adherence import evaluate_chunk
+from nutrition_logger.api import app
+from nutrition_logger.async_db import get_async_session, get_async_sessionmaker
+from nutrition_logger import async_repository as repository
+from nutrition_logger.cache import log_responses
+from nutrition_logger.config import database_url
+from nutrition_logger.models import Base
+from nutrition_logger.schema import UserCreate, FoodCreate, DailyLogCreate, FoodEntryCreate
+from nutrition_logger.totals import TOTAL_COLUMNS, stored_totals
+
+# Load environment variables
+load_dotenv()
+
+# Construct database URLs, tables are managed through the sync driver
+TEST_DB_URL = database_url(database=os.environ.get("POSTGRES_TEST_DB"))
+ASYNC_TEST_DB_URL = database_url("asyncpg", os.environ.get("POSTGRES_TEST_DB"))
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# async session inside a rolled back transaction, commits in the code under test become savepoints
+@pytest.fixture(scope="function")
+async def db_session(tables):
+    async_engine = create_async_engine(ASYNC_TEST_DB_URL)
+    async with async_engine.connect() as connection:
+        transaction = await connection.begin()
+        session = AsyncSession(bind=connection, expire_on_commit=False, join_transaction_mode="create_savepoint")
+        yield session
+        await session.close()
+        await transaction.rollback()
+    await async_engine.dispose()
+
+@pytest.fixture(scope="function")
+async def client(db_session):
+    async def override():
+        yield db_session
+    app.dependency_overrides[get_async_session] = override
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+    app.dependency_overrides.clear()
+
+BANANA = {"name": "Banana", "manufacturer": "Acme", "serving_size": 100, "unit": "g", "calories": 105, "protein": 1, "carbs": 27, "fat": 0.5}
+
+@pytest.mark.anyio
+async def test_repository_round_trip(db_session):
+    user = await repository.create_user(db_session, UserCreate(username="async", email="async@example.com"))
+    food = await repository.create_food(db_session, FoodCreate(**BANANA))
+    log = await repository.create_log(db_session, DailyLogCreate(user_id=user.id))
+    await repository.add_entry(db_session, FoodEntryCreate(daily_log_id=log.id, food_id=food.id, quantity=2))
+    await db_session.commit()
+
+    db_session.expunge_all()
+    loaded = await repository.get_log(db_session, log.id)
+    assert [entry.food.name for entry in loaded.food_entries] == ["Banana"]
+    assert await repository.get_log_by_date(db_session, user.id, log.date) is loaded
+    assert [found.id for found in await repository.list_logs(db_session, user.id)] == [log.id]
+    assert (await repository.get_user_by_username(db_session, "async")).id == user.id
+
+@pytest.mark.anyio
+async def test_async_writes_keep_daily_totals(db_session):
+    user = await repository.create_user(db_session, UserCreate(username="async", email="async@example.com"))
+    food = await repository.create_food(db_session, FoodCreate(**BANANA))
+    log = await repository.create_log(db_session, DailyLogCreate(user_id=user.id))
+    entry = await repository.add_entry(db_session, FoodEntryCreate(daily_log_id=log.id, food_id=food.id, quantity=2))
+    await db_session.commit()
+
+    totals = await db_session.run_sync(stored_totals, log.id)
+    assert totals.calories == pytest.approx(210)
+    assert totals.entry_count == 1
+
+    await repository.delete_entry(db_session, entry.id)
+    await db_session.commit()
+    totals = await db_session.run_sync(stored_totals, log.id)
+    assert [getattr(totals, column) for column in TOTAL_COLUMNS] == [0, 0, 0, 0, 0]
+
+@pytest.mark.anyio
+async def test_api_log_flow(client):
+    response = await client.post("/users", json={"username": "api", "email": "api@example.com"})
+    assert response.status_code == 201
+    user = response.json()
+
+    food = (await client.post("/foods", json=BANANA)).json()
+    log = (await client.post("/logs", json={"user_id": user["id"]})).json()
+    assert log["food_entries"] == []
+
+    entry = (await client.post("/entries", json={"daily_log_id": log["id"], "food_id": food["id"], "quantity": 2})).json()
+    response = await client.patch(f"/entries/{entry['id']}", json={"quantity": 3})
+    assert response.json()["quantity"] == 3
+
+    log = (await client.get(f"/logs/{log['id']}")).json()
+    assert [(entry["food"]["name"], entry["quantity"]) for entry in log["food_entries"]] == [("Banana", 3)]
+
+    response = await client.patch(f"/foods/{food['id']}", json={**BANANA, "calories": 90})
+    assert response.json()["calories"] == 90
+
+    assert (await client.delete(f"/entries/{entry['id']}")).status_code == 204
+    assert (await client.get(f"/logs/{log['id']}")).json()["food_entries"] == []
+
+@pytest.mark.anyio
+async def test_api_food_keeps_original_serving(client):
+    food = (await client.post("/foods", json={**BANANA, "serving_size": 1, "unit": "cup", "calories": 120})).json()
+    assert (food["serving_size"], food["unit"], food["calories"]) == (1, "cup", 120)
+    assert (food["base_unit"], food["base_amount"], food["calories_per_100"]) == ("ml", 240, 50)
+
+    #generated columns come back with the update
+    food = (await client.patch(f"/foods/{food['id']}", json={**BANANA, "serving_size": 2, "unit": "oz", "calories": 56.7})).json()
+    assert food["base_unit"] == "g"
+    assert food["calories_per_100"] == pytest.approx(100, rel=1e-3)
+
+@pytest.mark.anyio
+async def test_api_log_etag(client):
+    log_responses.clear()
+    user = (await client.post("/users", json={"username": "poller", "email": "poller@example.com"})).json()
+    food = (await client.post("/foods", json=BANANA)).json()
+    log = (await client.post("/logs", json={"user_id": user["id"]})).json()
+
+    first = await client.get(f"/logs/{log['id']}")
+    etag = first.headers["ETag"]
+    assert first.json() == log
+
+    #unchanged: 304 after a single version lookup, clients without the etag get the cached body
+    response = await client.get(f"/logs/{log['id']}", headers={"If-None-Match": etag})
+    assert (response.status_code, response.headers["ETag"], response.content) == (304, etag, b"")
+    assert 'desc="1 statements"' in response.headers["Server-Timing"]
+    response = await client.get(f"/logs/{log['id']}")
+    assert (response.content, response.headers["ETag"]) == (first.content, etag)
+    assert log_responses.stats()["hits"] == 1
+
+    #an entry change moves the version on
+    await client.post("/entries", json={"daily_log_id": log["id"], "food_id": food["id"]})
+    response = await client.get(f"/logs/{log['id']}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [entry["food"]["name"] for entry in response.json()["food_entries"]] == ["Banana"]
+
+    #so does a change to a food the log shows
+    etag = response.headers["ETag"]
+    await client.patch(f"/foods/{food['id']}", json={**BANANA, "name": "Plantain"})
+    response = await client.get(f"/logs/{log['id']}", headers={"If-None-Match": f'W/"other", {etag}'})
+    assert response.status_code == 200
+    assert [entry["food"]["name"] for entry in response.json()["food_entries"]] == ["Plantain"]
+
+@pytest.mark.anyio
+async def test_api_targets_and_adherence(client, db_session):
+    user = (await client.post("/users", json={"username": "goals", "email": "goals@example.com"})).json()
+    assert (await client.get(f"/users/{user['id']}/targets")).status_code == 404
+
+    targets = (await client.put(f"/users/{user['id']}/targets", json={"calories": 2000, "protein": 120})).json()
+    assert (targets["calories"], targets["protein"], targets["fat"]) == (2000, 120, None)
+    targets = (await client.put(f"/users/{user['id']}/targets", json={"calories": 1800})).json()
+    assert (targets["calories"], targets["protein"]) == (1800, None)
+    assert (await client.get(f"/users/{user['id']}/targets")).json() == targets
+    assert (await client.put(f"/users/{user['id']}/targets", json={"calories": 0})).status_code == 422
+
+    food = (await client.post("/foods", json=BANANA)).json()
+    day = datetime.date(2024, 3, 1)
+    await client.post(f"/users/{user['id']}/entries", json={"food_id": food["id"], "quantity": 17, "date": day.isoformat()})
+    assert (await client.get(f"/users/{user['id']}/adherence")).json() == []
+
+    await db_session.run_sync(lambda session: evaluate_chunk(session, day, 0, 999))
+    results = (await client.get(f"/users/{user['id']}/adherence")).json()
+    assert [(row["period"], row["as_of"], row["days"], row["days_on_target"]) for row in results] == [
+        ("day", "2024-03-01", 1, 1), ("week", "2024-03-01", 1, 1), ("month", "2024-03-01", 1, 1),
+    ]
+    assert results[0]["calories_ratio"] == pytest.approx(105 * 17 / 1800)
+    assert (await client.get(f"/users/{user['id']}/adherence", params={"as_of": "2024-02-29"})).json() == []
+
+@pytest.mark.anyio
+async def test_api_quick_add(client):
+    user = (await client.post("/users", json={"username": "quick", "email": "quick@example.com"})).json()
+    banana = (await client.post("/foods", json=BANANA)).json()
+    oats = (await client.post("/foods", json={**BANANA, "name": "Oats"})).json()
+    for food in (banana, banana, oats):
+        await client.post(f"/users/{user['id']}/entries", json={"food_id": food["id"]})
+
+    response = (await client.get(f"/users/{user['id']}/quick-add")).json()
+    assert [(food["name"], food["entry_count"]) for food in response["frequent"]] == [("Banana", 2), ("Oats", 1)]
+    assert response["frequent"][0]["score"] == pytest.approx(2)
+    assert [food["name"] for food in response["recent"]] == ["Oats", "Banana"]
+    assert (await client.get("/users/9999/quick-add")).status_code == 404
+
+@pytest.mark.anyio
+async def test_api_not_found(client):
+    assert (await client.get("/users/1")).status_code == 404
+    assert (await client.get("/foods/1")).status_code == 404
+    assert (await client.get("/logs/1")).status_code == 404
+    assert (await client.delete("/entries/1")).status_code == 404
+
+@pytest.mark.anyio
+async def test_api_pool_stats(client):
+    stats = (await client.get("/pool")).json()
+    assert {"size", "checked_out", "overflow", "waits", "wait_time"} <= set(stats)
+
+@pytest.mark.anyio
+async def test_api_bulk_entries(client):
+    user = (await client.post("/users", json={"username": "bulk", "email": "bulk@example.com"})).json()
+    food = (await client.post("/foods", json=BANANA)).json()
+    items = [{"user_id": user["id"], "date": f"2024-03-0{day}", "food_id": food["id"], "quantity": day} for day in (1, 2, 2)]
+
+    response = await client.post("/entries/bulk", json=items)
+    assert response.status_code == 201
+    entries = response.json()
+    assert [entry["quantity"] for entry in entries] == [1, 2, 2]
+    assert entries[1]["daily_log_id"] == entries[2]["daily_log_id"] != entries[0]["daily_log_id"]
+
+    log = (await client.get(f"/logs/{entries[1]['daily_log_id']}")).json()
+    assert len(log["food_entries"]) == 2
+
+    response = await client.post("/entries/bulk", json=[{**items[0], "food_id": food["id"] + 1}])
+    assert response.status_code == 422
+    response = await client.post("/entries/bulk", json=[{**items[0], "user_id": user["id"] + 1}])
+    assert response.status_code == 422
+    assert str(user["id"] + 1) in response.json()["detail"]
+
+@pytest.mark.anyio
+async def test_api_log_to_today(client):
+    user = (await client.post("/users", json={"username": "today", "email": "today@example.com"})).json()
+    food = (await client.post("/foods", json=BANANA)).json()
+
+    first = (await client.post(f"/users/{user['id']}/entries", json={"food_id": food["id"]})).json()
+    second = (await client.post(f"/users/{user['id']}/entries", json={"food_id": food["id"], "quantity": 2})).json()
+    assert first["daily_log_id"] == second["daily_log_id"]
+    log = (await client.get(f"/logs/{first['daily_log_id']}")).json()
+    assert log["date"] == datetime.date.today().isoformat()
+
+    assert (await client.post(f"/users/{user['id'] + 1}/entries", json={"food_id": food["id"]})).status_code == 404
+
+@pytest.mark.anyio
+async def test_api_query_metrics(client):
+    response = await client.post("/users", json={"username": "metrics", "email": "metrics@example.com"})
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+    assert "statements" in response.headers["Server-Timing"]
+    assert not response.headers["Server-Timing"].endswith('"0 statements"')
+
+    metrics = (await client.get("/metrics/queries")).json()
+    assert metrics["units"] >= 1
+    assert metrics["statements"] >= 1
+
+@pytest.mark.anyio
+async def test_api_export(client, db_session):
+    @asynccontextmanager
+    async def same_session():
+        yield db_session
+    app.dependency_overrides[get_async_sessionmaker] = lambda: same_session
+
+    user = (await client.post("/users", json={"username": "export", "email": "export@example.com"})).json()
+    food = (await client.post("/foods", json=BANANA)).json()
+    items = [{"user_id": user["id"], "date": f"2024-03-0{day}", "food_id": food["id"], "quantity": day} for day in (1, 2)]
+    await client.post("/entries/bulk", json=items)
+
+    async with client.stream("GET", f"/users/{user['id']}/export") as response:
+        assert response.headers["content-type"] == "application/x-ndjson"
+        rows = [json.loads(line) async for line in response.aiter_lines() if line]
+    assert [(row["date"], row["quantity"], row["calories"]) for row in rows] == [("2024-03-01", 1, 105), ("2024-03-02", 2, 210)]
+
+    response = await client.get(f"/users/{user['id']}/export", params={"format": "csv"})
+    assert response.text.splitlines()[0].startswith("date,log_id,entry_id")
+    assert (await client.get(f"/users/{user['id'] + 1}/export")).status_code == 404
@@ -0,0 +1,161 @@
+import pytest, os, datetime
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.models import Base, User, Food, DailyLog, FoodEntry, DailyTotals
+from nutrition_logger.archive import ColdArchive, archive_old_logs
+from nutrition_logger.rollups import daily_columns, entry_columns, stored_day_columns, user_rollups
+from nutrition_logger.totals import daily_totals, range_totals, stored_daily_totals, TOTAL_COLUMNS
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+user = os.environ.get("POSTGRES_USER")
+password = os.environ.get("POSTGRES_PW")
+db = os.environ.get("POSTGRES_TEST_DB")
+host = os.environ.get("POSTGRES_HOST", "localhost")
+port = os.environ.get("POSTGRES_PORT", 5432)
+
+# Construct database URL
+TEST_DB_URL = f"postgresql://{user}:{password}@{host}:{port}/{db}"
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# create session
+@pytest.fixture(scope="function")
+def db_session(engine, tables):
+    connection = engine.connect()
+    transaction = connection.begin()
+    Session = sessionmaker(bind=connection)
+    session = Session()
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+START, END = datetime.date(2024, 1, 1), datetime.date(2024, 6, 30)
+TODAY = datetime.date(2024, 7, 15)
+
+# two users logging both foods every day from START to END
+@pytest.fixture(scope="function")
+def history(db_session):
+    users = [User(username=name, email=f"{name}@example.com") for name in ("alice", "bob")]
+    foods = [
+        Food(name="Oats", manufacturer="Acme", serving_size=40, unit="g", calories=150, protein=5, carbs=27, fat=3),
+        Food(name="Milk", manufacturer="Dairy", serving_size=250, unit="ml", calories=120, protein=8, carbs=12, fat=5),
+    ]
+    day = START
+    while day <= END:
+        for i, user in enumerate(users):
+            entries = [FoodEntry(food=foods[0], quantity=1 + i), FoodEntry(food=foods[1], quantity=day.day % 3 + 1)]
+            db_session.add(DailyLog(user=user, date=day, food_entries=entries))
+        day += datetime.timedelta(days=1)
+    db_session.add_all([*users, *foods])
+    db_session.commit()
+    return [user.id for user in users]
+
+def snapshot(session, user_id, archive=None):
+    rows = lambda result: [(row.date, *(round(getattr(row, column), 6) for column in TOTAL_COLUMNS)) for row in result]
+    days = stored_day_columns(session, None, START, END, archive)
+    computed = daily_columns(entry_columns(session, None, START, END, archive))
+    return {
+        "daily": rows(daily_totals(session, user_id, START, END, archive)),
+        "stored": rows(stored_daily_totals(session, user_id, START, END, archive)),
+        "range": tuple(round(value, 6) for value in range_totals(session, user_id, START, END, archive)),
+        "days": [column.tolist() for column in days],
+        "computed": [column.round(6).tolist() for column in computed],
+        "monthly": user_rollups(session, None, START, END, archive=archive)["monthly"].calories.round(6).tolist(),
+    }
+
+def test_archive_old_months(db_session, history, tmp_path):
+    alice, _ = history
+    before = snapshot(db_session, alice)
+    archive = ColdArchive(str(tmp_path))
+
+    assert archive_old_logs(db_session, archive, keep_days=90, today=TODAY) == [(2024, 1), (2024, 2), (2024, 3)]
+    assert archive.months() == [(2024, 1), (2024, 2), (2024, 3)]
+    assert db_session.scalar(select(func.min(DailyLog.date))) == datetime.date(2024, 4, 1)
+    assert db_session.scalar(select(func.count()).select_from(DailyTotals)) == db_session.scalar(select(func.count()).select_from(DailyLog))
+
+    #nothing is lost, and without the archive only the hot months are left
+    assert snapshot(db_session, alice, archive) == before
+    assert len(daily_totals(db_session, alice, START, END)) == 91
+
+    #nothing more to archive
+    assert archive_old_logs(db_session, archive, keep_days=90, today=TODAY) == []
+
+def test_recent_ranges_do_not_open_the_archive(db_session, history, tmp_path):
+    alice, _ = history
+    archive = ColdArchive(str(tmp_path))
+    archive_old_logs(db_session, archive, keep_days=90, today=TODAY)
+
+    archive = ColdArchive(str(tmp_path))
+    recent = (datetime.date(2024, 5, 1), datetime.date(2024, 5, 31))
+    assert len(daily_totals(db_session, alice, *recent, archive=archive)) == 31
+    stored_day_columns(db_session, [alice], *recent, archive=archive)
+    assert archive.loads == 0
+
+    assert len(daily_totals(db_session, alice, datetime.date(2024, 3, 25), recent[1], archive=archive)) == 31 + 30 + 7
+    assert archive.loads == 1
+
+def test_late_rows_merge_into_archived_month(db_session, history, tmp_path):
+    alice, _ = history
+    archive = ColdArchive(str(tmp_path))
+    archive_old_logs(db_session, archive, keep_days=90, today=TODAY)
+    february = (datetime.date(2024, 2, 1), datetime.date(2024, 2, 29))
+    before = stored_day_columns(db_session, [alice], *february, archive=archive)
+
+    #an offline client syncs an old day after its month was archived
+    oats = db_session.scalar(select(Food).where(Food.name == "Oats"))
+    db_session.add(DailyLog(user_id=alice, date=datetime.date(2024, 2, 10), food_entries=[FoodEntry(food=oats, quantity=1)]))
+    db_session.commit()
+    merged = stored_day_columns(db_session, [alice], *february, archive=archive)
+    assert len(merged.day) == len(before.day)
+    assert merged.calories.sum() == pytest.approx(before.calories.sum() + 150)
+    for totals in (daily_totals, stored_daily_totals):
+        days = totals(db_session, alice, *february, archive)
+        assert [day.date for day in days] == [february[0] + datetime.timedelta(days=i) for i in range(29)]
+        assert sum(day.calories for day in days) == pytest.approx(merged.calories.sum())
+        tenth = days[9]
+        assert (tenth.entry_count, tenth.daily_log_id) == (3, db_session.scalar(select(DailyLog.id).where(DailyLog.user_id == alice, DailyLog.date == datetime.date(2024, 2, 10))))
+    in_range = range_totals(db_session, alice, *february, archive)
+    assert (in_range.days, in_range.entry_count) == (29, 59)
+    assert in_range.calories == pytest.approx(merged.calories.sum())
+
+    assert archive_old_logs(db_session, archive, keep_days=90, today=TODAY) == [(2024, 2)]
+    assert db_session.scalar(select(func.count()).select_from(DailyLog).where(DailyLog.date < datetime.date(2024, 4, 1))) == 0
+    archived = stored_day_columns(db_session, [alice], *february, archive=archive)
+    assert [column.tolist() for column in archived] == [column.tolist() for column in merged]
+
+def test_rows_added_during_archiving_stay(db_session, history, tmp_path, monkeypatch):
+    carol = User(username="carol", email="carol@example.com")
+    db_session.add(carol)
+    db_session.commit()
+    archive = ColdArchive(str(tmp_path))
+    oats = db_session.scalar(select(Food).where(Food.name == "Oats"))
+    write = ColdArchive.write
+
+    #a log committed for the month between the read and the delete
+    def write_then_log(self, year, month, columns):
+        write(self, year, month, columns)
+        if (year, month) == (2024, 2):
+            db_session.add(DailyLog(user_id=carol.id, date=datetime.date(2024, 2, 10), food_entries=[FoodEntry(food=oats, quantity=1)]))
+            db_session.flush()
+
+    monkeypatch.setattr(ColdArchive, "write", write_then_log)
+    archive_old_logs(db_session, archive, keep_days=90, today=TODAY)
+    late = db_session.scalars(select(DailyLog).where(DailyLog.date < datetime.date(2024, 4, 1))).all()
+    assert [(log.user_id, log.date, len(log.food_entries)) for log in late] == [(carol.id, datetime.date(2024, 2, 10), 1)]
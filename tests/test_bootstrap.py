@@ -0,0 +1,91 @@
+import pytest, os, json, subprocess, sys
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, inspect, select, text
+
+from nutrition_logger.bootstrap import MIGRATIONS, bootstrap
+from nutrition_logger.config import database_url
+from nutrition_logger.models import Base, User, Food, DailyLog, FoodEntry, DailyTotals, SchemaMigration, UserFood
+
+# Load environment variables
+load_dotenv()
+
+# Construct database URL
+TEST_DB_URL = database_url(database=os.environ.get("POSTGRES_TEST_DB"))
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# nothing is created up front, bootstrap() is what is under test
+@pytest.fixture(scope="function")
+def empty_database(engine):
+    Base.metadata.drop_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
+
+def test_import_does_no_io():
+    probe = (
+        "import json, sys\n"
+        "events = []\n"
+        "sys.addaudithook(lambda event, args: events.append(event) if event == 'socket.connect' else None)\n"
+        "import nutrition_logger.main, nutrition_logger.api, nutrition_logger.async_db\n"
+        "print(json.dumps(events))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", probe], check=True, capture_output=True, text=True).stdout
+    assert json.loads(output) == []
+
+def test_bootstrap_fresh_database(empty_database):
+    assert bootstrap(empty_database) == []
+    tables = set(inspect(empty_database).get_table_names())
+    assert set(Base.metadata.tables) <= tables
+    with empty_database.connect() as connection:
+        recorded = set(connection.scalars(select(SchemaMigration.name)))
+    assert recorded == {name for name, _ in MIGRATIONS}
+
+    #running it again is a no-op
+    assert bootstrap(empty_database) == []
+
+def test_bootstrap_upgrades_legacy_schema(empty_database):
+    #the schema as the first version created it: unique manufacturer, no search index, no daily_totals
+    legacy = [Base.metadata.tables[name] for name in ("users", "foods", "daily_logs", "food_entries")]
+    Base.metadata.create_all(empty_database, tables=legacy)
+    with empty_database.begin() as connection:
+        connection.execute(text("DROP INDEX ix_foods_search_fts"))
+        connection.execute(text("DROP INDEX ix_food_entries_daily_log_id, ix_food_entries_food_id"))
+        connection.execute(text("ALTER TABLE daily_logs DROP CONSTRAINT _user_date_uc, ADD CONSTRAINT _user_date_uc UNIQUE (user_id, date)"))
+        connection.execute(text("ALTER TABLE foods ADD CONSTRAINT foods_manufacturer_key UNIQUE (manufacturer)"))
+        connection.execute(text(
+            "ALTER TABLE foods DROP COLUMN base_unit, DROP COLUMN base_amount, DROP COLUMN calories_per_100, "
+            "DROP COLUMN protein_per_100, DROP COLUMN carbs_per_100, DROP COLUMN fat_per_100"
+        ))
+        connection.execute(text("ALTER TABLE daily_logs DROP COLUMN version"))
+
+    #core inserts, the ORM flush listeners would write to the missing daily_totals
+    with empty_database.begin() as connection:
+        user_id = connection.execute(User.__table__.insert().values(username="legacy", email="legacy@example.com").returning(User.id)).scalar()
+        food_id = connection.execute(Food.__table__.insert().values(name="Oats", manufacturer="Acme", serving_size=40, unit="g", calories=150, protein=5, carbs=27, fat=3).returning(Food.id)).scalar()
+        log_id = connection.execute(DailyLog.__table__.insert().values(user_id=user_id).returning(DailyLog.id)).scalar()
+        connection.execute(FoodEntry.__table__.insert().values(daily_log_id=log_id, food_id=food_id, quantity=2))
+
+    assert bootstrap(empty_database) == [name for name, _ in MIGRATIONS]
+
+    inspector = inspect(empty_database)
+    assert "foods_manufacturer_key" not in {c["name"] for c in inspector.get_unique_constraints("foods")}
+    assert "ix_foods_search_fts" in {index["name"] for index in inspector.get_indexes("foods")}
+    assert {"ix_food_entries_daily_log_id", "ix_food_entries_food_id"} <= {index["name"] for index in inspector.get_indexes("food_entries")}
+    assert "ix_daily_totals_covering" in {index["name"] for index in inspector.get_indexes("daily_totals")}
+    with empty_database.connect() as connection:
+        totals = connection.execute(select(DailyTotals).where(DailyTotals.daily_log_id == log_id)).one()
+    assert (totals.calories, totals.entry_count) == (300, 1)
+    with empty_database.connect() as connection:
+        quick_add = connection.execute(select(UserFood)).one()
+    assert (quick_add.user_id, quick_add.food_id, quick_add.entry_count) == (user_id, food_id, 1)
+
+    #existing foods are normalized as the generated columns are added
+    with empty_database.connect() as connection:
+        food = connection.execute(select(Food).where(Food.id == food_id)).one()
+    assert (food.base_unit, food.base_amount, food.calories_per_100) == ("g", 40, 375)
+    assert "version" in {column["name"] for column in inspect(empty_database).get_columns("daily_logs")}
+    assert bootstrap(empty_database) == []
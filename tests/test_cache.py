@@ -0,0 +1,152 @@
+import pytest, os
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.models import Base, User, Food, DailyLog, FoodEntry
+from nutrition_logger.cache import FoodCache, CachedFood, food_cache, entries_totals
+from nutrition_logger.totals import log_totals
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+user = os.environ.get("POSTGRES_USER")
+password = os.environ.get("POSTGRES_PW")
+db = os.environ.get("POSTGRES_TEST_DB")
+host = os.environ.get("POSTGRES_HOST", "localhost")
+port = os.environ.get("POSTGRES_PORT", 5432)
+
+# Construct database URL
+TEST_DB_URL = f"postgresql://{user}:{password}@{host}:{port}/{db}"
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# create session
+@pytest.fixture(scope="function")
+def db_session(engine, tables):
+    connection = engine.connect()
+    transaction = connection.begin()
+    Session = sessionmaker(bind=connection)
+    session = Session()
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture(scope="function")
+def foods(db_session):
+    foods = [
+        Food(name=name, manufacturer="Acme", serving_size=100, unit="g", calories=calories, protein=1, carbs=2, fat=3)
+        for name, calories in [("Banana", 105), ("Oats", 150), ("Rice", 130)]
+    ]
+    db_session.add_all(foods)
+    db_session.commit()
+    return [food.id for food in foods]
+
+def count_queries(session):
+    statements = []
+    event.listen(session.bind, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+def test_read_through_and_stats(db_session, foods):
+    cache = FoodCache()
+    statements = count_queries(db_session)
+
+    first = cache.get_many(db_session, foods)
+    second = cache.get_many(db_session, foods)
+
+    assert len(statements) == 1
+    assert first == second
+    assert isinstance(first[foods[0]], CachedFood)
+    assert first[foods[0]].name == "Banana"
+    assert cache.stats() == {"hits": 3, "misses": 3, "evictions": 0, "expirations": 0, "size": 3, "maxsize": 10_000}
+    assert cache.get(db_session, 9999) is None
+
+def test_lru_eviction(db_session, foods):
+    cache = FoodCache(maxsize=2)
+    cache.get(db_session, foods[0])
+    cache.get(db_session, foods[1])
+    cache.get(db_session, foods[0])
+    cache.get(db_session, foods[2])
+
+    assert len(cache) == 2
+    assert cache.evictions == 1
+    cache.get(db_session, foods[0])
+    assert cache.hits == 2
+
+def test_ttl_expiry(db_session, foods):
+    clock = FakeClock()
+    cache = FoodCache(ttl=10, clock=clock)
+    cache.get(db_session, foods[0])
+    clock.now = 9.9
+    cache.get(db_session, foods[0])
+    clock.now = 10
+    cache.get(db_session, foods[0])
+
+    assert (cache.hits, cache.misses, cache.expirations) == (1, 2, 1)
+
+def test_invalidated_on_update_and_delete(db_session, foods):
+    cache = FoodCache().watch()
+    try:
+        cache.get_many(db_session, foods)
+        banana = db_session.get(Food, foods[0])
+        banana.calories = 90
+        db_session.flush()
+        assert foods[0] not in cache._entries
+        assert cache.get(db_session, foods[0]).calories == 90
+        db_session.commit()
+        assert cache.get(db_session, foods[0]).calories == 90
+
+        db_session.delete(db_session.get(Food, foods[2]))
+        db_session.commit()
+        assert cache.get(db_session, foods[2]) is None
+    finally:
+        cache.unwatch()
+
+def test_uncommitted_write_not_cached(db_session, foods):
+    cache = FoodCache().watch()
+    try:
+        savepoint = db_session.begin_nested()
+        banana = db_session.get(Food, foods[0])
+        banana.calories = 1
+        db_session.flush()
+        assert cache.get(db_session, foods[0]).calories == 1
+        savepoint.rollback()
+
+        assert cache.get(db_session, foods[0]).calories == 105
+    finally:
+        cache.unwatch()
+
+def test_entries_totals_match_sql(db_session, foods):
+    alice = User(username="alice", email="alice@example.com")
+    log = DailyLog(user=alice)
+    log.food_entries = [FoodEntry(food_id=foods[0], quantity=2), FoodEntry(food_id=foods[1], quantity=0.5)]
+    db_session.add(log)
+    db_session.commit()
+
+    totals = entries_totals(db_session, log.food_entries)
+    expected = log_totals(db_session, log.id)
+
+    assert totals["calories"] == pytest.approx(expected.calories)
+    assert totals["fat"] == pytest.approx(expected.fat)
+    assert totals["entry_count"] == 2
+    assert food_cache.stats()["size"] >= 2
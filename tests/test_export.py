@@ -0,0 +1,118 @@
+import pytest, os, csv, datetime, io, json, tracemalloc
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.models import Base, User, Food, DailyLog, FoodEntry
+from nutrition_logger.archive import ColdArchive, archive_old_logs
+from nutrition_logger.export import export_user
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+user = os.environ.get("POSTGRES_USER")
+password = os.environ.get("POSTGRES_PW")
+db = os.environ.get("POSTGRES_TEST_DB")
+host = os.environ.get("POSTGRES_HOST", "localhost")
+port = os.environ.get("POSTGRES_PORT", 5432)
+
+# Construct database URL
+TEST_DB_URL = f"postgresql://{user}:{password}@{host}:{port}/{db}"
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# create session
+@pytest.fixture(scope="function")
+def db_session(engine, tables):
+    connection = engine.connect()
+    transaction = connection.begin()
+    Session = sessionmaker(bind=connection)
+    session = Session()
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+# two users, two foods and three days of logs, the last day left empty
+
+
+@pytest.fixture(scope="function")
+def history(db_session):
+    user = User(username="alice", email="alice@example.com")
+    oats = Food(name="Oats", manufacturer="Acme", serving_size=40, unit="g", calories=150, protein=5, carbs=27, fat=3)
+    milk = Food(name="Milk", manufacturer="Dairy", serving_size=250, unit="ml", calories=120, protein=8, carbs=12, fat=5)
+    db_session.add_all([
+        DailyLog(user=user, date=datetime.date(2024, 1, 2), food_entries=[FoodEntry(food=oats, quantity=2), FoodEntry(food=milk)]),
+        DailyLog(user=user, date=datetime.date(2024, 5, 1), food_entries=[FoodEntry(food=milk, quantity=0.5)]),
+        DailyLog(user=user, date=datetime.date(2024, 5, 2)),
+    ])
+    db_session.commit()
+    return user.id
+
+def test_export_ndjson(db_session, history):
+    lines = b"".join(export_user(db_session, history)).decode().splitlines()
+    rows = [json.loads(line) for line in lines]
+    assert [(row["date"], row["food"], row["quantity"], row["calories"]) for row in rows] == [
+        ("2024-01-02", "Oats", 2, 300),
+        ("2024-01-02", "Milk", 1, 120),
+        ("2024-05-01", "Milk", 0.5, 60),
+        ("2024-05-02", None, None, None),
+    ]
+
+def test_export_csv_range(db_session, history):
+    data = b"".join(export_user(db_session, history, "csv", start=datetime.date(2024, 5, 1))).decode()
+    rows = list(csv.DictReader(io.StringIO(data)))
+    assert [(row["date"], row["food"], row["quantity"]) for row in rows] == [("2024-05-01", "Milk", "0.5"), ("2024-05-02", "", "")]
+
+def test_export_includes_archive(db_session, history, tmp_path):
+    before = b"".join(export_user(db_session, history))
+    archive = ColdArchive(str(tmp_path))
+    assert archive_old_logs(db_session, archive, keep_days=30, today=datetime.date(2024, 4, 1)) == [(2024, 1)]
+    assert b"".join(export_user(db_session, history, archive=archive)) == before
+
+def test_export_archived_empty_log(db_session, history, tmp_path):
+    before = b"".join(export_user(db_session, history, "csv"))
+    archive = ColdArchive(str(tmp_path))
+    assert archive_old_logs(db_session, archive, keep_days=30, today=datetime.date(2024, 7, 1)) == [(2024, 1), (2024, 5)]
+    assert b"".join(export_user(db_session, history, "csv", archive=archive)) == before
+
+#peak memory follows the chunk size, not the length of the history
+def test_export_memory_is_flat(db_session):
+    user = User(username="long", email="long@example.com")
+    food = Food(name="Oats", manufacturer="Acme", serving_size=40, unit="g", calories=150, protein=5, carbs=27, fat=3)
+    db_session.add_all([user, food])
+    db_session.commit()
+
+    def seed(days):
+        db_session.execute(text("DELETE FROM food_entries; DELETE FROM daily_totals; DELETE FROM daily_logs"))
+        db_session.execute(text(
+            "INSERT INTO daily_logs (user_id, date) SELECT :user, DATE '2000-01-01' + d FROM generate_series(0, :days - 1) d"
+        ), {"user": user.id, "days": days})
+        db_session.execute(text(
+            "INSERT INTO food_entries (daily_log_id, food_id, quantity) SELECT l.id, :food, e FROM daily_logs l, generate_series(1, 5) e"
+        ), {"food": food.id})
+
+    def peak(days):
+        seed(days)
+        tracemalloc.start()
+        size = sum(len(chunk) for chunk in export_user(db_session, user.id, chunk_size=200))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return size, peak
+
+    small_size, small_peak = peak(400)
+    large_size, large_peak = peak(3200)
+    assert large_size > 7 * small_size
+    assert large_peak < 2 * small_peak
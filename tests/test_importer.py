@@ -0,0 +1,114 @@
+import pytest, os, json
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.models import Base, User, Food, DailyLog, FoodEntry
+from nutrition_logger.importer import import_foods
+from nutrition_logger.totals import stored_totals
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+user = os.environ.get("POSTGRES_USER")
+password = os.environ.get("POSTGRES_PW")
+db = os.environ.get("POSTGRES_TEST_DB")
+host = os.environ.get("POSTGRES_HOST", "localhost")
+port = os.environ.get("POSTGRES_PORT", 5432)
+
+# Construct database URL
+TEST_DB_URL = f"postgresql://{user}:{password}@{host}:{port}/{db}"
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# create session
+@pytest.fixture(scope="function")
+def db_session(engine, tables):
+    connection = engine.connect()
+    transaction = connection.begin()
+    Session = sessionmaker(bind=connection)
+    session = Session()
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+CSV_CATALOG = """name,manufacturer,serving_size,unit,calories,protein,carbs,fat
+Banana,Chiquita,118,g,105,1.3,27,0.3
+Plantain,Chiquita,148,g,181,1.9,47,0.5
+,Nobody,1,g,1,1,1,1
+Apple,Granny,182,g,,0.5,25,0.3
+Broken,Acme,-5,g,10,1,1,1
+"""
+
+def write_file(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_text(content)
+    return str(path)
+
+def collect_errors():
+    errors = []
+    return errors, lambda line_number, row, reason: errors.append((line_number, reason))
+
+@pytest.mark.parametrize("method", ["insert", "copy"])
+def test_import_csv(db_session, tmp_path, method):
+    errors, on_error = collect_errors()
+    report = import_foods(db_session.connection(), write_file(tmp_path, "foods.csv", CSV_CATALOG), batch_size=2, method=method, on_error=on_error)
+
+    assert (report.read, report.written, report.rejected) == (5, 3, 2)
+    assert [line for line, _ in errors] == [4, 6]
+    assert "name" in errors[0][1]
+    assert "serving_size" in errors[1][1]
+
+    foods = {food.name: food for food in db_session.query(Food)}
+    assert set(foods) == {"Banana", "Plantain", "Apple"}
+    assert foods["Plantain"].manufacturer == "Chiquita"
+    assert foods["Apple"].calories == 0
+
+def test_import_jsonl_reports_bad_lines(db_session, tmp_path):
+    lines = [
+        json.dumps({"name": "Oats", "manufacturer": "Quaker", "serving_size": 40, "unit": "g", "calories": 150}),
+        "{not json",
+        json.dumps({"name": "Rice", "manufacturer": "Uncle Ben", "unit": "g", "calories": 130, "carbs": 28}),
+    ]
+    errors, on_error = collect_errors()
+    report = import_foods(db_session.connection(), write_file(tmp_path, "foods.jsonl", "\n".join(lines)), on_error=on_error)
+
+    assert (report.written, report.rejected) == (2, 1)
+    assert errors[0][0] == 2
+    assert db_session.query(Food).filter_by(name="Rice").one().serving_size == 1.0
+
+def test_import_upserts_on_name_and_updates_totals(db_session, tmp_path):
+    alice = User(username="alice", email="alice@example.com")
+    banana = Food(name="Banana", manufacturer="Dole", serving_size=118, unit="g", calories=100, protein=1, carbs=20, fat=0)
+    log = DailyLog(user=alice)
+    log.food_entries = [FoodEntry(food=banana, quantity=2)]
+    db_session.add(log)
+    db_session.commit()
+
+    report = import_foods(db_session.connection(), write_file(tmp_path, "foods.csv", CSV_CATALOG))
+    db_session.expire_all()
+
+    assert report.written == 3
+    assert db_session.query(Food).count() == 3
+    assert banana.manufacturer == "Chiquita"
+    assert banana.calories == 105
+    totals = stored_totals(db_session, log.id)
+    assert totals.calories == pytest.approx(210)
+    assert totals.carbs == pytest.approx(54)
+
+def test_import_unknown_format(db_session, tmp_path):
+    with pytest.raises(ValueError):
+        import_foods(db_session.connection(), write_file(tmp_path, "foods.xml", "<foods/>"))
@@ -0,0 +1,128 @@
+import pytest, os, datetime
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, select, text
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.cache import FoodCache
+from nutrition_logger.models import Base, DailyLog
+from nutrition_logger.rollups import entry_columns, stored_day_columns
+from nutrition_logger.schema import DailyLogWithFoods
+from nutrition_logger.search import search_foods
+from nutrition_logger.totals import (
+    log_totals, logs_totals, daily_totals, users_daily_totals, range_totals,
+    stored_totals, stored_daily_totals, food_change_deltas, rebuild_daily_totals
+)
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+user = os.environ.get("POSTGRES_USER")
+password = os.environ.get("POSTGRES_PW")
+db = os.environ.get("POSTGRES_TEST_DB")
+host = os.environ.get("POSTGRES_HOST", "localhost")
+port = os.environ.get("POSTGRES_PORT", 5432)
+
+# Construct database URL
+TEST_DB_URL = f"postgresql://{user}:{password}@{host}:{port}/{db}"
+
+USERS, DAYS, ENTRIES, FOODS = 300, 60, 4, 50_000
+START = datetime.date(2024, 1, 1)
+
+# connect to database
+@pytest.fixture(scope="module")
+def engine():
+    engine = create_engine(TEST_DB_URL)
+    yield engine
+
+# committed, analyzed data large enough for the planner to prefer indexes wherever they apply
+@pytest.fixture(scope="module")
+def seeded(engine):
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO users (username, email) "
+            "SELECT 'user' || i, 'user' || i || '@example.com' FROM generate_series(1, :users) i"
+        ), {"users": USERS})
+        connection.execute(text(
+            "INSERT INTO foods (name, manufacturer, serving_size, unit, calories, protein, carbs, fat) "
+            "SELECT 'food' || i, 'brand' || (i % 50), 100, 'g', i % 400, i % 30, i % 60, i % 20 FROM generate_series(1, :foods) i"
+        ), {"foods": FOODS})
+        connection.execute(text(
+            "INSERT INTO daily_logs (user_id, date) "
+            "SELECT u, CAST(:start AS date) + d FROM generate_series(1, :users) u, generate_series(0, :days - 1) d"
+        ), {"users": USERS, "days": DAYS, "start": START})
+        connection.execute(text(
+            "INSERT INTO food_entries (daily_log_id, food_id, quantity) "
+            "SELECT l.id, 1 + (l.id * 7 + e * 13) % :foods, 1 + e FROM daily_logs l, generate_series(1, :entries) e"
+        ), {"foods": FOODS, "entries": ENTRIES})
+    with sessionmaker(bind=engine)() as session:
+        rebuild_daily_totals(session)
+        session.commit()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("VACUUM ANALYZE"))
+    yield
+    Base.metadata.drop_all(engine)
+
+@pytest.fixture(scope="function")
+def db_session(engine, seeded):
+    connection = engine.connect()
+    transaction = connection.begin()
+    Session = sessionmaker(bind=connection)
+    session = Session()
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+def _seq_scans(plan):
+    found = [plan["Relation Name"]] if plan["Node Type"] == "Seq Scan" else []
+    for child in plan.get("Plans", []):
+        found += _seq_scans(child)
+    return found
+
+#run a hot query and EXPLAIN every statement it sent, with the parameters it sent them with
+def assert_no_seq_scan(session, run):
+    statements = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+    connection = session.connection()
+    event.listen(connection, "before_cursor_execute", capture)
+    try:
+        run(session)
+    finally:
+        event.remove(connection, "before_cursor_execute", capture)
+
+    assert statements
+    for statement, parameters in statements:
+        plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()[0]["Plan"]
+        assert _seq_scans(plan) == [], f"sequential scan in\n{statement}"
+
+def log_id(session, user_id, day):
+    stmt = select(DailyLog.id).where(DailyLog.user_id == user_id, DailyLog.date == START + datetime.timedelta(days=day))
+    return session.scalar(stmt)
+
+END = START + datetime.timedelta(days=29)
+MACROS_CHANGE = ([0, 0, 0, 0], [1, 1, 1, 1])
+
+HOT_QUERIES = {
+    "log_totals": lambda s: log_totals(s, log_id(s, 7, 3)),
+    "logs_totals": lambda s: logs_totals(s, [log_id(s, 7, day) for day in range(5)]),
+    "daily_totals": lambda s: daily_totals(s, 7, START, END),
+    "users_daily_totals": lambda s: users_daily_totals(s, [7, 8, 9], START, END),
+    "range_totals": lambda s: range_totals(s, 7, START, END),
+    "stored_totals": lambda s: stored_totals(s, log_id(s, 7, 3)),
+    "stored_daily_totals": lambda s: stored_daily_totals(s, 7, START, END),
+    "food_change_deltas": lambda s: food_change_deltas(s, {42: MACROS_CHANGE}),
+    "entry_columns": lambda s: entry_columns(s, [7], START, END),
+    "stored_day_columns": lambda s: stored_day_columns(s, [7], START, END),
+    "load_log_with_foods": lambda s: s.get(DailyLog, log_id(s, 7, 3), options=DailyLogWithFoods.loader_options()),
+    "user_logs": lambda s: s.scalars(select(DailyLog).where(DailyLog.user_id == 7).order_by(DailyLog.date)).all(),
+    "food_cache": lambda s: FoodCache().get_many(s, [1, 2, 3]),
+    "search_foods": lambda s: search_foods(s, "food123"),
+}
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_hot_query_uses_indexes(db_session, name):
+    assert_no_seq_scan(db_session, HOT_QUERIES[name])
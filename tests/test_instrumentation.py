@@ -0,0 +1,134 @@
+import pytest, os, datetime
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.models import Base, User, Food, DailyLog, FoodEntry
+from nutrition_logger.instrumentation import QueryMetrics, track_queries
+from nutrition_logger.schema import DailyLogWithFoods
+from nutrition_logger.testing import query_budget
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+user = os.environ.get("POSTGRES_USER")
+password = os.environ.get("POSTGRES_PW")
+db = os.environ.get("POSTGRES_TEST_DB")
+host = os.environ.get("POSTGRES_HOST", "localhost")
+port = os.environ.get("POSTGRES_PORT", 5432)
+
+# Construct database URL
+TEST_DB_URL = f"postgresql://{user}:{password}@{host}:{port}/{db}"
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# create session
+@pytest.fixture(scope="function")
+def db_session(engine, tables):
+    connection = engine.connect()
+    transaction = connection.begin()
+    Session = sessionmaker(bind=connection)
+    session = Session()
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+@pytest.fixture(scope="function")
+def logs(db_session):
+    user = User(username="user", email="user@example.com")
+    foods = [
+        Food(name=f"Food {i}", manufacturer="Acme", serving_size=100, unit="g", calories=100, protein=1, carbs=2, fat=3)
+        for i in range(5)
+    ]
+    db_session.add_all([
+        DailyLog(user=user, date=datetime.date(2024, 1, day), food_entries=[FoodEntry(food=food) for food in foods])
+        for day in range(1, 6)
+    ])
+    db_session.commit()
+    db_session.expunge_all()
+
+#the pattern this is meant to catch: entries, then each entry's food, lazily in a loop
+def lazy_walk(session):
+    for log in session.scalars(select(DailyLog)):
+        for entry in log.food_entries:
+            entry.food.name
+
+def test_lazy_loading_flagged(db_session, logs):
+    with track_queries("lazy", metrics=None) as stats:
+        lazy_walk(db_session)
+
+    #logs, 5 x food_entries, then each of the 5 foods once (identity map)
+    assert stats.count == 11
+    assert stats.time > 0
+    repeated = dict(stats.repeated())
+    assert sorted(repeated.values()) == [5, 5]
+    assert any("food_entries" in statement for statement in repeated)
+
+def test_eager_loading_not_flagged(db_session, logs):
+    with track_queries("eager", metrics=None) as stats:
+        logs = db_session.scalars(select(DailyLog).options(*DailyLogWithFoods.loader_options())).all()
+        [DailyLogWithFoods.model_validate(log) for log in logs]
+    assert stats.count == 3
+    assert stats.repeated() == []
+
+def test_slowest_and_nesting(db_session):
+    with track_queries("outer", slowest=2, metrics=None) as outer:
+        db_session.execute(text("SELECT 1"))
+        with track_queries("inner", metrics=None) as inner:
+            db_session.execute(text("SELECT pg_sleep(0.05)"))
+            db_session.execute(text("SELECT 2"))
+    assert (outer.count, inner.count) == (3, 2)
+    slowest = outer.slowest()
+    assert len(slowest) == 2
+    assert "pg_sleep" in slowest[0][1]
+    assert slowest[0][0] >= 0.05
+
+def test_failed_statement_keeps_timing(db_session):
+    with track_queries(metrics=None) as stats:
+        with pytest.raises(ProgrammingError):
+            with db_session.begin_nested():
+                db_session.execute(text("SELECT * FROM no_such_table"))
+        db_session.execute(text("SELECT pg_sleep(0.02)"))
+    assert stats.slowest()[0][0] >= 0.02
+    assert not db_session.connection().info.get("query_start")
+
+def test_metrics_aggregate(db_session, logs):
+    metrics = QueryMetrics()
+    with track_queries("lazy", metrics=metrics):
+        lazy_walk(db_session)
+    db_session.expunge_all()
+    with track_queries("one", metrics=metrics):
+        db_session.execute(text("SELECT 1"))
+
+    stats = metrics.stats()
+    assert (stats["units"], stats["statements"], stats["n_plus_one"]) == (2, 12, 1)
+    assert stats["db_time"] > 0
+    assert {slow["unit"] for slow in stats["slowest"]} <= {"lazy", "one"}
+
+def test_query_budget(db_session, logs, query_budget):
+    with query_budget(3):
+        db_session.scalars(select(DailyLog).options(*DailyLogWithFoods.loader_options())).all()
+
+    db_session.expunge_all()
+    with pytest.raises(AssertionError, match="likely N\\+1"):
+        with query_budget(100):
+            lazy_walk(db_session)
+
+    with pytest.raises(AssertionError, match="budget 1"):
+        with query_budget(1):
+            db_session.execute(text("SELECT 1"))
+            db_session.execute(text("SELECT 2"))
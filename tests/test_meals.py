@@ -0,0 +1,170 @@
+import pytest, os, datetime, threading
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, update
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.cache import food_cache
+from nutrition_logger.models import Base, User, Food, DailyLog, FoodEntry
+from nutrition_logger.meals import get_or_create_log, log_entries, log_entry
+from nutrition_logger.schema import BulkEntryCreate
+from nutrition_logger.totals import log_totals, stored_totals, TOTAL_COLUMNS
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+user = os.environ.get("POSTGRES_USER")
+password = os.environ.get("POSTGRES_PW")
+db = os.environ.get("POSTGRES_TEST_DB")
+host = os.environ.get("POSTGRES_HOST", "localhost")
+port = os.environ.get("POSTGRES_PORT", 5432)
+
+# Construct database URL
+TEST_DB_URL = f"postgresql://{user}:{password}@{host}:{port}/{db}"
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# create session
+@pytest.fixture(scope="function")
+def db_session(engine, tables):
+    connection = engine.connect()
+    transaction = connection.begin()
+    Session = sessionmaker(bind=connection)
+    session = Session()
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+# two users, two foods and three days of logs, the last day left empty
+
+@pytest.fixture(scope="function")
+def seeded(db_session):
+    users = [User(username=f"user{i}", email=f"user{i}@example.com") for i in range(2)]
+    foods = [
+        Food(name="Oats", manufacturer="Acme", serving_size=40, unit="g", calories=150, protein=5, carbs=27, fat=3),
+        Food(name="Milk", manufacturer="Dairy", serving_size=250, unit="ml", calories=120, protein=8, carbs=12, fat=5),
+    ]
+    existing = DailyLog(user=users[0], date=datetime.date(2024, 1, 1), food_entries=[FoodEntry(food=foods[0], quantity=1)])
+    db_session.add_all([*users, *foods, existing])
+    db_session.commit()
+    return [user.id for user in users], [food.id for food in foods], existing.id
+
+def count_queries(session):
+    statements = []
+    event.listen(session.bind, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+def test_log_entries_batch(db_session, seeded):
+    (alice, bob), (oats, milk), existing = seeded
+    start = datetime.date(2024, 1, 1)
+    items = [
+        BulkEntryCreate(user_id=user_id, date=start + datetime.timedelta(days=day), food_id=food_id, quantity=quantity)
+        for day in range(30) for user_id in (alice, bob) for food_id, quantity in ((oats, 1.5), (milk, 2))
+    ]
+    statements = count_queries(db_session)
+    entries = log_entries(db_session, items)
+
+    #foods, users, logs upsert, entries insert, daily_totals deltas, log versions and user_foods counts
+    assert len(statements) <= 7
+    assert [(entry.food_id, entry.quantity) for entry in entries] == [(item.food_id, item.quantity) for item in items]
+    assert len({entry.id for entry in entries}) == len(items)
+
+    logs = {(log.user_id, log.date): log.id for log in db_session.query(DailyLog)}
+    assert len(logs) == 60
+    assert logs[(alice, start)] == existing
+    assert [entry.daily_log_id for entry in entries] == [logs[(item.user_id, item.date)] for item in items]
+
+    db_session.commit()
+    for log_id in logs.values():
+        stored = stored_totals(db_session, log_id)
+        computed = log_totals(db_session, log_id)
+        for column in TOTAL_COLUMNS:
+            assert getattr(stored, column) == pytest.approx(getattr(computed, column))
+    assert stored_totals(db_session, existing).entry_count == 3
+
+def test_log_entries_unknown_food(db_session, seeded):
+    (alice, _), _, _ = seeded
+    with pytest.raises(ValueError, match="unknown food ids"):
+        log_entries(db_session, [BulkEntryCreate(user_id=alice, date=datetime.date(2024, 2, 1), food_id=999)])
+    assert db_session.query(DailyLog).count() == 1
+
+def test_log_entries_unknown_user(db_session, seeded):
+    (alice, bob), (oats, _), _ = seeded
+    items = [BulkEntryCreate(user_id=user_id, date=datetime.date(2024, 2, 1), food_id=oats) for user_id in (alice, bob + 1, bob + 7)]
+    with pytest.raises(ValueError, match=rf"unknown user ids \[{bob + 1}, {bob + 7}\]"):
+        log_entries(db_session, items)
+    assert db_session.query(DailyLog).count() == 1
+
+#another process changes a food's macros, this process's cache cannot know: totals are valued from the database
+def test_stored_totals_ignore_stale_cache(db_session, seeded):
+    (alice, _), (oats, _), existing = seeded
+    food_cache.get(db_session, oats)
+    db_session.execute(update(Food).where(Food.id == oats).values(calories=200))
+    log_entries(db_session, [BulkEntryCreate(user_id=alice, date=datetime.date(2024, 1, 1), food_id=oats)])
+    log_entry(db_session, alice, oats, 1, datetime.date(2024, 1, 1))
+    db_session.commit()
+    #the entry logged before the change keeps its old value in the stored totals until a rebuild
+    assert stored_totals(db_session, existing).calories == pytest.approx(150 + 2 * 200)
+
+def test_log_entries_empty(db_session):
+    assert log_entries(db_session, []) == []
+
+def test_get_or_create_log(db_session, seeded):
+    (alice, _), _, existing = seeded
+    assert get_or_create_log(db_session, alice, datetime.date(2024, 1, 1)) == existing
+    today = get_or_create_log(db_session, alice)
+    assert today != existing
+    assert get_or_create_log(db_session, alice) == today
+    assert db_session.get(DailyLog, today).date == datetime.date.today()
+
+#real transactions from many threads racing to create the same day's log, none may fail
+def test_log_entry_concurrent_first_writes(engine, tables):
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        user = User(username="racer", email="racer@example.com")
+        food = Food(name="Oats", manufacturer="Acme", serving_size=40, unit="g", calories=150, protein=5, carbs=27, fat=3)
+        session.add_all([user, food])
+        session.commit()
+        user_id, food_id = user.id, food.id
+
+    threads, days = 8, 15
+    start = datetime.date(2024, 1, 1)
+    barrier = threading.Barrier(threads)
+    failures = []
+
+    def write():
+        for day in range(days):
+            #everyone starts the same new day together
+            barrier.wait()
+            try:
+                with Session() as session:
+                    log_entry(session, user_id, food_id, 1, start + datetime.timedelta(days=day))
+                    session.commit()
+            except Exception as error:
+                failures.append(error)
+
+    workers = [threading.Thread(target=write) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert failures == []
+    with Session() as session:
+        logs = session.query(DailyLog).filter(DailyLog.user_id == user_id).all()
+        assert len(logs) == days
+        for log in logs:
+            assert len(log.food_entries) == threads
+            assert stored_totals(session, log.id).entry_count == threads
@@ -0,0 +1,55 @@
+import pytest, os, threading
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError
+
+from nutrition_logger.config import database_url, engine_options
+from nutrition_logger.pool import TimedQueuePool, pool_stats
+
+# Load environment variables
+load_dotenv()
+
+# Construct database URL
+TEST_DB_URL = database_url(database=os.environ.get("POSTGRES_TEST_DB"))
+
+def test_engine_options_from_env(monkeypatch):
+    monkeypatch.setenv("POSTGRES_POOL_SIZE", "3")
+    monkeypatch.setenv("POSTGRES_MAX_OVERFLOW", "1")
+    monkeypatch.setenv("POSTGRES_POOL_PRE_PING", "false")
+    monkeypatch.setenv("POSTGRES_POOL_RECYCLE", "600")
+    monkeypatch.setenv("POSTGRES_STATEMENT_TIMEOUT", "1500")
+
+    options = engine_options()
+    assert (options["pool_size"], options["max_overflow"], options["pool_pre_ping"], options["pool_recycle"]) == (3, 1, False, 600)
+    assert options["connect_args"] == {"options": "-c statement_timeout=1500"}
+    assert engine_options("asyncpg")["connect_args"] == {"server_settings": {"statement_timeout": "1500"}}
+
+def test_statement_timeout_applied(monkeypatch):
+    monkeypatch.setenv("POSTGRES_STATEMENT_TIMEOUT", "1500")
+    engine = create_engine(TEST_DB_URL, poolclass=TimedQueuePool, **engine_options())
+    with engine.connect() as connection:
+        assert connection.execute(text("SHOW statement_timeout")).scalar() == "1500ms"
+    engine.dispose()
+
+def test_pool_stats_track_checkouts_and_waits():
+    engine = create_engine(TEST_DB_URL, poolclass=TimedQueuePool, pool_size=1, max_overflow=1, pool_timeout=0.2)
+    first = engine.connect()
+    second = engine.connect()
+    stats = pool_stats(engine)
+    assert (stats["checked_out"], stats["overflow"], stats["waits"]) == (2, 1, 2)
+
+    #both slots are taken, the third checkout waits out pool_timeout
+    with pytest.raises(TimeoutError):
+        engine.connect()
+    stats = pool_stats(engine)
+    assert stats["timeouts"] == 1
+    assert stats["max_wait"] >= 0.2
+
+    #a waiting checkout gets the connection as soon as it is returned
+    threading.Timer(0.05, first.close).start()
+    engine.connect().close()
+    second.close()
+    stats = pool_stats(engine)
+    assert stats["checked_out"] == 0
+    assert stats["waits"] == 4
+    engine.dispose()
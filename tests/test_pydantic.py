@@ -1,14 +1,16 @@
 import pytest, json, os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import create_engine, inspect, event, select
 from sqlalchemy.orm import sessionmaker, Session
 from pydantic import ValidationError
-from nutrition_logger.models import Base, User
+from nutrition_logger.models import Base, User, Food, DailyLog, FoodEntry
 from nutrition_logger.schema import (
     UserCreate, UserResponse, UserUpdate, 
     FoodCreate, FoodResponse, FoodUpdate, 
     DailyLogCreate, DailyLogResponse, 
-    FoodEntryCreate, FoodEntryResponse, FoodEntryUpdate
+    FoodEntryCreate, FoodEntryResponse, FoodEntryUpdate,
+    UserDetail, DailyLogDetail, DailyLogWithFoods, FoodEntryDetail, FoodEntrySummary,
+    list_adapter, validate_many,
 )
 
 
@@ -208,3 +210,82 @@ def test_deserialize(db_session):
     assert db_user.username == user["username"]
     assert db_user.email == user["email"]
     assert db_user.logs == user["logs"]
+
+# depth-bounded responses never lazy-load and never point back up
+
+@pytest.fixture(scope="function")
+def logged_user(db_session):
+    user = User(username="testuser", email="testuser@example.com")
+    food = Food(name="Banana", manufacturer="Chiquita", serving_size=118, unit="g", calories=105, protein=1.3, carbs=27, fat=0.3)
+    log = DailyLog(user=user)
+    log.food_entries = [FoodEntry(food=food, quantity=2), FoodEntry(food=food)]
+    db_session.add(log)
+    db_session.commit()
+    return user
+
+def test_log_detail_with_loader_options(db_session, logged_user):
+    log = db_session.scalars(select(DailyLog).options(*DailyLogWithFoods.loader_options())).one()
+
+    statements = []
+    event.listen(db_session.bind, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    parsed_json = json.loads(DailyLogWithFoods.model_validate(log).model_dump_json())
+    by_id = json.loads(DailyLogDetail.model_validate(log).model_dump_json())
+
+    assert statements == []
+    assert set(parsed_json.keys()) == {"id", "user_id", "date", "food_entries"}
+    assert [entry["quantity"] for entry in parsed_json["food_entries"]] == [2.0, 1.0]
+    assert parsed_json["food_entries"][0]["food"]["name"] == "Banana"
+    assert set(by_id["food_entries"][0].keys()) == {"id", "daily_log_id", "food_id", "quantity"}
+
+def test_unloaded_relationship_is_rejected(db_session, logged_user):
+    log = db_session.scalars(select(DailyLog)).one()
+
+    with pytest.raises(ValidationError) as error:
+        DailyLogDetail.model_validate(log)
+
+    assert "food_entries" in str(error)
+
+def test_expired_instance_is_rejected(db_session, logged_user):
+    entry = db_session.scalars(select(FoodEntry).options(*FoodEntryDetail.loader_options())).first()
+    db_session.expire(entry)
+
+    with pytest.raises(ValidationError):
+        FoodEntryDetail.model_validate(entry)
+
+def test_user_detail(db_session, logged_user):
+    user = db_session.scalars(select(User).options(*UserDetail.loader_options())).one()
+    parsed_json = json.loads(UserDetail.model_validate(user).model_dump_json())
+
+    assert set(parsed_json.keys()) == {"id", "username", "email", "logs"}
+    assert set(parsed_json["logs"][0].keys()) == {"id", "user_id", "date"}
+
+
+def test_trusted_matches_validated(db_session, logged_user):
+    log = db_session.scalars(select(DailyLog).options(*DailyLogWithFoods.loader_options())).one()
+
+    assert DailyLogWithFoods.trusted(log).model_dump_json() == DailyLogWithFoods.model_validate(log).model_dump_json()
+    row = db_session.execute(select(FoodEntry.__table__)).first()
+    assert FoodEntrySummary.trusted(row._mapping) == FoodEntrySummary.model_validate(row._mapping)
+
+    db_session.expire(log)
+    with pytest.raises(ValueError, match="unloaded attributes"):
+        DailyLogWithFoods.trusted(log)
+
+# batch validation
+
+def test_validate_many_reports_errors_per_item():
+    items = [
+        {"daily_log_id": 1, "food_id": 1, "quantity": 2},
+        {"daily_log_id": 1, "food_id": 0},
+        "not an entry",
+        {"daily_log_id": 2, "food_id": 3},
+    ]
+    batch = validate_many(FoodEntryCreate, items)
+
+    assert sorted(batch.valid) == [0, 3]
+    assert batch.valid[3] == FoodEntryCreate(daily_log_id=2, food_id=3)
+    assert [(error["loc"], error["type"]) for error in batch.errors[1]] == [(("food_id",), "greater_than")]
+    assert [error["loc"] for error in batch.errors[2]] == [()]
+    assert list_adapter(FoodEntryCreate) is list_adapter(FoodEntryCreate)
+
+    assert validate_many(FoodCreate, []) == ({}, {})
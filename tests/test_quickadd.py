@@ -0,0 +1,162 @@
+import pytest, os, datetime
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.archive import ColdArchive, archive_old_logs
+from nutrition_logger.config import database_url
+from nutrition_logger.meals import log_entries, log_entry
+from nutrition_logger.models import Base, User, Food, DailyLog, FoodEntry, UserFood
+from nutrition_logger.quickadd import HALF_LIFE_DAYS, decayed, quick_add, rebuild_user_foods
+from nutrition_logger.schema import BulkEntryCreate
+
+# Load environment variables
+load_dotenv()
+
+# Construct database URL
+TEST_DB_URL = database_url(database=os.environ.get("POSTGRES_TEST_DB"))
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# create session
+@pytest.fixture(scope="function")
+def postgres_session(engine, tables):
+    connection = engine.connect()
+    transaction = connection.begin()
+    Session = sessionmaker(bind=connection)
+    session = Session()
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+# embedded database, the day arithmetic differs, dropping the tables clears the food cache
+@pytest.fixture(scope="function")
+def sqlite_session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    Base.metadata.drop_all(engine)
+
+@pytest.fixture(params=["postgres", "sqlite"])
+def db_session(request):
+    return request.getfixturevalue(f"{request.param}_session")
+
+TODAY = datetime.date(2024, 6, 1)
+
+def days_ago(days):
+    return TODAY - datetime.timedelta(days=days)
+
+@pytest.fixture(scope="function")
+def seeded(db_session):
+    user = User(username="quick", email="quick@example.com")
+    foods = [Food(name=name, manufacturer="Acme", serving_size=1, unit="piece", calories=100, protein=1, carbs=1, fat=1) for name in ("Oats", "Milk", "Apple")]
+    db_session.add_all([user, *foods])
+    db_session.commit()
+    return user.id, [food.id for food in foods]
+
+def stored(session, user_id):
+    rows = session.scalars(select(UserFood).where(UserFood.user_id == user_id).execution_options(populate_existing=True))
+    return {row.food_id: (row.entry_count, row.score, row.last_date) for row in rows}
+
+# the table kept on every flush must hold what rebuilding it from the entries gives
+def assert_matches_rebuild(session, user_id):
+    kept = stored(session, user_id)
+    rebuild_user_foods(session, user_id)
+    rebuilt = stored(session, user_id)
+    assert kept.keys() == rebuilt.keys()
+    for food_id, (count, score, last_date) in rebuilt.items():
+        assert kept[food_id] == (count, pytest.approx(score), last_date)
+
+def test_old_habits_fade(db_session, seeded):
+    user_id, (oats, milk, apple) = seeded
+    #oats every day four months ago, milk twice this week, an apple today
+    for day in range(120, 130):
+        log_entry(db_session, user_id, oats, 1, days_ago(day))
+    log_entry(db_session, user_id, milk, 1, days_ago(3))
+    log_entry(db_session, user_id, milk, 1, days_ago(1))
+    log_entry(db_session, user_id, apple, 1, TODAY)
+    db_session.commit()
+
+    result = quick_add(db_session, user_id, today=TODAY)
+    assert [food.name for food in result.frequent] == ["Milk", "Apple", "Oats"]
+    assert [food.name for food in result.recent] == ["Apple", "Milk", "Oats"]
+    milk_row = result.frequent[0]
+    assert (milk_row.entry_count, milk_row.last_date) == (2, days_ago(1))
+    assert milk_row.score == pytest.approx(2 ** (-3 / HALF_LIFE_DAYS) + 2 ** (-1 / HALF_LIFE_DAYS))
+    assert result.frequent[1].score == pytest.approx(1)
+    assert [food.name for food in quick_add(db_session, user_id, limit=1, today=TODAY).frequent] == ["Milk"]
+    assert_matches_rebuild(db_session, user_id)
+
+def test_quick_add_is_one_statement(db_session, seeded):
+    user_id, (oats, milk, _) = seeded
+    log_entry(db_session, user_id, oats, 1, TODAY)
+    db_session.commit()
+    statements = []
+    event.listen(db_session.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    result = quick_add(db_session, user_id)
+
+    assert len(statements) == 1
+    assert [food.food_id for food in result.recent] == [oats]
+
+def test_deletes_and_moves(db_session, seeded):
+    user_id, (oats, milk, apple) = seeded
+    entries = [log_entry(db_session, user_id, oats, 1, days_ago(day)) for day in (0, 5, 10)]
+    log_entry(db_session, user_id, milk, 1, days_ago(2))
+    db_session.commit()
+
+    #the latest oats entry goes: one fewer and the last date falls back to the entry before it
+    db_session.delete(entries[0])
+    db_session.commit()
+    assert stored(db_session, user_id)[oats][::2] == (2, days_ago(5))
+
+    #an entry changed to another food moves over, milk's only entry deleted takes milk out
+    entries[1].food_id = apple
+    db_session.delete(db_session.scalars(select(FoodEntry).where(FoodEntry.food_id == milk)).one())
+    db_session.commit()
+    rows = stored(db_session, user_id)
+    assert {food_id: (count, last_date) for food_id, (count, _, last_date) in rows.items()} == {oats: (1, days_ago(10)), apple: (1, days_ago(5))}
+    assert_matches_rebuild(db_session, user_id)
+
+    #deleting a log deletes its entries
+    db_session.delete(db_session.scalars(select(DailyLog).where(DailyLog.date == days_ago(10))).one())
+    db_session.commit()
+    assert set(stored(db_session, user_id)) == {apple}
+
+#archived entries still count, a food whose other entries are all archived keeps its row and falls back to the latest archived date
+def test_delete_with_archived_history(db_session, seeded, tmp_path):
+    user_id, (oats, _, _) = seeded
+    log_entry(db_session, user_id, oats, 1, datetime.date(2020, 1, 5))
+    today = log_entry(db_session, user_id, oats, 1, TODAY)
+    db_session.commit()
+    assert archive_old_logs(db_session, ColdArchive(str(tmp_path)), today=TODAY) == [(2020, 1)]
+
+    db_session.delete(today)
+    db_session.commit()
+    assert stored(db_session, user_id)[oats][::2] == (1, datetime.date(2020, 1, 5))
+    assert quick_add(db_session, user_id, today=TODAY).recent[0].last_date == datetime.date(2020, 1, 5)
+
+def test_bulk_entries(db_session, seeded):
+    user_id, (oats, milk, _) = seeded
+    items = [BulkEntryCreate(user_id=user_id, date=days_ago(day), food_id=food_id) for day in range(7) for food_id in (oats, oats, milk)]
+    log_entries(db_session, items)
+    db_session.commit()
+
+    rows = stored(db_session, user_id)
+    assert (rows[oats][0], rows[milk][0]) == (14, 7)
+    assert decayed(rows[oats][1], TODAY) == pytest.approx(2 * sum(2 ** (-day / HALF_LIFE_DAYS) for day in range(7)))
+    assert_matches_rebuild(db_session, user_id)
@@ -0,0 +1,137 @@
+import pytest, os, datetime
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.models import Base, User, Food, DailyLog, FoodEntry
+from nutrition_logger.rollups import (
+    EntryColumns, DayColumns, entry_columns, stored_day_columns, daily_columns,
+    weekly_averages, monthly_averages, rolling_means, adherence_streaks, user_rollups, to_day, to_date
+)
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+user = os.environ.get("POSTGRES_USER")
+password = os.environ.get("POSTGRES_PW")
+db = os.environ.get("POSTGRES_TEST_DB")
+host = os.environ.get("POSTGRES_HOST", "localhost")
+port = os.environ.get("POSTGRES_PORT", 5432)
+
+# Construct database URL
+TEST_DB_URL = f"postgresql://{user}:{password}@{host}:{port}/{db}"
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# create session
+@pytest.fixture(scope="function")
+def db_session(engine, tables):
+    connection = engine.connect()
+    transaction = connection.begin()
+    Session = sessionmaker(bind=connection)
+    session = Session()
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+MONDAY = to_day(datetime.date(2024, 9, 2))
+
+def make_days(rows):
+    user_id, day, calories = (np.array(column) for column in zip(*rows))
+    zeros = np.zeros(len(rows))
+    return DayColumns(user_id, day, calories.astype(float), zeros, zeros, zeros, np.ones(len(rows), dtype=np.int64))
+
+# testing the vectorized rollups on hand built columns
+
+def test_daily_columns_groups_entries():
+    entries = EntryColumns(
+        np.array([2, 1, 1, 2]), np.array([MONDAY, MONDAY, MONDAY, MONDAY + 1]),
+        np.array([10.0, 20.0, 30.0, 40.0]), np.zeros(4), np.zeros(4), np.zeros(4),
+    )
+    days = daily_columns(entries)
+
+    assert days.user_id.tolist() == [1, 2, 2]
+    assert days.day.tolist() == [MONDAY, MONDAY, MONDAY + 1]
+    assert days.calories.tolist() == [50.0, 10.0, 40.0]
+    assert days.entry_count.tolist() == [2, 1, 1]
+
+def test_weekly_averages():
+    days = make_days([(1, MONDAY, 2000), (1, MONDAY + 6, 1000), (1, MONDAY + 7, 3000), (2, MONDAY + 1, 1500)])
+    weekly = weekly_averages(days)
+
+    assert weekly.user_id.tolist() == [1, 1, 2]
+    assert weekly.period_start.tolist() == [MONDAY, MONDAY + 7, MONDAY]
+    assert weekly.days_logged.tolist() == [2, 1, 1]
+    assert weekly.calories.tolist() == [1500, 3000, 1500]
+
+def test_monthly_averages():
+    end_of_august = MONDAY - 2
+    days = make_days([(1, end_of_august, 1000), (1, MONDAY, 2000), (1, MONDAY + 1, 3000)])
+    monthly = monthly_averages(days)
+
+    assert [to_date(day) for day in monthly.period_start] == [datetime.date(2024, 8, 1), datetime.date(2024, 9, 1)]
+    assert monthly.calories.tolist() == [1000, 2500]
+
+def test_rolling_means_skip_missing_days():
+    days = make_days([(1, MONDAY, 1000), (1, MONDAY + 2, 2000), (1, MONDAY + 9, 4000)])
+    trend = rolling_means(days, window=7)
+
+    assert trend.first_day == MONDAY
+    assert trend.calories.shape == (1, 10)
+    assert trend.calories[0, 0] == 1000
+    assert trend.calories[0, 2] == 1500
+    assert trend.calories[0, 6] == 1500
+    assert trend.calories[0, 7] == 2000
+    assert trend.calories[0, 8] == 2000
+    assert trend.calories[0, 9] == 4000
+
+def test_adherence_streaks():
+    days = make_days(
+        [(1, MONDAY + i, 2000) for i in range(3)] + [(1, MONDAY + 3, 3000)] + [(1, MONDAY + 4 + i, 1950) for i in range(2)]
+        + [(2, MONDAY, 2000)]
+    )
+    streaks = adherence_streaks(days, {1: 2000, 2: 2000}, tolerance=0.1)
+
+    assert streaks.user_id.tolist() == [1, 2]
+    assert streaks.longest.tolist() == [3, 1]
+    assert streaks.current.tolist() == [2, 0]
+
+# testing the columnar loaders against the database
+
+def test_loaders_match(db_session):
+    alice = User(username="alice", email="alice@example.com")
+    banana = Food(name="Banana", manufacturer="Chiquita", serving_size=118, unit="g", calories=105, protein=1.3, carbs=27, fat=0.3)
+    monday = to_date(MONDAY)
+    logs = [DailyLog(user=alice, date=monday + datetime.timedelta(days=i)) for i in range(3)]
+    for i, log in enumerate(logs):
+        log.food_entries = [FoodEntry(food=banana, quantity=i + 1), FoodEntry(food=banana, quantity=1)]
+    db_session.add_all(logs)
+    db_session.commit()
+
+    from_entries = daily_columns(entry_columns(db_session, [alice.id]))
+    stored = stored_day_columns(db_session, [alice.id])
+
+    assert stored.day.tolist() == [MONDAY, MONDAY + 1, MONDAY + 2]
+    assert from_entries.day.tolist() == stored.day.tolist()
+    assert np.allclose(from_entries.calories, stored.calories)
+    assert stored.calories.tolist() == pytest.approx([210, 315, 420])
+
+    rollups = user_rollups(db_session, targets=300.0, start=monday, end=monday + datetime.timedelta(days=6))
+    assert rollups["weekly"].calories.tolist() == pytest.approx([315])
+    assert rollups["rolling_7d"].calories.shape == (1, 7)
+    assert rollups["streaks"].longest.tolist() == [1]
+    assert rollups["streaks"].current.tolist() == [0]
@@ -0,0 +1,140 @@
+import pytest, os
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, select, text, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from nutrition_logger.config import database_url, replica_urls
+from nutrition_logger.models import Base, User
+from nutrition_logger.routing import ReplicaRouter, RoutingSession
+
+# Load environment variables
+load_dotenv()
+
+# two local databases stand in for a primary and its replica
+TEST_DB = os.environ.get("POSTGRES_TEST_DB")
+REPLICA_TEST_DB = os.environ.get("POSTGRES_REPLICA_TEST_DB", f"{TEST_DB}_replica")
+TEST_DB_URL = database_url(database=TEST_DB)
+REPLICA_TEST_DB_URL = database_url(database=REPLICA_TEST_DB)
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+@pytest.fixture(scope="session")
+def replica_engine(engine):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        exists = connection.execute(text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": REPLICA_TEST_DB}).first()
+        if exists is None:
+            connection.execute(text(f'CREATE DATABASE "{REPLICA_TEST_DB}"'))
+    replica = create_engine(REPLICA_TEST_DB_URL, echo=True)
+    yield replica
+    replica.dispose()
+
+# the same tables on both, the replica holds a user the primary does not have
+@pytest.fixture(scope="function")
+def tables(engine, replica_engine):
+    for bind in (engine, replica_engine):
+        Base.metadata.create_all(bind)
+    with replica_engine.begin() as connection:
+        connection.execute(User.__table__.insert().values(username="on-replica", email="replica@example.com"))
+    yield
+    for bind in (engine, replica_engine):
+        Base.metadata.drop_all(bind)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def usernames(session):
+    return session.scalars(select(User.username).order_by(User.username)).all()
+
+def test_replica_urls_from_env(monkeypatch):
+    monkeypatch.setenv("POSTGRES_PORT", "5432")
+    monkeypatch.setenv("POSTGRES_REPLICAS", "replica-a, replica-b:6543/other")
+    urls = replica_urls()
+    assert [url.split("@")[1] for url in urls] == [f"replica-a:5432/{os.environ.get('POSTGRES_DB')}", "replica-b:6543/other"]
+    monkeypatch.setenv("POSTGRES_REPLICAS", "")
+    assert replica_urls() == []
+
+def test_reads_go_to_replica_until_the_session_writes(engine, replica_engine, tables):
+    router = ReplicaRouter(engine, [replica_engine])
+    with RoutingSession(router=router) as session:
+        assert usernames(session) == ["on-replica"]
+        session.add(User(username="on-primary", email="primary@example.com"))
+        session.flush()
+        #read your own writes: the session sticks to the primary
+        assert usernames(session) == ["on-primary"]
+        session.rollback()
+        assert usernames(session) == []
+
+    with RoutingSession(router=router) as session:
+        session.execute(update(User).where(User.id == 0).values(email="nobody@example.com"))
+        assert usernames(session) == []
+
+def test_locking_reads_and_pinned_sessions_use_primary(engine, replica_engine, tables):
+    router = ReplicaRouter(engine, [replica_engine])
+    with RoutingSession(router=router) as session:
+        assert session.scalars(select(User.username).with_for_update()).all() == []
+    with RoutingSession(router=router) as session:
+        session.use_primary()
+        assert usernames(session) == []
+
+def test_without_router_session_uses_its_bind(engine, tables):
+    with RoutingSession(bind=engine) as session:
+        assert usernames(session) == []
+
+def test_failover_to_primary_and_back(engine, replica_engine, tables):
+    clock = FakeClock()
+    down = create_engine(database_url(database=REPLICA_TEST_DB, port="1"))
+    router = ReplicaRouter(engine, [down, replica_engine], check_interval=10, clock=clock)
+
+    #the unreachable replica is found by the first health check and skipped
+    with RoutingSession(router=router) as session:
+        assert [usernames(session) for _ in range(3)] == [["on-replica"]] * 3
+    assert [replica["healthy"] for replica in router.status()] == [False, True]
+
+    #no healthy replica left: reads fall back to the primary
+    router.mark_down(router.replicas[1])
+    with RoutingSession(router=router) as session:
+        assert usernames(session) == []
+
+    #both are checked again once the interval has passed, the one that answers takes reads back
+    clock.now += 10
+    with RoutingSession(router=router) as session:
+        assert usernames(session) == ["on-replica"]
+    assert [replica["failures"] for replica in router.status()] == [1, 1]
+
+#a replica that dies between health checks is taken out by the statement that fails on it
+def test_failed_statement_marks_replica_down(engine, tables):
+    down = create_engine(database_url(database=REPLICA_TEST_DB, port="1"))
+    router = ReplicaRouter(engine, [down])
+    router.replicas[0].checked_at = router.clock()
+    with RoutingSession(router=router) as session:
+        with pytest.raises(OperationalError):
+            usernames(session)
+    assert router.status()[0]["healthy"] is False
+    with RoutingSession(router=router) as session:
+        assert usernames(session) == []
+
+@pytest.mark.anyio
+async def test_async_session_routing(engine, replica_engine, tables):
+    primary = create_async_engine(database_url("asyncpg", TEST_DB))
+    replica = create_async_engine(database_url("asyncpg", REPLICA_TEST_DB))
+    router = ReplicaRouter(primary.sync_engine, [replica.sync_engine])
+    async with AsyncSession(primary, sync_session_class=RoutingSession, router=router) as session:
+        assert (await session.scalars(select(User.username))).all() == ["on-replica"]
+        session.add(User(username="on-primary", email="primary@example.com"))
+        await session.flush()
+        assert (await session.scalars(select(User.username))).all() == ["on-primary"]
+    await primary.dispose()
+    await replica.dispose()
@@ -0,0 +1,159 @@
+import pytest, os
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.models import Base, Food
+from nutrition_logger import search as search_module
+from nutrition_logger.search import FoodSearchIndex, FoodMatch, search_foods
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+user = os.environ.get("POSTGRES_USER")
+password = os.environ.get("POSTGRES_PW")
+db = os.environ.get("POSTGRES_TEST_DB")
+host = os.environ.get("POSTGRES_HOST", "localhost")
+port = os.environ.get("POSTGRES_PORT", 5432)
+
+# Construct database URL
+TEST_DB_URL = f"postgresql://{user}:{password}@{host}:{port}/{db}"
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# create session
+@pytest.fixture(scope="function")
+def db_session(engine, tables):
+    connection = engine.connect()
+    transaction = connection.begin()
+    Session = sessionmaker(bind=connection)
+    session = Session()
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+# embedded database for the in-memory index
+@pytest.fixture(scope="function")
+def sqlite_session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+FOODS = [
+    ("Banana", "Chiquita"),
+    ("Banana Bread", "Homemade"),
+    ("Organic Bananas", "Dole"),
+    ("Bran Flakes", "Kellogg's"),
+    ("Chicken Breast", "Tyson"),
+]
+
+def add_foods(session):
+    session.add_all([Food(name=name, manufacturer=manufacturer, serving_size=1, unit="g", calories=0, protein=0, carbs=0, fat=0) for name, manufacturer in FOODS])
+    session.commit()
+
+def names(matches):
+    return [match.name for match in matches]
+
+@pytest.fixture(params=["postgres", "sqlite", "index"])
+def search(request):
+    if request.param == "postgres":
+        session = request.getfixturevalue("db_session")
+        add_foods(session)
+        return lambda query, limit=10: search_foods(session, query, limit)
+    session = request.getfixturevalue("sqlite_session")
+    add_foods(session)
+    index = FoodSearchIndex().load(session) if request.param == "index" else None
+    return lambda query, limit=10: search_foods(session, query, limit, index=index)
+
+# every backend must agree on matching and ranking
+
+def test_prefix_ranking(search):
+    assert names(search("ban")) == ["Banana", "Banana Bread", "Organic Bananas"]
+
+def test_every_word_must_match(search):
+    assert names(search("banana bre")) == ["Banana Bread"]
+    assert names(search("chiq ban")) == ["Banana"]
+
+def test_manufacturer_and_limit(search):
+    assert names(search("tyson")) == ["Chicken Breast"]
+    assert names(search("br", limit=2)) == ["Bran Flakes", "Banana Bread"]
+
+def test_no_match(search):
+    assert search("zucchini") == []
+    assert search("  ") == []
+
+def test_index_follows_commits(sqlite_session):
+    add_foods(sqlite_session)
+    index = FoodSearchIndex().load(sqlite_session).watch()
+    try:
+        sqlite_session.add(Food(name="Bagel", manufacturer="Thomas", serving_size=1, unit="g", calories=0, protein=0, carbs=0, fat=0))
+        sqlite_session.flush()
+        assert index.search("bag") == []
+        sqlite_session.commit()
+        assert names(index.search("bag")) == ["Bagel"]
+
+        bran = sqlite_session.query(Food).filter_by(name="Bran Flakes").one()
+        bran.name = "Raisin Bran"
+        sqlite_session.delete(sqlite_session.query(Food).filter_by(name="Bagel").one())
+        sqlite_session.commit()
+        assert names(index.search("rai")) == ["Raisin Bran"]
+        assert index.search("bag") == []
+
+        sqlite_session.add(Food(name="Baguette", manufacturer="Paul", serving_size=1, unit="g", calories=0, protein=0, carbs=0, fat=0))
+        sqlite_session.flush()
+        sqlite_session.rollback()
+        assert index.search("bag") == []
+        assert len(index) == len(FOODS)
+    finally:
+        index.unwatch()
+
+def test_index_match_shape(sqlite_session):
+    add_foods(sqlite_session)
+    index = FoodSearchIndex().load(sqlite_session)
+    food = sqlite_session.query(Food).filter_by(name="Banana").one()
+
+    assert index.search("banana chiquita") == [FoodMatch(food.id, "Banana", "Chiquita")]
+
+#busy prefixes read their kept ranking and stop after limit, past it and after writes they must still agree with the scan
+def test_index_ranked_prefixes(sqlite_session, monkeypatch):
+    monkeypatch.setattr(search_module, "TOP_RANKED", 4)
+    monkeypatch.setattr(search_module, "RANK_ON_THE_SPOT", 3)
+    words = ["bar", "bark", "basil", "bean", "beet", "kale"]
+    sqlite_session.add_all([
+        Food(name=f"{words[i % 6]} {words[i * 7 % 5]}{i}", manufacturer=words[i % 4], serving_size=1, unit="g", calories=0, protein=0, carbs=0, fat=0)
+        for i in range(40)
+    ])
+    sqlite_session.commit()
+    index = FoodSearchIndex().load(sqlite_session)
+    assert (search_module.WORDS, "b") in index._top
+    queries = ["b", "ba", "bar b", "b k", "kale be", "be ba", "k"]
+
+    def agree():
+        for query in queries:
+            for limit in (3, 10, 50):
+                assert index.search(query, limit) == search_foods(sqlite_session, query, limit), (query, limit)
+
+    agree()
+    for food in sqlite_session.query(Food).filter(Food.id % 3 == 0):
+        food.name = f"b {food.id}" if food.id % 2 else f"kale {food.name}"
+        index.put(food.id, food.name, food.manufacturer)
+    for food in sqlite_session.query(Food).filter(Food.id % 5 == 0):
+        sqlite_session.delete(food)
+        index.remove(food.id)
+    sqlite_session.commit()
+    agree()
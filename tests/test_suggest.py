@@ -0,0 +1,165 @@
+import pytest, os, datetime
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.config import database_url
+from nutrition_logger.meals import log_entry
+from nutrition_logger.models import Base, User, Food, Target
+from nutrition_logger.suggest import WEIGHTS, NutrientIndex, remaining_macros, suggest_foods
+
+# Load environment variables
+load_dotenv()
+
+# Construct database URL
+TEST_DB_URL = database_url(database=os.environ.get("POSTGRES_TEST_DB"))
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# create session
+@pytest.fixture(scope="function")
+def db_session(engine, tables):
+    connection = engine.connect()
+    transaction = connection.begin()
+    Session = sessionmaker(bind=connection)
+    session = Session()
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+def random_catalog(count, seed=7):
+    rng = np.random.default_rng(seed)
+    macros = np.column_stack((rng.uniform(0, 800, count), rng.uniform(0, 60, count), rng.uniform(0, 120, count), rng.uniform(0, 50, count)))
+    return np.arange(1, count + 1, dtype=np.int64), macros
+
+#the same answer by scanning every food
+def brute_force(ids, macros, remaining, k, fits=False):
+    dimensions = [i for i, value in enumerate(remaining) if value is not None]
+    query = np.maximum([remaining[i] for i in dimensions], 0) * WEIGHTS[dimensions]
+    points = (macros * WEIGHTS)[:, dimensions]
+    distances = ((points - query) ** 2).sum(axis=1)
+    if fits:
+        distances[(points > query).any(axis=1)] = np.inf
+    order = [i for i in np.argsort(distances, kind="stable") if np.isfinite(distances[i])][:k]
+    return [int(ids[i]) for i in order]
+
+QUERIES = [
+    [600, 40, 60, 20],
+    [150, 30, None, None],
+    [None, None, None, 5],
+    [-100, 10, 10, 10],
+    [2000, 200, 300, 100],
+]
+
+@pytest.mark.parametrize("fits", [False, True])
+def test_nearest_matches_brute_force(fits):
+    ids, macros = random_catalog(5_000)
+    index = NutrientIndex(leaf_size=64)
+    index.build(ids, macros * WEIGHTS)
+    for remaining in QUERIES:
+        found = index.nearest(remaining, 10, fits)
+        assert [fit.id for fit in found] == brute_force(ids, macros, remaining, 10, fits)
+        assert [fit.distance for fit in found] == sorted(fit.distance for fit in found)
+
+def test_incremental_updates():
+    ids, macros = random_catalog(2_000)
+    index = NutrientIndex(leaf_size=32)
+    index.build(ids, macros * WEIGHTS)
+    remaining = [500, 30, 50, 15]
+
+    #the nearest food moves away, a new one lands exactly on the query, another is removed
+    nearest = index.nearest(remaining, 3)
+    macros[nearest[0].id - 1] = [800, 0, 0, 50]
+    index.put(nearest[0].id, *macros[nearest[0].id - 1])
+    index.remove(nearest[1].id)
+    index.put(9_999, *remaining)
+    keep = ids != nearest[1].id
+    ids, macros = np.append(ids[keep], 9_999), np.vstack((macros[keep], remaining))
+    assert len(index) == len(ids)
+    assert [fit.id for fit in index.nearest(remaining, 10)] == brute_force(ids, macros, remaining, 10)
+    assert index.nearest(remaining, 1)[0].distance == 0
+
+    #enough changes rebuild the tree with nothing pending
+    for food_id in range(1, 200):
+        macros[food_id - 1] = [food_id, 1, 1, 1]
+        index.put(food_id, food_id, 1, 1, 1)
+    assert len(index.pending) < 199
+    assert len(index) == len(ids)
+    for remaining in QUERIES:
+        assert [fit.id for fit in index.nearest(remaining, 10, True)] == brute_force(ids, macros, remaining, 10, True)
+
+def test_empty_index():
+    index = NutrientIndex()
+    assert index.nearest([500, 30, 50, 15]) == []
+    index.put(1, 100, 1, 1, 1)
+    assert index.nearest([500, 30, 50, 15]) == [(1, pytest.approx(np.sqrt(400**2 + 116**2 + 196**2 + 126**2)))]
+    assert index.nearest([None, None, None, None]) == []
+
+def add_foods(session):
+    foods = [
+        Food(name="Rice", manufacturer="Acme", serving_size=100, unit="g", calories=350, protein=7, carbs=78, fat=1),
+        Food(name="Chicken", manufacturer="Acme", serving_size=100, unit="g", calories=165, protein=31, carbs=0, fat=4),
+        Food(name="Peanuts", manufacturer="Acme", serving_size=100, unit="g", calories=570, protein=26, carbs=16, fat=49),
+    ]
+    session.add_all(foods)
+    session.commit()
+    return foods
+
+def test_suggest_foods(db_session):
+    rice, chicken, peanuts = add_foods(db_session)
+    user = User(username="hungry", email="hungry@example.com")
+    db_session.add(user)
+    db_session.commit()
+    index = NutrientIndex().load(db_session)
+    assert len(index) == 3
+    day = datetime.date(2024, 3, 1)
+
+    assert remaining_macros(db_session, user.id, day) is None
+    assert suggest_foods(db_session, user.id, index, day) == []
+
+    db_session.add(Target(user_id=user.id, calories=1900, protein=150))
+    log_entry(db_session, user.id, rice.id, 4, day)
+    db_session.commit()
+    assert remaining_macros(db_session, user.id, day) == [500, 122, None, None]
+    #peanuts come closest on calories but would go over them
+    assert suggest_foods(db_session, user.id, index, day, fits=False)[0] is peanuts
+    assert suggest_foods(db_session, user.id, index, day) == [rice, chicken]
+
+# committed on purpose (the index follows commits), dropped with the tables
+def test_watch_applies_committed_writes(engine, tables):
+    Session = sessionmaker(bind=engine)
+    index = NutrientIndex().watch()
+    try:
+        with Session() as session:
+            rice, chicken, _ = add_foods(session)
+            rice_id, chicken_id = rice.id, chicken.id
+        assert index.nearest([350, 7, 78, 1], 1)[0].id == rice_id
+
+        with Session() as session:
+            session.get(Food, rice_id).calories = 0
+            session.delete(session.get(Food, chicken_id))
+            session.flush()
+            session.rollback()
+        assert len(index) == 3
+        assert index.nearest([350, 7, 78, 1], 1)[0].id == rice_id
+
+        with Session() as session:
+            session.delete(session.get(Food, chicken_id))
+            session.commit()
+        assert len(index) == 2
+        assert chicken_id not in [fit.id for fit in index.nearest([165, 31, 0, 4], 10)]
+    finally:
+        index.unwatch()
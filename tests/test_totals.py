@@ -0,0 +1,217 @@
+import pytest, os, datetime
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.models import Base, User, Food, DailyLog, FoodEntry, DailyTotals
+from nutrition_logger.totals import (
+    log_totals, logs_totals, daily_totals, users_daily_totals, range_totals,
+    stored_totals, stored_daily_totals, rebuild_daily_totals, TOTAL_COLUMNS
+)
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+user = os.environ.get("POSTGRES_USER")
+password = os.environ.get("POSTGRES_PW")
+db = os.environ.get("POSTGRES_TEST_DB")
+host = os.environ.get("POSTGRES_HOST", "localhost")
+port = os.environ.get("POSTGRES_PORT", 5432)
+
+# Construct database URL
+TEST_DB_URL = f"postgresql://{user}:{password}@{host}:{port}/{db}"
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# create session
+@pytest.fixture(scope="function")
+def db_session(engine, tables):
+    connection = engine.connect()
+    transaction = connection.begin()
+    Session = sessionmaker(bind=connection)
+    session = Session()
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+# two users, two foods and three days of logs, the last day left empty
+@pytest.fixture(scope="function")
+def seeded(db_session):
+    today = datetime.date(2024, 9, 10)
+    alice = User(username="alice", email="alice@example.com")
+    bob = User(username="bob", email="bob@example.com")
+    banana = Food(name="Banana", manufacturer="Chiquita", serving_size=118, unit="g", calories=105, protein=1.3, carbs=27, fat=0.3)
+    oats = Food(name="Oats", manufacturer="Quaker", serving_size=40, unit="g", calories=150, protein=5, carbs=27, fat=3)
+    db_session.add_all([alice, bob, banana, oats])
+    db_session.flush()
+
+    day1 = DailyLog(user=alice, date=today - datetime.timedelta(days=2))
+    day1.food_entries = [FoodEntry(food=banana, quantity=2), FoodEntry(food=oats, quantity=1)]
+    day2 = DailyLog(user=alice, date=today - datetime.timedelta(days=1))
+    day2.food_entries = [FoodEntry(food=oats, quantity=0.5)]
+    day3 = DailyLog(user=alice, date=today)
+    bob_day = DailyLog(user=bob, date=today)
+    bob_day.food_entries = [FoodEntry(food=banana, quantity=1)]
+    db_session.add_all([day1, day2, day3, bob_day])
+    db_session.commit()
+    return {"alice": alice, "bob": bob, "days": [day1, day2, day3], "bob_day": bob_day, "today": today}
+
+def count_queries(session):
+    statements = []
+    event.listen(session.bind, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+def test_log_totals(db_session, seeded):
+    totals = log_totals(db_session, seeded["days"][0].id)
+
+    assert totals.calories == pytest.approx(2 * 105 + 150)
+    assert totals.protein == pytest.approx(2 * 1.3 + 5)
+    assert totals.carbs == pytest.approx(2 * 27 + 27)
+    assert totals.fat == pytest.approx(2 * 0.3 + 3)
+    assert totals.entry_count == 2
+
+def test_log_totals_empty_and_missing(db_session, seeded):
+    empty = log_totals(db_session, seeded["days"][2].id)
+
+    assert empty.calories == 0
+    assert empty.entry_count == 0
+    assert log_totals(db_session, 9999) is None
+
+def test_logs_totals_single_query(db_session, seeded):
+    ids = [log.id for log in seeded["days"]]
+    statements = count_queries(db_session)
+
+    rows = logs_totals(db_session, ids)
+
+    assert len(statements) == 1
+    assert [row.daily_log_id for row in rows] == ids
+    assert [row.entry_count for row in rows] == [2, 1, 0]
+
+def test_daily_totals_date_range(db_session, seeded):
+    today = seeded["today"]
+    rows = daily_totals(db_session, seeded["alice"].id, start=today - datetime.timedelta(days=1), end=today)
+
+    assert [row.date for row in rows] == [today - datetime.timedelta(days=1), today]
+    assert rows[0].calories == pytest.approx(75)
+
+def test_users_daily_totals(db_session, seeded):
+    rows = users_daily_totals(db_session, [seeded["alice"].id, seeded["bob"].id], start=seeded["today"])
+
+    assert [(row.user_id, row.calories) for row in rows] == [(seeded["alice"].id, 0), (seeded["bob"].id, 105)]
+
+def test_range_totals(db_session, seeded):
+    totals = range_totals(db_session, seeded["alice"].id)
+
+    assert totals.days == 3
+    assert totals.entry_count == 3
+    assert totals.calories == pytest.approx(2 * 105 + 150 + 75)
+
+# stored totals must always match what the aggregate query computes
+def assert_stored_matches(session, *logs):
+    for log in logs:
+        stored = stored_totals(session, log.id)
+        computed = log_totals(session, log.id)
+        for column in TOTAL_COLUMNS:
+            assert getattr(stored, column) == pytest.approx(getattr(computed, column))
+
+def test_stored_totals_after_inserts(db_session, seeded):
+    assert_stored_matches(db_session, *seeded["days"], seeded["bob_day"])
+    assert stored_totals(db_session, seeded["days"][2].id).entry_count == 0
+
+def test_stored_totals_single_lookup(db_session, seeded):
+    log_id = seeded["days"][0].id
+    statements = count_queries(db_session)
+
+    totals = stored_totals(db_session, log_id)
+
+    assert len(statements) == 1
+    assert totals.calories == pytest.approx(360)
+
+def test_stored_totals_quantity_change_and_delete(db_session, seeded):
+    day1 = seeded["days"][0]
+    day1.food_entries[0].quantity = 3
+    db_session.commit()
+    assert_stored_matches(db_session, day1)
+
+    db_session.delete(day1.food_entries[1])
+    db_session.commit()
+    assert_stored_matches(db_session, day1)
+    assert stored_totals(db_session, day1.id).entry_count == 1
+
+def test_stored_totals_move_entry(db_session, seeded):
+    day1, day2, day3 = seeded["days"]
+    entry = day1.food_entries[0]
+    entry.daily_log_id = day3.id
+    db_session.commit()
+
+    assert_stored_matches(db_session, day1, day2, day3)
+
+def test_stored_totals_food_macro_edit(db_session, seeded):
+    banana = db_session.query(Food).filter_by(name="Banana").first()
+    banana.calories = 120
+    banana.protein = 2
+    db_session.commit()
+
+    assert_stored_matches(db_session, *seeded["days"], seeded["bob_day"])
+
+def test_stored_totals_food_edit_with_entry_changes_in_one_flush(db_session, seeded):
+    day1, day2, day3 = seeded["days"]
+    banana = db_session.query(Food).filter_by(name="Banana").first()
+    banana.calories = 90
+    day3.food_entries.append(FoodEntry(food=banana))
+    db_session.delete(seeded["bob_day"].food_entries[0])
+    day1.food_entries[0].quantity = 1
+    db_session.commit()
+
+    assert_stored_matches(db_session, day1, day2, day3, seeded["bob_day"])
+
+def versions(session, *logs):
+    return [session.scalar(select(DailyLog.version).where(DailyLog.id == log.id)) for log in logs]
+
+def test_log_versions(db_session, seeded):
+    day1, day2, day3 = seeded["days"]
+    bob_day = seeded["bob_day"]
+    assert versions(db_session, day1, day2, day3, bob_day) == [1, 1, 1, 1]
+
+    #entry changes bump only their own logs, loaded logs see the new version without a refresh
+    day1.food_entries[0].quantity = 3
+    day3.food_entries.append(FoodEntry(food_id=day1.food_entries[1].food_id))
+    db_session.flush()
+    assert (day1.version, day3.version) == (2, 2)
+    db_session.delete(day3.food_entries[0])
+    db_session.commit()
+    assert versions(db_session, day1, day2, day3, bob_day) == [2, 1, 3, 1]
+
+    #a food shown in a log changes the log, even when its macros do not
+    banana = db_session.query(Food).filter_by(name="Banana").first()
+    banana.name = "Cavendish banana"
+    db_session.commit()
+    assert versions(db_session, day1, day2, day3, bob_day) == [3, 1, 3, 2]
+
+def test_stored_daily_totals(db_session, seeded):
+    rows = stored_daily_totals(db_session, seeded["alice"].id)
+    computed = daily_totals(db_session, seeded["alice"].id)
+
+    assert [(row.date, row.entry_count) for row in rows] == [(row.date, row.entry_count) for row in computed]
+
+def test_rebuild_daily_totals(db_session, seeded):
+    db_session.query(DailyTotals).delete()
+    db_session.commit()
+
+    assert rebuild_daily_totals(db_session, seeded["alice"].id) == 3
+    assert stored_totals(db_session, seeded["bob_day"].id) is None
+    assert rebuild_daily_totals(db_session) == 4
+    assert_stored_matches(db_session, *seeded["days"], seeded["bob_day"])
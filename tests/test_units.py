@@ -0,0 +1,77 @@
+import pytest, os
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.config import database_url
+from nutrition_logger.models import Base, Food
+from nutrition_logger.units import UNITS
+
+# Load environment variables
+load_dotenv()
+
+# Construct database URL
+TEST_DB_URL = database_url(database=os.environ.get("POSTGRES_TEST_DB"))
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# create session
+@pytest.fixture(scope="function")
+def db_session(engine, tables):
+    connection = engine.connect()
+    transaction = connection.begin()
+    Session = sessionmaker(bind=connection)
+    session = Session()
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+def test_orm_writes_are_normalized(db_session):
+    food = Food(name="Milk", manufacturer="Acme", serving_size=1, unit="cup", calories=120, protein=8, carbs=12, fat=4.8)
+    db_session.add(food)
+    db_session.flush()
+    assert (food.base_unit, food.base_amount) == ("ml", 240)
+    assert (food.calories_per_100, food.protein_per_100, food.fat_per_100) == pytest.approx((50, 3.333, 2), rel=1e-3)
+
+    food.unit = "l"
+    db_session.flush()
+    assert (food.base_unit, food.base_amount, food.calories_per_100) == ("ml", 1000, 12)
+
+#every unit in the table converts as the table says, including writes that bypass the ORM
+def test_sql_matches_table(db_session):
+    rows = [
+        dict(name=f"food {unit}", manufacturer="Acme", serving_size=2.5, unit=unit.upper(), calories=100, protein=10, carbs=20, fat=5)
+        for unit in [*UNITS, "slice"]
+    ]
+    db_session.execute(Food.__table__.insert(), rows)
+    stored = db_session.execute(select(Food.unit, Food.base_unit, Food.base_amount, Food.calories_per_100)).all()
+    assert len(stored) == len(rows)
+    for unit, base_unit, base_amount, calories in stored:
+        expected_unit, factor = UNITS.get(unit.lower(), (unit.lower(), 1.0))
+        assert (base_unit, base_amount) == (expected_unit, pytest.approx(2.5 * factor))
+        assert calories == pytest.approx(100 * 100 / (2.5 * factor))
+
+#per-100 values make foods logged in different units comparable: same food, different labels
+def test_units_compare(db_session):
+    db_session.add_all([
+        Food(name="Oats g", manufacturer="Acme", serving_size=40, unit="g", calories=150, protein=5, carbs=27, fat=3),
+        Food(name="Oats oz", manufacturer="Acme", serving_size=1, unit="oz", calories=150 * 28.349523125 / 40, protein=0, carbs=0, fat=0),
+    ])
+    db_session.flush()
+    per_100 = db_session.scalars(select(Food.calories_per_100).order_by(Food.name)).all()
+    assert per_100 == pytest.approx([375, 375])
+
+    db_session.execute(update(Food).where(Food.name == "Oats g").values(serving_size=0.04, unit="kg"))
+    assert db_session.scalar(select(Food.calories_per_100).where(Food.name == "Oats g")) == pytest.approx(375)
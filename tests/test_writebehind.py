@@ -0,0 +1,150 @@
+import pytest, asyncio, os, queue, threading, time, datetime
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.orm import sessionmaker
+
+from nutrition_logger.config import database_url, write_behind_options
+from nutrition_logger.models import Base, User, Food, FoodEntry, DailyTotals
+from nutrition_logger.schema import BulkEntryCreate
+from nutrition_logger.writebehind import EntryWriter
+
+# Load environment variables
+load_dotenv()
+
+# Construct database URL
+TEST_DB_URL = database_url(database=os.environ.get("POSTGRES_TEST_DB"))
+
+# connect to database
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(TEST_DB_URL, echo=True)
+    yield engine
+
+# construct engine
+@pytest.fixture(scope="function")
+def tables(engine):
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+# the writer commits in sessions of its own, so the data is committed too and dropped with the tables
+@pytest.fixture(scope="function")
+def Session(engine, tables):
+    return sessionmaker(bind=engine)
+
+@pytest.fixture(scope="function")
+def seeded(Session):
+    with Session() as session:
+        user = User(username="writer", email="writer@example.com")
+        food = Food(name="Oats", manufacturer="Acme", serving_size=40, unit="g", calories=150, protein=5, carbs=27, fat=3)
+        session.add_all([user, food])
+        session.commit()
+        return user.id, food.id
+
+def count_commits(engine):
+    commits = []
+    event.listen(engine, "commit", lambda connection: commits.append(1))
+    return commits
+
+DAY = datetime.date(2024, 3, 1)
+
+def test_write_behind_options_from_env(monkeypatch):
+    monkeypatch.setenv("ENTRY_WRITE_BEHIND", "false")
+    assert write_behind_options() is None
+    monkeypatch.setenv("ENTRY_WRITE_BEHIND", "true")
+    monkeypatch.setenv("ENTRY_BATCH_DELAY_MS", "20")
+    monkeypatch.setenv("ENTRY_BATCH_SIZE", "100")
+    assert write_behind_options() == {"max_batch": 100, "max_delay": 0.02, "maxsize": 10_000}
+
+def test_entries_are_written_in_batches(engine, Session, seeded):
+    user_id, food_id = seeded
+    commits = count_commits(engine)
+    writer = EntryWriter(Session, max_batch=100, max_delay=0.5)
+    futures = [
+        writer.submit(BulkEntryCreate(user_id=user_id, date=DAY + datetime.timedelta(days=i % 3), food_id=food_id, quantity=1 + i % 2))
+        for i in range(450)
+    ]
+    rows = [future.result(timeout=10) for future in futures]
+    writer.close()
+
+    #a future resolves to its own committed row
+    assert [(row.food_id, row.quantity) for row in rows] == [(food_id, 1 + i % 2) for i in range(450)]
+    assert writer.stats()["batches"] == len(commits) == 5
+    with Session() as session:
+        assert session.scalar(select(func.count(FoodEntry.id))) == 450
+        assert session.scalar(select(func.sum(DailyTotals.entry_count))) == 450
+
+def test_failed_entry_does_not_fail_its_batch(Session, seeded):
+    user_id, food_id = seeded
+    writer = EntryWriter(Session, max_batch=10, max_delay=0.5)
+    good = [writer.submit(BulkEntryCreate(user_id=user_id, date=DAY, food_id=food_id)) for _ in range(3)]
+    bad = writer.submit(BulkEntryCreate(user_id=user_id, date=DAY, food_id=food_id + 1))
+    writer.close()
+
+    assert all(future.result().id for future in good)
+    with pytest.raises(ValueError, match="unknown food ids"):
+        bad.result()
+    assert writer.stats()["failed"] == 1
+
+def test_full_queue_applies_backpressure(Session, seeded):
+    user_id, food_id = seeded
+    gate = threading.Event()
+
+    def blocked_session():
+        gate.wait()
+        return Session()
+
+    writer = EntryWriter(blocked_session, max_batch=1, max_delay=0.01, maxsize=2)
+    item = BulkEntryCreate(user_id=user_id, date=DAY, food_id=food_id)
+    #one entry in the writer's hands, two waiting, the fourth has no room
+    futures = [writer.submit(item)]
+    while writer.stats()["queued"]:
+        time.sleep(0.01)
+    futures += [writer.submit(item) for _ in range(2)]
+    with pytest.raises(queue.Full):
+        writer.submit(item, timeout=0.1)
+
+    gate.set()
+    writer.close()
+    assert all(future.done() and future.result() for future in futures)
+
+#a durable request that goes away cancels its future (asyncio.wrap_future), the writer skips that entry and goes on
+def test_cancelled_entry_is_skipped(Session, seeded):
+    user_id, food_id = seeded
+    gate = threading.Event()
+
+    def blocked_session():
+        gate.wait()
+        return Session()
+
+    writer = EntryWriter(blocked_session, max_batch=1, max_delay=0.01)
+    item = BulkEntryCreate(user_id=user_id, date=DAY, food_id=food_id)
+    first = writer.submit(item)
+    while writer.stats()["queued"]:
+        time.sleep(0.01)
+    dropped = writer.submit(item)
+
+    async def request():
+        await asyncio.wait_for(asyncio.wrap_future(dropped), 0.01)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(request())
+    assert dropped.cancelled()
+
+    gate.set()
+    later = [writer.submit(item) for _ in range(3)]
+    writer.close(timeout=10)
+    assert all(future.result(timeout=0).id for future in [first, *later])
+    with Session() as session:
+        assert session.scalar(select(func.count(FoodEntry.id))) == 4
+
+def test_close_drains_queue(Session, seeded):
+    user_id, food_id = seeded
+    #would otherwise wait a minute for the batch to fill
+    writer = EntryWriter(Session, max_batch=1000, max_delay=60)
+    futures = [writer.submit(BulkEntryCreate(user_id=user_id, date=DAY, food_id=food_id)) for _ in range(20)]
+    writer.close(timeout=10)
+
+    assert all(future.done() for future in futures)
+    with pytest.raises(RuntimeError):
+        writer.submit(BulkEntryCreate(user_id=user_id, date=DAY, food_id=food_id))